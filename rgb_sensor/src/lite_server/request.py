@@ -1,16 +1,40 @@
 import ujson
+import uasyncio as asyncio
+
+# Request line plus headers must fit in the per-connection buffer
+MAX_HEADER_BYTES = 1024
+MAX_HEADER_COUNT = 24
+MAX_BODY_BYTES = 8192
+
+CR = 13
+LF = 10
+COLON = 58
+SPACE = 32
+
+class RequestError(Exception):
+    """A request the server refuses to parse; status is the HTTP status to answer with"""
+    def __init__(self, status, msg):
+        super().__init__(msg)
+        self.status = status
 
 class Request():
-    def __init__(self, conn):
-        self._conn = conn
-
-        self._method = None
-        self._uri = None
-        self._version = None
-        self._header = {}
-        self._body = None
-        self._build_from_conn(conn)
-    
+    def __init__(self, method, uri, version, header, body=None):
+        self._method = method
+        self._uri = uri
+        self._version = version
+        self._header = header
+        self._body = body
+        # Pattern and path parameters of the matched route, set by the server
+        self.route = None
+        self.params = {}
+
+        self._path, _, query_string = uri.partition('?')
+        self._query = {}
+        for parameter in query_string.split('&'):
+            if parameter:
+                key, _, value = parameter.partition('=')
+                self._query[key] = value
+
     @property
     def method(self):
         return self._method
@@ -19,6 +43,16 @@ class Request():
     def uri(self):
         return self._uri
 
+    @property
+    def path(self):
+        """The uri without its query string"""
+        return self._path
+
+    @property
+    def query(self):
+        """Query string parameters as a dict of strings"""
+        return self._query
+
     @property
     def version(self):
         return self._version
@@ -31,48 +65,173 @@ class Request():
     def body(self):
         return self._body
 
-    def _build_from_conn(self, conn):
-        recv_file = conn.makefile('rwb', 0)
-        header_lines = []
-        while True:
-            line = recv_file.readline()
-            # A single blank line seperates the Request header from the body
-            if not line or line == b'\r\n':
-                break
-            else:
-                header_lines.append(line)
-        
-        self._parse_header(header_lines)
-        self._parse_body()
+    def get_header(self, name, default=None):
+        """Header lookup by case-insensitive name"""
+        return self._header.get(name.lower(), default)
 
+    @property
+    def keep_alive(self):
+        """HTTP/1.1 connections persist unless the client asks to close;
+        HTTP/1.0 ones only when the client asks to keep them alive.
+        """
+        connection = self.get_header('Connection', '').lower()
+        if self._version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
 
-    def _parse_header(self, header_lines):
-        request_line = str(header_lines.pop(0))[2:-5]
-        print('request', request_line)
-        stripped_request = request_line.strip()
-        method, uri, version = stripped_request.split(' ')
 
-        self._method = method
-        self._uri = uri
-        self._version = version
-        
-        for option in header_lines:
-            header_key, header_value = str(option)[2:-5].split(': ')
-            if header_key == 'Content-Lenght':
-                header_value = int(header_value)
-            self.header[header_key] = header_value
-        
-    def _parse_body(self):
-        if 'Content-Length' in self._header:
-            data = []
-            contentLength = self._header['Content-Length']
-            while contentLength > 0:
-                getsize = 1024
-                if contentLength < getsize:
-                    getsize = contentLength
-                data.append(self._conn.recv(getsize))
-            
-            if self._header['Content-Type'] == 'application/json':
-                self._body = ujson.loads("".join(data))
+class RequestReader():
+    """Parses the requests of one connection.
+
+    Bytes are read with readinto into a single buffer allocated per
+    connection; the header block is located and split in place, so the only
+    allocations per request are the strings that end up in the Request and
+    the body itself. Bytes past the end of a request stay in the buffer for
+    the next (pipelined) one.
+    """
+    def __init__(self, reader, buffer_size=MAX_HEADER_BYTES):
+        self._reader = reader
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    async def _readinto(self, view):
+        if hasattr(self._reader, 'readinto'):
+            return await self._reader.readinto(view)
+        # CPython's StreamReader has no readinto
+        data = await self._reader.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    async def _fill(self):
+        """Reads more bytes after the buffered ones. Returns 0 at end of stream."""
+        if self._start:
+            # Move the unconsumed bytes to the front to make room
+            pending = self._end - self._start
+            self._buffer[:pending] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        if self._end == len(self._buffer):
+            raise RequestError(431, "Request header larger than {} bytes".format(len(self._buffer)))
+        count = await self._readinto(self._view[self._end:])
+        self._end += count
+        return count
+
+    def _find_header_end(self, scan_from):
+        """Returns the index just past the blank line ending the header, or -1"""
+        buf = self._buffer
+        for i in range(max(self._start + 3, scan_from), self._end):
+            if buf[i] == LF and buf[i - 1] == CR and buf[i - 2] == LF and buf[i - 3] == CR:
+                return i + 1
+        return -1
+
+    async def read_request(self, idle_timeout=None, header_timeout=None):
+        """Returns the next Request on the connection, or None if the client
+        closed it, or sent nothing within idle_timeout seconds. Once the
+        first byte is in, the whole header must follow within
+        header_timeout seconds. Raises RequestError for requests that are
+        malformed, over the limits or too slow.
+        """
+        if self._start == self._end:
+            try:
+                if not await asyncio.wait_for(self._fill(), idle_timeout):
+                    return None
+            except asyncio.TimeoutError:
+                return None
+
+        try:
+            header_end = await asyncio.wait_for(self._read_header(), header_timeout)
+        except asyncio.TimeoutError:
+            raise RequestError(408, "Request header not complete within {} s".format(header_timeout))
+        if header_end < 0:
+            return None
+
+        method, uri, version, header = self._parse_header(self._start, header_end)
+        self._start = header_end
+        body = await self._read_body(header)
+        return Request(method, uri, version, header, body)
+
+    async def _read_header(self):
+        """Reads until the blank line ending the header and returns the
+        index just past it, or -1 if the client closed the connection first
+        """
+        header_end = self._find_header_end(self._start)
+        while header_end < 0:
+            scanned = self._end - self._start
+            if not await self._fill():
+                return -1
+            header_end = self._find_header_end(self._start + scanned)
+        return header_end
+
+    def _parse_header(self, start, end):
+        try:
+            return self._parse_header_lines(start, end)
+        except UnicodeError:
+            raise RequestError(400, "Header is not ASCII")
+
+    def _parse_header_lines(self, start, end):
+        buf = self._buffer
+        view = self._view
+        method = uri = version = None
+        header = {}
+        line_start = start
+        for i in range(start, end - 2):
+            if buf[i] != LF:
+                continue
+            line_end = i - 1 if buf[i - 1] == CR else i
+            if method is None:
+                request_line = str(view[line_start:line_end], 'ascii').split(' ')
+                if len(request_line) != 3:
+                    raise RequestError(400, "Malformed request line")
+                method, uri, version = request_line
+                print('request', method, uri)
             else:
-                self._body = "".join(data)
\ No newline at end of file
+                if len(header) >= MAX_HEADER_COUNT:
+                    raise RequestError(431, "More than {} headers".format(MAX_HEADER_COUNT))
+                colon = line_start
+                while colon < line_end and buf[colon] != COLON:
+                    colon += 1
+                if colon == line_end:
+                    raise RequestError(400, "Malformed header line")
+                value_start = colon + 1
+                while value_start < line_end and buf[value_start] == SPACE:
+                    value_start += 1
+                header_key = str(view[line_start:colon], 'ascii').lower()
+                header_value = str(view[value_start:line_end], 'ascii')
+                if header_key == 'content-length':
+                    # int() would take signs, spaces and underscores
+                    if not header_value or not header_value.isdigit():
+                        raise RequestError(400, "Invalid Content-Length")
+                    header_value = int(header_value)
+                header[header_key] = header_value
+            line_start = i + 1
+        if method is None:
+            raise RequestError(400, "Missing request line")
+        return method, uri, version, header
+
+    async def _read_body(self, header):
+        content_length = header.get('content-length', 0)
+        if not content_length:
+            return None
+        if content_length > MAX_BODY_BYTES:
+            raise RequestError(413, "Body larger than {} bytes".format(MAX_BODY_BYTES))
+
+        body = bytearray(content_length)
+        body_view = memoryview(body)
+        # Part of the body may already be buffered behind the header
+        received = min(content_length, self._end - self._start)
+        body[:received] = self._view[self._start:self._start + received]
+        self._start += received
+        while received < content_length:
+            count = await self._readinto(body_view[received:])
+            if not count:
+                raise RequestError(400, "Connection closed inside the body")
+            received += count
+
+        if header.get('content-type') == 'application/json':
+            try:
+                return ujson.loads(bytes(body))
+            except ValueError:
+                raise RequestError(400, "Malformed JSON body")
+        return body
@@ -1,50 +1,199 @@
 import ujson
 
+# Size of the per-connection buffer the status line and headers are built in
+HEAD_BUFFER_SIZE = 512
+# Largest piece of body handed to the stream before waiting for it to drain
+WRITE_CHUNK_SIZE = 1024
+
+CRLF = b"\r\n"
+LAST_CHUNK = b"0\r\n\r\n"
+
 def content_type_header(content_type):
     return "Content-Type: {}".format(content_type)
 
+def is_iterator(body):
+    """Generators and other iterators are streamed; lists and dicts are JSON"""
+    return hasattr(body, '__next__')
+
 STATUS_CODE_MAP = {
     '200': 'OK',
     '201': 'Created',
     '202': 'Accepted',
     '204': 'No Content',
+    '304': 'Not Modified',
     '400': 'Bad Request',
+    '404': 'Not Found',
+    '408': 'Request Timeout',
+    '413': 'Payload Too Large',
+    '431': 'Request Header Fields Too Large',
     '500': 'Internal Server Error',
 }
 
 class Response:
-    def __init__(self, conn):
-        self._conn = conn
+    def __init__(self, writer, head_buffer=None):
+        self._writer = writer
+        self._head_buffer = head_buffer
         self.version = 1.1
         self._status = None
         self._status_txt = None
         self._headers = []
         self._body = None
+        self._content_length = None
+        self.content_type = None
 
         self.body_set = False
-    
+        self.sent = False
+        self.keep_alive = False
+        # Cleared for HTTP/1.0 clients, which do not understand chunked bodies
+        self.chunked = True
+
     @property
     def status_set(self):
-        return self._status is not None 
-    
+        return self._status is not None
+
+    @property
+    def status_code(self):
+        return self._status
+
+    @property
+    def streamed(self):
+        return is_iterator(self._body)
+
+    def encoded_body(self):
+        """The fixed body as bytes (or a bytes-like object)"""
+        body = self._body
+        if body is None:
+            return b''
+        if isinstance(body, str):
+            body = self._body = body.encode()
+        return body
+
     def send(self):
-        self._conn.send(str(self))
-        self._conn.close()
-    
+        """Queues the response on the stream; the server flushes it once
+        the handler returns. Use flush() to push it out earlier. Streamed
+        bodies can only be sent with send_all().
+        """
+        if self.streamed:
+            raise RuntimeError("A streamed body must be sent with send_all()")
+        body = self.encoded_body()
+        self._write_head(len(body))
+        if body:
+            self._writer.write(body)
+        self.sent = True
+
+    async def send_all(self):
+        """Writes the response and waits until the stream has taken all of
+        it. The body goes out in pieces of at most WRITE_CHUNK_SIZE bytes,
+        each drained before the next, so it is never copied whole into the
+        stream's buffer.
+        """
+        if self.streamed:
+            await self._send_stream()
+        else:
+            body = self.encoded_body()
+            self._write_head(len(body))
+            self.sent = True
+            view = memoryview(body)
+            for start in range(0, len(body), WRITE_CHUNK_SIZE):
+                self._writer.write(view[start:start + WRITE_CHUNK_SIZE])
+                await self._writer.drain()
+        await self._writer.drain()
+
+    async def _send_stream(self):
+        """Sends an iterator body: with Content-Length when its length was
+        given, chunked otherwise, or delimited by closing the connection for
+        clients that can not take chunks.
+        """
+        writer = self._writer
+        length = self._content_length
+        chunked = length is None and self.chunked
+        if length is None and not chunked:
+            self.keep_alive = False
+        self._write_head(length, chunked)
+        self.sent = True
+
+        written = 0
+        try:
+            for data in self._body:
+                if isinstance(data, str):
+                    data = data.encode()
+                if not data:
+                    # An empty chunk would end a chunked body
+                    continue
+                if chunked:
+                    writer.write("{:x}\r\n".format(len(data)).encode())
+                    writer.write(data)
+                    writer.write(CRLF)
+                else:
+                    writer.write(data)
+                written += len(data)
+                await writer.drain()
+        finally:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        if chunked:
+            writer.write(LAST_CHUNK)
+        elif length is not None and written != length:
+            # The client can only tell the body is incomplete if we hang up
+            print("Streamed body was {} bytes, not the declared {}".format(written, length))
+            self.keep_alive = False
+
+    async def flush(self):
+        await self._writer.drain()
+
+    def start_stream(self, content_type):
+        """Sends the head of a response whose body is written incrementally
+        with write() and ends when the connection closes.
+        """
+        if not self.status_set:
+            self.set_status(200)
+        self.keep_alive = False
+        self._set_content_type(content_type)
+        self._write_head(None)
+        self.body_set = True
+        self.sent = True
+        return self
+
+    def write(self, data):
+        """Queues part of a streamed body (see start_stream)"""
+        if isinstance(data, str):
+            data = data.encode()
+        self._writer.write(data)
+
+    def _set_content_type(self, content_type):
+        self.content_type = content_type
+        self.add_header(content_type_header(content_type))
+
     def add_header(self, header_txt):
         self._headers.append(header_txt)
         return self
-    
-    def set_body(self, body):
+
+    def set_body(self, body, content_type=None, content_length=None):
+        """Sets the body: bytes-like objects are sent as they are, str as
+        text, iterators (generators included) are streamed piece by piece and
+        anything else is sent as JSON. content_length is only needed for
+        iterators, whose length is otherwise unknown and which are then sent
+        chunked.
+
+        A handler that streams has to call set_body itself; a generator
+        returned from a handler is taken for a coroutine.
+        """
         self.body_set = True
         if body is None:
             return self
-        if isinstance(body, str):
+        if isinstance(body, (bytes, bytearray, memoryview)) or is_iterator(body):
             self._body = body
-            self.add_header(content_type_header("text/html"))
+            self._content_length = content_length
+            self._set_content_type(content_type or "application/octet-stream")
+        elif content_type is not None:
+            self._body = body if isinstance(body, str) else ujson.dumps(body)
+            self._set_content_type(content_type)
+        elif isinstance(body, str):
+            self._body = body
+            self._set_content_type("text/html")
         else:
             self._body = ujson.dumps(body)
-            self.add_header(content_type_header("application/json"))
+            self._set_content_type("application/json")
         return self
 
     def set_status(self, status_code, status_msg=None):
@@ -60,7 +209,53 @@ class Response:
     @property
     def header(self):
         return "\r\n".join(self._headers)
-    
+
+    def head_lines(self, content_length, chunked=False):
+        """Status line and headers, including the framing headers. A
+        content_length of None is for bodies that are chunked or delimited
+        by closing the connection.
+        """
+        lines = [self.status_line]
+        lines.extend(self._headers)
+        # 204 and 304 responses never have a body to frame
+        framed = self._status not in (204, 304)
+        if framed and content_length is not None:
+            lines.append("Content-Length: {}".format(content_length))
+        elif framed and chunked:
+            lines.append("Transfer-Encoding: chunked")
+        lines.append("Connection: keep-alive" if self.keep_alive else "Connection: close")
+        return lines
+
+    def head(self, content_length, chunked=False):
+        """The head as one string, up to and including the blank line that
+        precedes the body
+        """
+        lines = self.head_lines(content_length, chunked)
+        lines.append("\r\n")
+        return "\r\n".join(lines)
+
+    def _write_head(self, content_length, chunked=False):
+        """Queues the head, assembled in the connection's head buffer when
+        it fits. uasyncio's stream copies what it is given, so the buffer is
+        free again as soon as write() returns.
+        """
+        buf = self._head_buffer
+        if buf is None:
+            self._writer.write(self.head(content_length, chunked).encode())
+            return
+        end = 0
+        for line in self.head_lines(content_length, chunked):
+            data = line.encode()
+            start = end
+            end = start + len(data) + 2
+            if end + 2 > len(buf):
+                self._writer.write(self.head(content_length, chunked).encode())
+                return
+            buf[start:end - 2] = data
+            buf[end - 2:end] = CRLF
+        buf[end:end + 2] = CRLF
+        self._writer.write(memoryview(buf)[:end + 2])
+
     @property
     def status(self):
         return "{} {}".format(self._status, self._status_txt)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Encoded GET responses, reused until the data behind them changes.
+
+@author: jcron
+"""
+import os
+
+MAX_CACHE_ENTRIES = 16
+
+# Versions start over on every boot; the nonce keeps an ETag from before a
+# reboot from matching data of the same version after it
+BOOT_NONCE = ''.join('{:02x}'.format(byte) for byte in os.urandom(4))
+
+
+def make_etag(version):
+    """Strong ETag for a version of this boot: an int, or a tuple of ints"""
+    if isinstance(version, tuple):
+        return '"{}-{}"'.format(BOOT_NONCE, '-'.join('{:x}'.format(part) for part in version))
+    return '"{}-{:x}"'.format(BOOT_NONCE, version)
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == etag or candidate == '*' or candidate == 'W/' + etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """Keeps the encoded body of each cached URI with the version it was
+    built from, e.g. a sample sequence number or a configuration version.
+
+    A request whose route reports the same version again is answered from
+    the cache without calling the handler, or with 304 Not Modified when
+    the client already holds that version. Only 200 responses with a fixed
+    body are stored; at most max_entries URIs are kept.
+    """
+
+    def __init__(self, max_entries=MAX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def serve(self, request, response, version):
+        """Answers the request from the cache if it can. Returns True if it
+        did, in which case the handler must not be called.
+        """
+        etag = make_etag(version)
+        if etag_matches(request.get_header('If-None-Match'), etag):
+            self.not_modified += 1
+            response.set_status(304).add_header("ETag: " + etag)
+            response.body_set = True
+            return True
+        entry = self._entries.get(request.uri)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return False
+        self.hits += 1
+        response.set_status(200).add_header("ETag: " + etag)
+        response.set_body(entry[2], entry[1])
+        return True
+
+    def store(self, request, response, version):
+        """Keeps the handler's response for later requests of the same version"""
+        if response.sent or response.streamed or response.status_code != 200:
+            return
+        if request.uri not in self._entries and len(self._entries) >= self.max_entries:
+            # Any entry will do; the cache only holds a handful of endpoints
+            del self._entries[next(iter(self._entries))]
+        self._entries[request.uri] = (version, response.content_type, response.encoded_body())
+        response.add_header("ETag: " + make_etag(version))
+
+    def clear(self):
+        self._entries = {}
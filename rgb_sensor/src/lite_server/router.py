@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Routing table for WebServer.
+
+A route pattern is a path whose segments may be parameters:
+`/sensor/<sensor_id>/sample` matches `/sensor/0/sample` with params
+{'sensor_id': '0'}, and a final `<*rest>` segment matches the remainder of
+the path, which makes the route a prefix match.
+
+@author: jcron
+"""
+from src.lite_server.request import RequestError
+
+# Where each handler argument comes from
+ARG_REQUEST = 0
+ARG_RESPONSE = 1
+ARG_PARAMS = 2
+ARG_QUERY = 3
+ARG_PATH_PARAM = 4
+# A key of the JSON body, or else of the query string
+ARG_VALUE = 5
+
+SPECIAL_ARGS = {
+    'request': ARG_REQUEST,
+    'response': ARG_RESPONSE,
+    'params': ARG_PARAMS,
+    'query': ARG_QUERY,
+}
+
+
+def split_path(path):
+    """'/a/b/' -> ['a', 'b']; '/' -> []"""
+    path = path.strip('/')
+    return path.split('/') if path else []
+
+
+def handler_arguments(func, args=None):
+    """Returns the handler's argument names and how many of them are
+    required. MicroPython functions carry no signature, so handlers served
+    there must name their arguments with args=.
+    """
+    if args is not None:
+        return tuple(args), len(args)
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return (), 0
+    names = code.co_varnames[:code.co_argcount]
+    defaults = getattr(func, '__defaults__', None) or ()
+    return names, len(names) - len(defaults)
+
+
+class Route:
+    """A compiled pattern and the plan for calling its handler. Everything
+    about the handler's arguments is worked out here, at registration, so a
+    request only has to fill them in.
+    """
+
+    def __init__(self, method, pattern, handler, args=None, cache_key=None):
+        self.method = method
+        self.pattern = pattern
+        self.handler = handler
+        # cache_key(request) -> version of the data the response is built from
+        self.cache_key = cache_key
+
+        self.segments = []
+        self.param_names = []
+        self.rest_name = None
+        for segment in split_path(pattern):
+            if self.rest_name is not None:
+                raise ValueError("<*{}> must be the last segment of {}".format(self.rest_name, pattern))
+            if segment.startswith('<*') and segment.endswith('>'):
+                self.rest_name = segment[2:-1]
+            elif segment.startswith('<') and segment.endswith('>'):
+                self.param_names.append(segment[1:-1])
+                self.segments.append(None)
+            else:
+                self.segments.append(segment)
+
+        names, required = handler_arguments(handler, args)
+        plan = []
+        for i, name in enumerate(names):
+            if name in self.param_names or name == self.rest_name:
+                source = ARG_PATH_PARAM
+            else:
+                source = SPECIAL_ARGS.get(name, ARG_VALUE)
+            plan.append((name, source, i < required))
+        self.plan = tuple(plan)
+
+    @property
+    def is_static(self):
+        return not self.param_names and self.rest_name is None
+
+    @property
+    def priority(self):
+        """Sort key: literal segments beat parameters, position by position"""
+        return tuple(0 if segment is not None else 1 for segment in self.segments)
+
+    def match(self, parts):
+        """Returns the path parameters if the split path matches, else None"""
+        segments = self.segments
+        if len(parts) < len(segments) or (self.rest_name is None and len(parts) != len(segments)):
+            return None
+        params = {}
+        names = self.param_names
+        n = 0
+        for i, segment in enumerate(segments):
+            if segment is None:
+                params[names[n]] = parts[i]
+                n += 1
+            elif segment != parts[i]:
+                return None
+        if self.rest_name is not None:
+            params[self.rest_name] = '/'.join(parts[len(segments):])
+        return params
+
+    def arguments(self, request, response, params):
+        """Handler kwargs for a request. Raises RequestError (400) when a
+        required argument is in neither the body nor the query string.
+        """
+        body = request.body if isinstance(request.body, dict) else None
+        kwargs = {}
+        for name, source, required in self.plan:
+            if source == ARG_REQUEST:
+                kwargs[name] = request
+            elif source == ARG_RESPONSE:
+                kwargs[name] = response
+            elif source == ARG_PATH_PARAM:
+                kwargs[name] = params[name]
+            elif source == ARG_PARAMS:
+                kwargs[name] = params
+            elif source == ARG_QUERY:
+                kwargs[name] = request.query
+            elif body is not None and name in body:
+                kwargs[name] = body[name]
+            elif name in request.query:
+                kwargs[name] = request.query[name]
+            elif required:
+                raise RequestError(400, "Missing argument {}".format(name))
+        return kwargs
+
+
+class Router:
+    """Routes by method and path.
+
+    compile() indexes the routes: static paths go in a dict, parametrized
+    ones in lists keyed by segment count and sorted so literal segments win,
+    and prefix routes in a list tried last, longest first. Routes added
+    after compiling trigger a recompile on the next match.
+    """
+
+    def __init__(self):
+        self._routes = []
+        self._static = {}
+        self._dynamic = {}
+        self._prefix = {}
+        self._compiled = False
+
+    def add(self, method, pattern, handler, args=None, cache_key=None):
+        route = Route(method, pattern, handler, args, cache_key)
+        self._routes.append(route)
+        self._compiled = False
+        return route
+
+    def compile(self):
+        static = {}
+        dynamic = {}
+        prefix = {}
+        for route in self._routes:
+            if route.is_static:
+                static.setdefault(route.method, {})['/' + '/'.join(route.segments)] = route
+            elif route.rest_name is None:
+                dynamic.setdefault(route.method, {}).setdefault(len(route.segments), []).append(route)
+            else:
+                prefix.setdefault(route.method, []).append(route)
+        for by_length in dynamic.values():
+            for routes in by_length.values():
+                routes.sort(key=lambda route: route.priority)
+        for routes in prefix.values():
+            routes.sort(key=lambda route: (-len(route.segments), route.priority))
+        self._static = static
+        self._dynamic = dynamic
+        self._prefix = prefix
+        self._compiled = True
+
+    def match(self, method, path):
+        """Returns (route, params), or (None, None) if no route matches"""
+        if not self._compiled:
+            self.compile()
+        static = self._static.get(method)
+        if static is not None:
+            route = static.get(path) or static.get('/' + path.strip('/'))
+            if route is not None:
+                return route, {}
+
+        parts = split_path(path)
+        by_length = self._dynamic.get(method)
+        if by_length is not None:
+            for route in by_length.get(len(parts), ()):
+                params = route.match(parts)
+                if params is not None:
+                    return route, params
+        for route in self._prefix.get(method, ()):
+            params = route.match(parts)
+            if params is not None:
+                return route, params
+        return None, None
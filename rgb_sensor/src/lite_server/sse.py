@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Server-Sent Events on top of a lite_server Response.
+
+@author: jcron
+"""
+import uasyncio as asyncio
+
+
+class EventStream:
+    """Streams events to one client. open() sends the response head; each
+    send() writes one event and waits for the client to take it, at most
+    write_timeout seconds (OSError/TimeoutError end the stream).
+    """
+    write_timeout = 10
+
+    def __init__(self, response):
+        self._response = response
+
+    def open(self):
+        self._response.add_header("Cache-Control: no-cache")
+        self._response.start_stream("text/event-stream")
+        return self
+
+    async def send(self, data, event=None, event_id=None):
+        response = self._response
+        if event_id is not None:
+            response.write("id: {}\n".format(event_id))
+        if event is not None:
+            response.write("event: {}\n".format(event))
+        response.write("data: ")
+        response.write(data)
+        response.write("\n\n")
+        await asyncio.wait_for(response.flush(), self.write_timeout)
+
+    async def comment(self, text=""):
+        """Keep-alive line; clients ignore it"""
+        self._response.write(": {}\n\n".format(text))
+        await asyncio.wait_for(self._response.flush(), self.write_timeout)
@@ -5,117 +5,216 @@ Created on Sun Nov  3 15:00:47 2019
 @author: jcron
 """
 
-import usocket
+import uasyncio as asyncio
 import ujson
 import _thread
-from src.lite_server.response import Response
-from src.lite_server.request import Request
+import time
+from src.lite_server.response import Response, HEAD_BUFFER_SIZE
+from src.lite_server.request import RequestReader, RequestError
+from src.lite_server.router import Router
+from src.lite_server.response_cache import ResponseCache
 import src.lite_server.dav_functions as web_dav
+from src.metrics import Metrics
 
-
-def function_args(func):
-    function_arguments = [i for i in dir(func) if not i.startswith('__')]
-    return function_arguments
-
-def get_function_kwargs(arg_list, request, response):
-    """ Throws KeyError if arg is not available in body """
-    kwarg_source = request.body if isinstance(request.body, dict) else {}
-    kwarg_source.update({'request': request, 'response': response})
-    kwargs = {
-        arg_name: kwarg_source[arg_name]
-        for arg_name in arg_list
-    }
-    return kwargs
+def is_awaitable(result):
+    """async handlers return a coroutine (a generator on MicroPython)"""
+    return hasattr(result, 'send')
 
 class WebServer:
     _run = True
-    addr = ('', 8008)
+    addr = ('0.0.0.0', 8008)
+    backlog = 5
+    # Seconds a persistent connection may sit idle between requests
+    keep_alive_timeout = 5
+    # Seconds a client may take to send a request's header once it started
+    header_timeout = 10
+    max_requests_per_connection = 100
 
     def __init__(self, *, enable_web_dav=False):
-        self.__router = {
-            "POST": {},
-            "GET": {},
-        }
-        self.__socket = None
+        self.__router = Router()
+        self.response_cache = ResponseCache()
+        self.metrics = Metrics()
+        # Request counters by (route, status) and latency histograms by route
+        self._request_counters = {}
+        self._request_latency = {}
+        self.__web_dav_enabled = enable_web_dav
+        self.__server = None
+
+    def compile(self):
+        """Builds the route tables. Routes added afterwards need another call."""
+        self.__router.compile()
 
     def start_listening(self):
-        self.__socket = usocket.socket(usocket.AF_INET, usocket.SOCK_STREAM)
-        addr = usocket.getaddrinfo('0.0.0.0', 8008)[0][-1]
-        self.__socket.bind(addr)
-        print("listening on {}:{}".format(addr[0], addr[1]))
-        _thread.start_new_thread(self.__run, ())
+        """Starts serving on a background thread running the asyncio loop"""
+        self.compile()
+        _thread.start_new_thread(asyncio.run, (self.serve(),))
+
+    async def serve(self):
+        """Accepts connections and handles each one in its own task until
+        stop() is called. Handlers may be plain functions or async def.
+        """
+        host, port = self.addr
+        self.__server = await asyncio.start_server(self._handle_client, host, port, backlog=self.backlog)
+        print("listening on {}:{}".format(host, port))
+        while self._run:
+            await asyncio.sleep(1)
+        self.__server.close()
+        await self.__server.wait_closed()
+
+    def stop(self):
+        self._run = False
     
-    def POST(self, uri):
+    def POST(self, uri, args=None):
+        """Registers a handler for uri, which may hold <param> segments and
+        end in a <*rest> segment (see router.py). Handler arguments are
+        filled in by name: request, response, params, query, path
+        parameters, and otherwise keys of the JSON body or query string.
+        MicroPython can not list a function's arguments, so handlers that
+        take any must name them in args.
+        """
         def wrapper(func):
-            self.__router["POST"][uri] = (func, function_args(func))
+            self.__router.add("POST", uri, func, args)
             return func
         return wrapper
 
-    def GET(self, uri):
+    def GET(self, uri, args=None, cache_key=None):
+        """See POST. With cache_key, responses are cached: cache_key(request)
+        returns the version (an int or tuple of ints) of the data the
+        response is built from, and the handler only runs again once that
+        changes. Clients get the version as an ETag and can poll with
+        If-None-Match for a 304.
+        """
         def wrapper(func):
-            self.__router["GET"][uri] = (func, function_args(func))
+            self.__router.add("GET", uri, func, args, cache_key)
             return func
         return wrapper
 
-    def __run(self):
-        self.__socket.listen(5)
-        while self._run:
-            conn, addr = self.__socket.accept()
-            try:
-                request = Request(conn)
-                print('client conneted from', addr)
-                method = request.method
-                uri = request.uri
-
-                if method in ["PUT", "DELETE"] and not self.__web_dav_enabled: 
-                    err_msg = "WEB DAV has not been enabled.  Unable to process {} request.".format(method)
-                    print(err_msg)
-                    raise RuntimeError(err_msg)
-                elif method not in ["GET", "POST", "PUT", "DELETE"]:
-                    err_msg = "{} has not been implemented".format(method)
-                    print(err_msg)
-                    raise NotImplementedError(err_msg)
-                else:
-                    if method == 'PUT' and self.__web_dav_enabled:
-                        web_dav.create(uri, request.body)
-                        response = Response(conn).set_status(201)
-                        response.send()
-
-                    elif method == 'DELETE' and self.__web_dav_enabled:
-                        web_dav.delete(uri)
-                        response = Response(conn).set_status(204)
-                        response.send()
-
-                    elif uri in self.__router[method]:
-                        print("request received:", request)
-                        callback, arg_list = self.__router[method][uri]
-                        response = Response(conn)
-                        print("calling bound method")
-                        kwargs = get_function_kwargs(arg_list, request, response):
-                        result = callback(**kwargs)
-                        print("complete")
-
-                        if not response.body_set:
-                            response.set_body(result)
-                        if not response.status_set:
-                            response.set_status(200)
-
-                        print(response)
-                        response.send()
-
-                    else:
-                        err_msg = "Endpoint not implemented {}:{}".format(method, uri)
-                        print(err_msg)
-                        raise RuntimeError(err_msg)
-                    
-            except RuntimeError as err:
-                response = Response(conn).set_status(500)
-                print('Error processing request: \n{}\n{}'.format(response, err))
-                response.send()
-                
-            finally:
+    async def _handle_client(self, reader, writer):
+        """Serves requests on one connection, in order, until the client
+        asks to close, goes idle for keep_alive_timeout, or an error occurs.
+        Pipelined requests are simply read from the stream after the
+        previous response.
+        """
+        addr = writer.get_extra_info('peername')
+        print('client conneted from', addr)
+        try:
+            requests = RequestReader(reader)
+            # Every response on the connection assembles its head in here
+            head_buffer = bytearray(HEAD_BUFFER_SIZE)
+            requests_served = 0
+            while self._run:
+                try:
+                    request = await requests.read_request(self.keep_alive_timeout, self.header_timeout)
+                except RequestError as err:
+                    print('Rejected request from', addr, err)
+                    await Response(writer, head_buffer).set_status(err.status).send_all()
+                    self._observe_request(None, err.status)
+                    break
+                if request is None:
+                    break
+                started = time.ticks_us()
+                requests_served += 1
+                response = Response(writer, head_buffer)
+                response.keep_alive = (
+                    request.keep_alive
+                    and requests_served < self.max_requests_per_connection
+                )
+                response.chunked = request.version != 'HTTP/1.0'
                 try:
-                    conn.close()
-                except Exception:
-                    pass
-            
\ No newline at end of file
+                    await self.dispatch(request, response)
+                except RequestError as err:
+                    print('Rejected request from', addr, err)
+                    if response.sent:
+                        break
+                    response = Response(writer, head_buffer).set_status(err.status)
+                    response.keep_alive = request.keep_alive
+                except Exception as err:
+                    print('Error processing request: \n{}\n{}'.format(response, err))
+                    if response.sent:
+                        # Part of the response is out already; all we can do is hang up
+                        break
+                    response = Response(writer, head_buffer).set_status(500)
+                if response.sent:
+                    await writer.drain()
+                else:
+                    await response.send_all()
+                self._observe_request(request.route, response.status_code, started)
+                if not response.keep_alive:
+                    break
+
+        except Exception as err:
+            print('Connection error', addr, err)
+
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    def _observe_request(self, route, status, started=None):
+        """Counts a request by route pattern and status and, given when it
+        started, records its latency
+        """
+        route = route or 'unmatched'
+        key = (route, status)
+        counter = self._request_counters.get(key)
+        if counter is None:
+            counter = self._request_counters[key] = self.metrics.counter(
+                'http_requests_total', "Requests served", {'route': route, 'status': status})
+        counter.inc()
+        if started is not None:
+            latency = self._request_latency.get(route)
+            if latency is None:
+                latency = self._request_latency[route] = self.metrics.histogram(
+                    'http_request_duration_seconds', "Time from parsed request to sent response", {'route': route})
+            latency.observe_since(started)
+        self.metrics.heap.sample()
+
+    async def dispatch(self, request, response):
+        method = request.method
+        uri = request.path
+
+        if method in ["PUT", "DELETE"] and not self.__web_dav_enabled: 
+            err_msg = "WEB DAV has not been enabled.  Unable to process {} request.".format(method)
+            print(err_msg)
+            raise RuntimeError(err_msg)
+        elif method not in ["GET", "POST", "PUT", "DELETE"]:
+            err_msg = "{} has not been implemented".format(method)
+            print(err_msg)
+            raise NotImplementedError(err_msg)
+        else:
+            if method == 'PUT' and self.__web_dav_enabled:
+                web_dav.create(uri, request.body)
+                response.set_status(201)
+
+            elif method == 'DELETE' and self.__web_dav_enabled:
+                web_dav.delete(uri)
+                response.set_status(204)
+
+            else:
+                route, params = self.__router.match(method, uri)
+                if route is None:
+                    raise RequestError(404, "Endpoint not implemented {}:{}".format(method, uri))
+                print("request received:", request)
+                request.route = route.pattern
+                request.params = params
+                version = None
+                if route.cache_key is not None:
+                    version = route.cache_key(request)
+                    if self.response_cache.serve(request, response, version):
+                        return
+                print("calling bound method")
+                result = route.handler(**route.arguments(request, response, params))
+                if is_awaitable(result):
+                    result = await result
+                print("complete")
+
+                if not response.body_set:
+                    response.set_body(result)
+                if not response.status_set:
+                    response.set_status(200)
+                if version is not None:
+                    self.response_cache.store(request, response, version)
+
+                print(response)
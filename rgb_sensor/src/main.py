@@ -5,37 +5,183 @@ Created on Fri Oct 25 16:00:35 2019
 @author: jcron
 """
 import machine
-from src.rgb_sensor_tcs34725 import Controller
+import ujson
+import uasyncio as asyncio
+from src.rgb_sensor_tcs34725 import Controller, Sample
+from src.rgb_sensor_tcs34725.ring_buffer import SampleCursor, new_sample_record
+from src.rgb_sensor_tcs34725.export import pack_samples, samples_as_json, SAMPLES_CONTENT_TYPE
 from src.lite_server.web_server import WebServer
+from src.lite_server.request import RequestError
+from src.lite_server.sse import EventStream
+from src.metrics import COUNTER, CONTENT_TYPE as METRICS_CONTENT_TYPE
 from micropython import const
 
 LED_PIN = const(13)
 INTERRUPT_PIN = const(23)
 SCL_PIN = const(22)
 SDA_PIN = const(21)
+# I2C bus frequency in Hz
+I2C_FREQ = const(9600)
+# Samples a /stream subscriber may fall behind before it starts dropping them
+STREAM_MAX_BACKLOG = const(8)
+STREAM_KEEP_ALIVE_MS = const(15000)
+# Merge a short and a long exposure into every sample (see hdr.py), for
+# light that changes faster than auto-exposure follows
+ACQUISITION_HDR = False
 
-def start_webserver(sensor):
+def register_sensor_metrics(metrics, sensor_id, sensor):
+    """Exposes what the sensor's bus, driver, calibration and acquisition
+    already count
+    """
+    driver = sensor.driver
+    bus = driver.device.i2c
+    acquisition = sensor.acquisition
+    counters = (
+        ('i2c_transactions_total', "I2C transactions", lambda: bus.transactions),
+        ('i2c_bytes_written_total', "Bytes written to the sensor", lambda: bus.bytes_written),
+        ('i2c_bytes_read_total', "Bytes read from the sensor", lambda: bus.bytes_read),
+        ('i2c_errors_total', "Failed I2C transactions", lambda: bus.errors),
+        ('calibrations_total', "Calibration steps", lambda: sensor.calibrations),
+        ('interrupts_received_total', "Clear channel interrupts", lambda: driver.interrupts_received),
+        ('interrupt_schedule_failures_total', "Interrupts whose handler could not be scheduled right away", lambda: driver.schedule_failures),
+        ('interrupt_services_deferred_total', "Interrupt handlers that found the bus held and left the interrupts pending", lambda: driver.services_deferred),
+        ('samples_acquired_total', "Samples read by the acquisition loop", lambda: acquisition.samples_acquired),
+        ('integrations_missed_total', "Integrations the acquisition loop missed", lambda: acquisition.integrations_missed),
+    )
+    labels = {'sensor': sensor_id}
+    for name, help_text, func in counters:
+        metrics.function(name, COUNTER, help_text, func, labels)
+
+def create_webserver(sensors, default_sensor_id='0'):
+    """Returns a WebServer with every route registered. sensors maps sensor
+    ids to Controllers. The /sensor/<sensor_id>/... routes serve any of
+    them; the original top level routes serve the default one.
+    """
     server = WebServer(enable_web_dav=True)
+    default_sensor = sensors[default_sensor_id]
+    for sensor_id in sorted(sensors):
+        register_sensor_metrics(server.metrics, sensor_id, sensors[sensor_id])
+
+    def get_sensor(sensor_id):
+        sensor = sensors.get(sensor_id)
+        if sensor is None:
+            raise RequestError(404, "No sensor {}".format(sensor_id))
+        return sensor
 
-    @server.POST("/reset")
-    def reset_esp32(response):
+    @server.POST("/reset", args=('response',))
+    async def reset_esp32(response):
         response.set_status(200)
         response.send()
+        await response.flush()
         machine.reset()
     
-    @server.GET("/rgbcct")
+    def latest_seq(sensor):
+        """Cache version of responses built from the latest sample"""
+        return lambda request: sensor.latest_sample().seq
+
+    def config_version(sensor):
+        """Cache version of responses built from the configuration"""
+        return lambda request: sensor.driver.config_version
+
+    def sensor_latest_seq(request):
+        return get_sensor(request.params['sensor_id']).latest_sample().seq
+
+    def sensor_config_version(request):
+        return get_sensor(request.params['sensor_id']).driver.config_version
+
+    @server.GET("/rgbcct", cache_key=latest_seq(default_sensor))
     def get_rgbcct():
-        rgb = sensor.color_raw
-        ct = sensor.ct
-        lux = sensor.lux
-        return [rgb[0], rgb[1], rgb[2], rgb[3], ct, lux]
+        return default_sensor.latest_sample().as_list()
+
+    def send_samples(sensor, request, response):
+        """Every sample newer than ?since=<seq>. Binary (see export.py) when
+        the client accepts it, JSON otherwise.
+        """
+        since = request.query.get('since', '0')
+        if not since.isdigit():
+            raise RequestError(400, "since must be a sequence number")
+        since = int(since)
+        accept = request.get_header('Accept', '')
+        if SAMPLES_CONTENT_TYPE in accept or 'application/octet-stream' in accept:
+            response.set_body(pack_samples(sensor.samples, since), SAMPLES_CONTENT_TYPE)
+        else:
+            response.set_body(samples_as_json(sensor.samples, since))
+
+    @server.GET("/samples", args=('request', 'response'))
+    def get_samples(request, response):
+        send_samples(default_sensor, request, response)
+
+    # The last encoded event of each sensor, shared by its /stream subscribers
+    last_events = {sensor_id: [0, None] for sensor_id in sensors}
+
+    def encode_event(last_event, seq, record):
+        if last_event[0] != seq:
+            sample = Sample(record[0], record[1], record[2], record[3], record[4], record[5], record[6], seq)
+            last_event[1] = ujson.dumps(sample.as_dict())
+            last_event[0] = seq
+        return last_event[1]
 
-    @server.GET("/status")
+    async def stream_samples(sensor_id, response):
+        """Pushes every acquired sample as a Server-Sent Event. The sensor is
+        never read here: subscribers follow the sample ring with their own
+        cursor and skip samples if they fall behind.
+        """
+        sensor = get_sensor(sensor_id)
+        last_event = last_events[sensor_id]
+        events = EventStream(response).open()
+        cursor = SampleCursor(sensor.samples, max_backlog=STREAM_MAX_BACKLOG)
+        record = new_sample_record()
+        idle_ms = 0
+        while True:
+            seq = cursor.take_into(record)
+            if seq:
+                await events.send(encode_event(last_event, seq, record), event="sample", event_id=seq)
+                idle_ms = 0
+                continue
+            poll_ms = max(10, int(sensor.driver.cycle_time) // 2)
+            await asyncio.sleep(poll_ms / 1000)
+            idle_ms += poll_ms
+            if idle_ms >= STREAM_KEEP_ALIVE_MS:
+                await events.comment()
+                idle_ms = 0
+
+    @server.GET("/stream", args=('response',))
+    async def get_stream(response):
+        await stream_samples(default_sensor_id, response)
+
+    @server.GET("/status", cache_key=config_version(default_sensor))
     def get_status():
-        status = sensor.status
+        status = default_sensor.status
         return status
 
-    server.start_listening()
+    @server.GET("/metrics", args=('response',))
+    def get_metrics(response):
+        response.set_body(server.metrics.render(), METRICS_CONTENT_TYPE)
+
+    @server.GET("/sensors")
+    def get_sensors():
+        return sorted(sensors)
+
+    @server.GET("/sensor/<sensor_id>/sample", args=('sensor_id',), cache_key=sensor_latest_seq)
+    def get_sensor_sample(sensor_id):
+        return get_sensor(sensor_id).latest_sample().as_dict()
+
+    @server.GET("/sensor/<sensor_id>/samples", args=('sensor_id', 'request', 'response'))
+    def get_sensor_samples(sensor_id, request, response):
+        send_samples(get_sensor(sensor_id), request, response)
+
+    @server.GET("/sensor/<sensor_id>/stream", args=('sensor_id', 'response'))
+    async def get_sensor_stream(sensor_id, response):
+        await stream_samples(sensor_id, response)
+
+    @server.GET("/sensor/<sensor_id>/status", args=('sensor_id',), cache_key=sensor_config_version)
+    def get_sensor_status(sensor_id):
+        return get_sensor(sensor_id).status
+
+    return server
+
+def start_webserver(sensors, default_sensor_id='0'):
+    create_webserver(sensors, default_sensor_id).start_listening()
 
 def connect(cb):
     import network
@@ -51,7 +197,8 @@ def connect(cb):
 
 def run():
     print("hello world")
-    sensor = Controller(SCL_PIN, SDA_PIN, 9600, LED_PIN, INTERRUPT_PIN)
+    sensor = Controller(SCL_PIN, SDA_PIN, I2C_FREQ, LED_PIN, INTERRUPT_PIN)
     print("sensor initialized")
-    cb = lambda: start_webserver(sensor)
+    sensor.start_acquisition(hdr=ACQUISITION_HDR)
+    cb = lambda: start_webserver({'0': sensor})
     connect(cb)
\ No newline at end of file
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Counters and latency histograms, served in the Prometheus text format.
+
+Updating a metric does not allocate: a Counter is an int, a Histogram a
+fixed array of bucket counts, and durations are measured with
+time.ticks_us. Values other subsystems already count (the driver's
+interrupt counters, the bus' transaction counters) are registered as
+functions and only read when the metrics are rendered.
+
+    metrics = Metrics()
+    requests = metrics.counter('http_requests_total', "Requests", {'route': '/rgbcct'})
+    latency = metrics.histogram('http_request_duration_seconds', "Latency")
+    started = time.ticks_us()
+    ...
+    requests.inc()
+    latency.observe_since(started)
+
+@author: jcron
+"""
+import gc
+import time
+from array import array
+
+# Histogram bucket bounds in microseconds, rendered in seconds
+LATENCY_BUCKETS_US = (1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000, 2500000)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """Counts observations (in microseconds) per bucket. counts[i] holds
+    the observations up to buckets[i] that fit no smaller bucket, the last
+    one those above every bound.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_US):
+        self.buckets = buckets
+        self.counts = array('L', [0] * (len(buckets) + 1))
+        self.count = 0
+        self.sum_us = 0
+
+    def observe(self, value_us):
+        buckets = self.buckets
+        i = 0
+        n = len(buckets)
+        while i < n and value_us > buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum_us += value_us
+
+    def observe_since(self, start_ticks_us):
+        self.observe(time.ticks_diff(time.ticks_us(), start_ticks_us))
+
+
+class HeapMonitor:
+    """Free heap and garbage collections. MicroPython does not count its
+    collections, so they are inferred: whenever the allocated heap shrank
+    since the last sample, at least one collection ran. sample() is cheap
+    enough to call once per request or per sample.
+    """
+
+    def __init__(self):
+        self.collections = 0
+        self._allocated = self.allocated()
+
+    @staticmethod
+    def allocated():
+        if hasattr(gc, 'mem_alloc'):
+            return gc.mem_alloc()
+        return 0
+
+    @staticmethod
+    def free():
+        if hasattr(gc, 'mem_free'):
+            return gc.mem_free()
+        return 0
+
+    def sample(self):
+        allocated = self.allocated()
+        if allocated < self._allocated:
+            self.collections += 1
+        self._allocated = allocated
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, labels[key]) for key in sorted(labels)) + '}'
+
+
+def _format_seconds(value_us):
+    return '{:g}'.format(value_us / 1000000)
+
+
+class Metrics:
+    """A set of metric families, each a name, a type, a help text and one
+    metric per label set
+    """
+
+    def __init__(self):
+        self._families = {}
+        self._order = []
+        self.heap = HeapMonitor()
+        self.function(
+            'heap_free_bytes', GAUGE, "Free heap", self.heap.free)
+        self.function(
+            'heap_allocated_bytes', GAUGE, "Allocated heap", self.heap.allocated)
+        self.function(
+            'gc_collections_total', COUNTER, "Garbage collections observed",
+            lambda: self.heap.collections)
+
+    def _add(self, name, kind, help_text, labels, metric):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help_text, [])
+            self._order.append(name)
+        elif family[0] != kind:
+            raise ValueError("{} is a {}".format(name, family[0]))
+        family[2].append((_format_labels(labels), metric))
+        return metric
+
+    def counter(self, name, help_text, labels=None):
+        return self._add(name, COUNTER, help_text, labels, Counter())
+
+    def histogram(self, name, help_text, labels=None, buckets=LATENCY_BUCKETS_US):
+        return self._add(name, HISTOGRAM, help_text, labels, Histogram(buckets))
+
+    def function(self, name, kind, help_text, func, labels=None):
+        """A counter or gauge whose value func() returns at render time"""
+        return self._add(name, kind, help_text, labels, func)
+
+    def render(self):
+        """Yields the text exposition format one family at a time"""
+        self.heap.sample()
+        for name in self._order:
+            kind, help_text, metrics = self._families[name]
+            lines = ['# HELP {} {}\n# TYPE {} {}\n'.format(name, help_text, name, kind)]
+            for labels, metric in metrics:
+                if kind == HISTOGRAM:
+                    _render_histogram(lines, name, labels, metric)
+                else:
+                    value = metric() if callable(metric) else metric.value
+                    lines.append('{}{} {}\n'.format(name, labels, value))
+            yield ''.join(lines)
+
+
+def _render_histogram(lines, name, labels, histogram):
+    # Bucket labels go after the metric's own
+    prefix = labels[:-1] + ',' if labels else '{'
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append('{}_bucket{}le="{}"}} {}\n'.format(name, prefix, _format_seconds(bound), cumulative))
+    lines.append('{}_bucket{}le="+Inf"}} {}\n'.format(name, prefix, histogram.count))
+    lines.append('{}_sum{} {}\n'.format(name, labels, _format_seconds(histogram.sum_us)))
+    lines.append('{}_count{} {}\n'.format(name, labels, histogram.count))
@@ -1,2 +1,3 @@
-from src.rgb_sensor_tcs34725.driver import Driver, GAINS, TIME_ONE_CYCLE
+from src.rgb_sensor_tcs34725.driver import Driver, GAINS, TIME_ONE_CYCLE, integration_time_to_atime, wait_time_to_wtime
+from src.rgb_sensor_tcs34725.sample import Sample
 from src.rgb_sensor_tcs34725.controller import Controller
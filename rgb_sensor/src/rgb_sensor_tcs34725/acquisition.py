@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Continuous acquisition synchronized to the sensor's integration cycle.
+
+@author: jcron
+"""
+import time
+import _thread
+from array import array
+from micropython import const
+from src.rgb_sensor_tcs34725.dn40 import TIME_ONE_CYCLE
+
+# Margin after the expected end of an integration before reading it
+READ_MARGIN_US = const(1000)
+# Restart the cycle after this many reads in a row find AVALID clear
+MAX_NOT_READY = const(4)
+
+
+class AcquisitionEngine:
+    """Reads every integration the sensor completes, exactly once, into the
+    driver's sample ring.
+
+    AVALID stays set once any integration has completed, so on its own it
+    can not tell a new result from one already read. The engine therefore
+    owns the phase of the cycle: it restarts the integration (which clears
+    AVALID), sleeps for exactly the programmed init + ATIME, reads STATUS
+    and the data in one transaction, then sleeps for the programmed WTIME
+    before restarting. A set AVALID bit always means a result nobody has
+    read yet, and the chip keeps the ATIME + WTIME duty cycle.
+    Timing is taken from the register shadow before every cycle. Exposure
+    changes are handed to request_exposure() and written between two
+    integrations, so every sample is tagged with the gain and ATIME it
+    integrated at.
+
+    With hdr set to an HDRMerger, every cycle is a short and a long
+    integration merged into one sample (see hdr.py).
+    """
+
+    def __init__(self, driver):
+        self._driver = driver
+        self._run = False
+        self._sample_callbacks = []
+
+        self.running = False
+        # driver.capture_on_interrupt from before start(), restored by stop()
+        self._capture_on_interrupt = True
+        # HDRMerger for extended range acquisition (see hdr.py), or None
+        self.hdr = None
+        # (gain, ATIME) to write before the next integration, or None
+        self._pending_exposure = None
+        self._exposure_lock = _thread.allocate_lock()
+        self._hdr_short = array('H', (0, 0, 0, 0))
+        self._hdr_long = array('H', (0, 0, 0, 0))
+        self._hdr_merged = array('H', (0, 0, 0, 0))
+        self.samples_acquired = 0
+        self.integrations_missed = 0
+        self.not_ready = 0
+
+    def register_sample_callback(self, callback):
+        """callback(seq) is called from the acquisition thread after each sample"""
+        self._sample_callbacks.append(callback)
+
+    def start(self):
+        if self._run:
+            return
+        self._run = True
+        # The loop captures every integration; interrupts only drive calibration
+        self._capture_on_interrupt = self._driver.capture_on_interrupt
+        self._driver.capture_on_interrupt = False
+        _thread.start_new_thread(self._loop, ())
+
+    def stop(self):
+        if not self._run:
+            return
+        self._run = False
+        self._driver.capture_on_interrupt = self._capture_on_interrupt
+
+    def request_exposure(self, gain, atime):
+        """Sets the exposure of the next integration the loop starts; the
+        one in flight finishes at the settings it started with
+        """
+        with self._exposure_lock:
+            self._pending_exposure = (gain, atime)
+
+    def _apply_pending_exposure(self):
+        with self._exposure_lock:
+            exposure = self._pending_exposure
+            self._pending_exposure = None
+        if exposure is not None:
+            self._driver.set_exposure(exposure[0], exposure[1])
+
+    def _next_integration(self):
+        """Applies a requested exposure, then starts an integration"""
+        self._apply_pending_exposure()
+        return self._start_integration()
+
+    def _start_integration(self):
+        """Starts an integration now and returns when its result is due"""
+        driver = self._driver
+        self._integration_us = int((driver.integration_count + 1) * TIME_ONE_CYCLE * 1000)
+        if driver.is_wait_between_integration_enabled:
+            self._wait_us = int(driver.wait_time * 1000)
+        else:
+            self._wait_us = 0
+        driver.restart_integration()
+        return time.ticks_add(time.ticks_us(), self._integration_us + READ_MARGIN_US)
+
+    def _loop(self):
+        print("acquisition started")
+        self.running = True
+        driver = self._driver
+        not_ready_streak = 0
+        try:
+            if self.hdr is not None:
+                self._hdr_loop()
+                return
+            due = self._next_integration()
+            while self._run:
+                delay = time.ticks_diff(due, time.ticks_us())
+                if delay > 0:
+                    time.sleep_us(delay)
+
+                seq = driver.capture_if_valid()
+                if not seq:
+                    # Integration not finished yet; check again one cycle later
+                    self.not_ready += 1
+                    not_ready_streak += 1
+                    if not_ready_streak >= MAX_NOT_READY:
+                        not_ready_streak = 0
+                        due = self._next_integration()
+                    else:
+                        due = time.ticks_add(due, int(TIME_ONE_CYCLE * 1000))
+                    continue
+
+                not_ready_streak = 0
+                self.samples_acquired += 1
+                for callback in self._sample_callbacks:
+                    callback(seq)
+
+                # Idle for WTIME, as the chip would, then start the next integration
+                restart_at = time.ticks_add(due, self._wait_us)
+                late = time.ticks_diff(time.ticks_us(), restart_at)
+                if late < 0:
+                    time.sleep_us(-late)
+                elif late > self._integration_us:
+                    # Held up long enough for the chip to complete integrations we never read
+                    self.integrations_missed += late // (self._integration_us + self._wait_us)
+                due = self._next_integration()
+        finally:
+            # A request that came in after the last integration still applies
+            self._apply_pending_exposure()
+            self.running = False
+            print("acquisition stopped")
+
+    def _expose_into(self, exposure, rgbc):
+        """Integrates once at exposure (gain, ATIME) and reads the result
+        into rgbc. Returns False if it never became valid.
+        """
+        driver = self._driver
+        driver.set_exposure(exposure[0], exposure[1])
+        due = self._start_integration()
+        for _ in range(MAX_NOT_READY):
+            delay = time.ticks_diff(due, time.ticks_us())
+            if delay > 0:
+                time.sleep_us(delay)
+            if driver.color_raw_if_valid_into(rgbc) is not None:
+                return True
+            self.not_ready += 1
+            due = time.ticks_add(due, int(TIME_ONE_CYCLE * 1000))
+        return False
+
+    def _hdr_loop(self):
+        """Alternates the merger's short and long exposures and pushes one
+        merged sample per pair, then waits WTIME
+        """
+        driver = self._driver
+        merger = self.hdr
+        short_exposure, long_exposure = merger.exposures
+        short_rgbc = self._hdr_short
+        long_rgbc = self._hdr_long
+        merged = self._hdr_merged
+        while self._run:
+            if not self._expose_into(short_exposure, short_rgbc):
+                continue
+            if not self._expose_into(long_exposure, long_rgbc):
+                continue
+            exposure = merger.exposures[merger.merge_into(short_rgbc, long_rgbc, merged)]
+            seq = driver.samples.push(
+                merged[0], merged[1], merged[2], merged[3],
+                exposure[0], exposure[1], time.ticks_ms()
+            )
+            self.samples_acquired += 1
+            for callback in self._sample_callbacks:
+                callback(seq)
+            if self._wait_us:
+                time.sleep_us(self._wait_us)
@@ -2,7 +2,10 @@ import time
 from machine import Pin
 from micropython import const
 from src.utils.locakable_i2c import I2C
-from src.rgb_sensor_tcs34725 import Driver, GAINS, TIME_ONE_CYCLE
+from src.rgb_sensor_tcs34725 import Driver, GAINS, TIME_ONE_CYCLE, integration_time_to_atime, wait_time_to_wtime
+from src.rgb_sensor_tcs34725.acquisition import AcquisitionEngine
+from src.rgb_sensor_tcs34725.exposure import ExposureLadder, PROBE_THRESHOLDS
+from src.rgb_sensor_tcs34725.hdr import HDRMerger, DEFAULT_SHORT_EXPOSURE, DEFAULT_LONG_EXPOSURE
 
 MAX_GAIN_UPPER_C_THESHOLD = const(2000)
 MAX_INTEGRATION_TIME = const(612)
@@ -13,12 +16,26 @@ DESIRED_INTEGRATION_FLOOR_COUNT = const(63)
 DESIRED_INTEGRATION_FLOOR_TIME = const(152)
 DESIRED_INTEGRATION_FLOOR_TIME_COMPARISON = const(153)
 
+# Auto-exposure modes: one gain index or integration step per interrupt,
+# or a jump to the exposure predicted from the reading (see exposure.py)
+AUTO_EXPOSURE_STEP = 'step'
+AUTO_EXPOSURE_PREDICTIVE = 'predictive'
+
 class Controller:
-    def __init__(self, scl_pin, sda_pin, freq, led_pin, interrupt_pin):
+    def __init__(self, scl_pin, sda_pin, freq, led_pin, interrupt_pin, auto_exposure=AUTO_EXPOSURE_PREDICTIVE):
         i2c = I2C(scl=Pin(scl_pin), sda=Pin(sda_pin), freq=freq)
         self._sensor_driver = Driver(i2c, led_pin, interrupt_pin)
         self._sensor_driver.register_interrupt_callback(self.get_interrupt_handler())
         self._last_rgb_val = None
+        self._latest_sample = None
+        self.calibrations = 0
+        self.auto_exposure = auto_exposure
+        self._exposure_ladder = ExposureLadder(GAINS)
+        self._acquisition = AcquisitionEngine(self._sensor_driver)
+        # Whether HDR acquisition disabled the interrupt, to enable it again on stop
+        self._hdr_disabled_interrupt = False
+        # (gain, ATIME) from before HDR acquisition, restored on stop
+        self._pre_hdr_exposure = None
 
         self.start_sensor()
         self.calibrate()
@@ -28,28 +45,76 @@ class Controller:
 
         #trigger interrupt when within 5% of the total range of the saturation limits
         self._sensor_driver.interrupt_saturation_tolerance = 0.05 
-        # Roughly 1 second of threshold breach: 5 evaulates to 5 (see page 17 of spec sheet for alternative values)
-        self._sensor_driver.interrupt_persistance_filter = 5 
-
-        #initial value; configured in calls to callibrate
-        self._sensor_driver.gain = 1 
 
-        # 154 will remove flicker from 60 Hz lines, and allows digital saturation thresholds to become dominant.
-        self._sensor_driver.integration_time = DESIRED_INTEGRATION_FLOOR_TIME # 151ms
-        # Creates a cycle where devide is on for 154 (above) and idle for 100ms (below)
+        # Creates a cycle where devide is on for 154 (below) and idle for 100ms
         # Reduces power usage
-        self._sensor_driver.wait_time = 100 #ms
+        wtime, long_wait = wait_time_to_wtime(100) #ms
+        self._sensor_driver.configure(
+            # Roughly 1 second of threshold breach: 5 evaulates to 5 (see page 17 of spec sheet for alternative values)
+            persistence=5,
+            #initial value; configured in calls to callibrate
+            gain=1,
+            # 154 will remove flicker from 60 Hz lines, and allows digital saturation thresholds to become dominant.
+            atime=integration_time_to_atime(DESIRED_INTEGRATION_FLOOR_TIME), # 151ms
+            wtime=wtime,
+            long_wait=long_wait,
+        )
         self._sensor_driver.enable_wait_between_integrations()
 
         self._sensor_driver.enable_rgbc()
-        # sleep for 1 integration cycle
-        sleep_time = (self._sensor_driver.integration_time + self._sensor_driver.wait_time) / 1000
-        print("sleep for {}".format(sleep_time))
-        time.sleep(sleep_time)
+        # wait for the first integration cycle
+        self._sensor_driver.wait_for_integration()
+
+    def start_acquisition(self, hdr=False, short_exposure=DEFAULT_SHORT_EXPOSURE, long_exposure=DEFAULT_LONG_EXPOSURE):
+        """Starts reading every integration into the sample ring in the
+        background. With hdr, each sample is merged from a short and a long
+        exposure, both (gain, ATIME), and auto-exposure is suspended until
+        acquisition stops.
+        """
+        if self._acquisition.running:
+            return
+        if hdr:
+            self._pre_hdr_exposure = (self._sensor_driver.gain, self._sensor_driver.ATIME)
+            if self._sensor_driver.is_interrupt_enabled:
+                self._sensor_driver.disable_interrupt()
+                self._hdr_disabled_interrupt = True
+            self._acquisition.hdr = HDRMerger(short_exposure, long_exposure)
+        else:
+            self._acquisition.hdr = None
+        self._acquisition.start()
+
+    def stop_acquisition(self):
+        """Stops acquisition. After HDR the exposure from before is restored
+        and, if auto-exposure was suspended, calibrated again.
+        """
+        self._acquisition.stop()
+        if self._pre_hdr_exposure is None:
+            return
+        # The HDR loop leaves its own exposures set; let it finish the last one
+        while self._acquisition.running:
+            time.sleep_ms(1)
+        gain, atime = self._pre_hdr_exposure
+        self._pre_hdr_exposure = None
+        self._sensor_driver.set_exposure(gain, atime)
+        if self._hdr_disabled_interrupt:
+            self._hdr_disabled_interrupt = False
+            # The light may have changed while auto-exposure was suspended.
+            # The data registers still hold an HDR reading: calibrate from
+            # one taken at the restored exposure.
+            self._sensor_driver.restart_integration()
+            self._sensor_driver.wait_for_integration()
+            self.calibrate()
+
+    @property
+    def acquisition(self):
+        return self._acquisition
 
     def get_interrupt_handler(self):
         def interrupt_handler():
             print("controller interrupt called")
+            if self._pre_hdr_exposure is not None:
+                # Exposure is switched by the HDR loop until it has stopped
+                return
             self.calibrate()
         
         return interrupt_handler
@@ -57,9 +122,43 @@ class Controller:
     
     def calibrate(self):
         print("calibrate")
+        self.calibrations += 1
         if self._sensor_driver.is_interrupt_enabled:
             self._sensor_driver.disable_interrupt()
             self._sensor_driver.clear_interrupt()
+        if self.auto_exposure == AUTO_EXPOSURE_PREDICTIVE:
+            self.calibrate_predictive()
+        else:
+            self.calibrate_step()
+        self._sensor_driver.enable_interrupt()
+
+    def calibrate_predictive(self):
+        """Moves straight to the exposure the current clear count calls for,
+        with the precomputed thresholds of that rung. The integration is
+        restarted so the next result, and interrupt, come from the new
+        settings; while acquisition runs its loop does that.
+        """
+        driver = self._sensor_driver
+        ladder = self._exposure_ladder
+        r, g, b, c = driver.color_raw
+        gain = driver.gain
+        atime = driver.ATIME
+        rung = ladder.select(c, gain, atime)
+        print("c", c, "rung", rung)
+        if rung == ladder.find(gain, atime):
+            driver.configure(thresholds=ladder.thresholds(rung))
+            return
+        thresholds = ladder.thresholds(rung)
+        if ladder.is_saturated(c, atime):
+            # Only a lower bound: calibrate again from the first reading there
+            thresholds = PROBE_THRESHOLDS
+        if self._set_exposure(GAINS[ladder.gain_index[rung]], ladder.atime[rung], thresholds):
+            driver.restart_integration()
+
+    def calibrate_step(self):
+        """Moves the gain one step, or the integration time by
+        INTEGRATION_TIME_STEP, towards a clear count in range
+        """
         r, g, b, c = self._sensor_driver.color_raw
         current_gain = self._sensor_driver.gain
         current_integration_time = self._sensor_driver.integration_time
@@ -89,11 +188,24 @@ class Controller:
 
         next_gain = GAINS[next_gain_index]
         next_integraion_time = max(0, min(MAX_INTEGRATION_TIME, next_integraion_time))
-        self._sensor_driver.gain = next_gain
-        self._sensor_driver.integration_time = next_integraion_time
-        self._sensor_driver.interrupt_thresholds = self.get_interrupt_thresholds(next_gain_index, next_integraion_time)
+        self._set_exposure(
+            next_gain,
+            integration_time_to_atime(next_integraion_time),
+            self.get_interrupt_thresholds(next_gain_index, next_integraion_time),
+        )
 
-        self._sensor_driver.enable_interrupt()
+    def _set_exposure(self, gain, atime, thresholds):
+        """Writes a new exposure and its interrupt thresholds. While
+        acquisition runs, the exposure is handed to the acquisition loop
+        instead, which writes it between two integrations. Returns True if
+        it was written here.
+        """
+        if self._acquisition.running:
+            self._sensor_driver.configure(thresholds=thresholds)
+            self._acquisition.request_exposure(gain, atime)
+            return False
+        self._sensor_driver.configure(gain=gain, atime=atime, thresholds=thresholds)
+        return True
     
     def get_interrupt_thresholds(self, gain_index, integration_time):
         integration_count = integration_time / TIME_ONE_CYCLE
@@ -120,17 +232,50 @@ class Controller:
             high_threshold = min(MAX_SENSOR_VALUE, max(0, int(upper_saturation)))
         return (low_threshold, high_threshold)
 
+    @property
+    def samples(self):
+        return self._sensor_driver.samples
+
+    def acquire(self):
+        """Reads a new sample into the sample ring and returns it"""
+        seq = self._sensor_driver.capture()
+        self._latest_sample = self._sensor_driver.samples.sample(seq)
+        return self._latest_sample
+
+    def latest_sample(self):
+        """Returns the most recent Sample. The sensor is only read again once
+        a full integration cycle has elapsed since the last acquisition, so
+        every consumer within a cycle shares the same values. While
+        acquisition runs the ring is only read, unless it has no sample yet.
+        """
+        # Catch interrupts whose deferred handler could not be scheduled
+        self._sensor_driver.service_interrupts()
+        sample = self._latest_sample
+        latest_seq = self._sensor_driver.samples.latest_seq
+        if sample is None or sample.seq != latest_seq:
+            sample = self._sensor_driver.samples.sample(latest_seq)
+            self._latest_sample = sample
+        if self._acquisition.running and sample is not None:
+            # The acquisition loop keeps the ring current; never touch the bus here
+            return sample
+        if (
+            sample is None
+            or time.ticks_diff(time.ticks_ms(), sample.timestamp) >= self._sensor_driver.cycle_time
+        ):
+            sample = self.acquire()
+        return sample
+
     @property
     def ct(self):
-        return self._sensor_driver._temperature_and_lux_dn40()[1] 
+        return self.latest_sample().ct
 
     @property
     def lux(self):
-        return self._sensor_driver._temperature_and_lux_dn40()[0] 
+        return self.latest_sample().lux
 
     @property
     def color_raw(self):
-        return self._sensor_driver.color_raw
+        return self.latest_sample().color_raw
 
     @property
     def driver(self):
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+DN40 lux and color temperature computation for the TCS34725.
+Pure computation; does not touch the bus, so it can be shared by every
+consumer of a sample.
+
+@author: jcron
+"""
+
+TIME_ONE_CYCLE = 2.4 # milliseconds
+
+# Device specific values (DN40 Table 1 in Appendix I)
+GA = 1 # Glass Attenuation (1 for no glass) see DNS40 3.3
+DF = 310.0 # Device Factor
+R_COEF = 0.136
+G_COEF = 1.0 # used in lux computation
+B_COEF = -0.444
+CT_COEF = 3810
+CT_OFFSET = 1391
+
+def temperature_and_lux_dn40(R, G, B, C, ATIME, AGAINx):
+    """ Converts the raw RGBC values to color temperature in degrees
+    Kelvin using the algorithm described in DN40 from Taos (now AMS).
+    Also computes lux. Returns tuple with both values or tuple of Nones
+    if computation can not be done.
+
+    ATIME is the raw integration time register value, AGAINx the gain (1, 4, 16, 60).
+    """
+    ATIME_ms = (256 - ATIME) * TIME_ONE_CYCLE
+
+    #ANALOG/Digital Saturation (DN40 3.5)
+    # if ATIME_ms >  154ms; then we're dealing with digital saturation
+    # if ATIME_ms <= 154ms; then we MIGHT have analog saturation.
+    #                       in other words, the total amount accumulated
+    #                       is going to be equal to 1024 * num_cycles
+    #                       rather than the max digital value of 65535. 
+    SATURATION_LEVEL = 65535 if 256 - ATIME > 63 else 1024 * (256 - ATIME)
+
+    # Ripple Saturation (DN40 3.7)
+    # Ripple Rejection: Man-made light sources (in N.A.) will oscilate at 60 Hz
+    #                   Integration times in multiples of 50ms will remove ripple  
+    # Ripple Saturation: Occurs when the peak of a ripple is saturated, giving incorrect
+    #                    values.  integration_times > 150ms will experience digital_saturation
+    #                    before analog saturation, so we can ignore ripple saturation effects
+    if ATIME_ms < 150:
+        SATURATION_LEVEL -= SATURATION_LEVEL / 4
+
+    # Check for saturation and mark sample as invalid
+    # Extended range sensing is possible (see DN40 3.13)
+    if C >= SATURATION_LEVEL:
+        return None, None
+
+    # IR Rejection (DN40 3.1)
+    IR = (R + G + B - C) / 2 if R + G + B > C else 0.0
+    R2 = R - IR
+    G2 = G - IR
+    B2 = B - IR
+
+    # Lux Calculation (DN40 3.2)
+    G1 = R_COEF * R2 + G_COEF * G2 + B_COEF * B2
+    CPL = (ATIME_ms * AGAINx) / (GA * DF)
+    CPL = 0.001 if CPL == 0 else CPL
+    lux = G1 / CPL
+
+    #CT Calculations (DN40 3.4)
+    # Color Saturation will make this number much less acurate. See DN40 3.12
+    R2 = 0.001 if R2 == 0 else R2
+    CT = CT_COEF * B2 / R2 + CT_OFFSET
+
+    return lux, CT
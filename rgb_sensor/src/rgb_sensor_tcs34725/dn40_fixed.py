@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Integer DN40 lux and color temperature computation.
+
+The same pipeline as dn40.temperature_and_lux_dn40 (saturation check, IR
+rejection, G1, CPL, CT) in fixed point, compiled with the native emitter on
+MicroPython. For physical readings (no channel above clear) every
+intermediate value stays below 2**30, a small int, so it can run for every
+sample without feeding the garbage collector. Readings that are not
+physical can take lux past what an int32 of thousandths holds; it is
+clamped there. Viper is not used: the
+kernel needs // on ints, which not every MicroPython release flashed on
+these boards implements for viper. On CPython the kernel runs as plain
+Python, which is what tests/test_dn40_fixed.py compares against the float
+version.
+
+Results are truncated: lux to 0.001 lux, CCT to 1 K. The module imports
+nothing from the package so host scripts can load it on its own.
+
+@author: jcron
+"""
+import _thread
+from array import array
+
+try:
+    from micropython import native
+except ImportError:
+    def native(func):
+        return func
+
+# Kernel status codes
+DN40_OK = 0
+DN40_SATURATED = 1
+# R2 is zero, so there is no CCT
+DN40_NO_CT = 2
+
+# Layout of the result array
+RESULT_STATUS = 0
+RESULT_LUX_MILLI = 1
+RESULT_CT = 2
+
+
+def new_result():
+    """Returns an array suitable for dn40_into"""
+    return array('i', (0, 0, 0))
+
+
+@native
+def dn40_into(rgbc, atime, gain, out):
+    """rgbc is (red, green, blue, clear), as filled by Driver.color_raw_into.
+    Writes [status, lux in thousandths, CCT in K] into out and returns the
+    status.
+    """
+    cycles = 256 - atime
+
+    # Saturation (DN40 3.5, 3.7); exact, as 1024 * cycles is a multiple of 4
+    saturation = 65535
+    if cycles <= 63:
+        saturation = 1024 * cycles
+    if cycles <= 62:
+        # ATIME_ms < 150: ripple saturation
+        saturation -= saturation // 4
+    if rgbc[3] >= saturation:
+        out[0] = 1
+        out[1] = 0
+        out[2] = 0
+        return 1
+
+    # IR rejection (DN40 3.1) in doubled units, which keeps IR / 2 exact
+    r = rgbc[0]
+    g = rgbc[1]
+    b = rgbc[2]
+    ir2 = r + g + b - rgbc[3]
+    if ir2 < 0:
+        ir2 = 0
+    r2 = 2 * r - ir2
+    g2 = 2 * g - ir2
+    b2 = 2 * b - ir2
+
+    # G1 (DN40 3.2) times 500: the coefficients 0.136, 1 and -0.444 times 250
+    g1 = 34 * r2 + 250 * g2 - 111 * b2
+
+    # lux = G1 / CPL = G1 * 310 / (2.4 * cycles * gain), in thousandths:
+    # g1 * 775 / (3 * cycles * gain). Divided first so nothing overflows.
+    divisor = 3 * cycles * gain
+    negative = g1 < 0
+    if negative:
+        g1 = 0 - g1
+    quotient = g1 // divisor
+    if quotient > 2770945:
+        # (2**31 - 1 - 774) // 775: the result would not fit the int32 array
+        lux = 2147483647
+    else:
+        remainder = g1 - quotient * divisor
+        lux = quotient * 775 + (remainder * 775) // divisor
+    if negative:
+        lux = 0 - lux
+    out[1] = lux
+
+    # CCT (DN40 3.4); the doubled units cancel out
+    if r2 == 0:
+        out[0] = 2
+        out[2] = 0
+        return 2
+    out[0] = 0
+    out[2] = (3810 * b2) // r2 + 1391
+    return 0
+
+
+_scratch_lock = _thread.allocate_lock()
+_scratch_rgbc = array('H', (0, 0, 0, 0))
+_scratch_result = new_result()
+
+
+def result_values(result):
+    """(lux, CCT) from a dn40_into result, with None for values that
+    could not be computed
+    """
+    status = result[RESULT_STATUS]
+    if status == DN40_SATURATED:
+        return None, None
+    lux = result[RESULT_LUX_MILLI] / 1000
+    if status == DN40_NO_CT:
+        return lux, None
+    return lux, result[RESULT_CT]
+
+
+def _temperature_and_lux(rgbc, result, R, G, B, C, ATIME, AGAINx):
+    rgbc[0] = R
+    rgbc[1] = G
+    rgbc[2] = B
+    rgbc[3] = C
+    dn40_into(rgbc, ATIME, AGAINx, result)
+    return result_values(result)
+
+
+def temperature_and_lux_fixed(R, G, B, C, ATIME, AGAINx):
+    """Drop-in for dn40.temperature_and_lux_dn40: returns (lux, CCT), with
+    None for values that can not be computed.
+
+    The module's scratch buffers are used unless another thread (or a
+    scheduled callback) holds them, in which case fresh ones are allocated
+    rather than waiting.
+    """
+    if _scratch_lock.acquire(0):
+        try:
+            return _temperature_and_lux(_scratch_rgbc, _scratch_result, R, G, B, C, ATIME, AGAINx)
+        finally:
+            _scratch_lock.release()
+    return _temperature_and_lux(array('H', (0, 0, 0, 0)), new_result(), R, G, B, C, ATIME, AGAINx)
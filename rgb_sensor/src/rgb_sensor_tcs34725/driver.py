@@ -7,11 +7,18 @@ C Example: https://github.com/adafruit/Adafruit_TCS34725/
 
 @author: jcron
 """
-from machine import Pin, SoftI2C
+from machine import Pin, SoftI2C, disable_irq, enable_irq
 from micropython import const
+import micropython
 import time
 import _thread
+from array import array
 from src.utils.i2c_device import I2CDevice
+from src.rgb_sensor_tcs34725.dn40 import TIME_ONE_CYCLE
+from src.rgb_sensor_tcs34725.dn40_fixed import dn40_into, new_result, result_values
+from src.rgb_sensor_tcs34725.exposure import saturation
+from src.rgb_sensor_tcs34725.sample import Sample
+from src.rgb_sensor_tcs34725.ring_buffer import SampleRing
 
 ADDR_ENABLE_REG = const(0x00)
 ENABLE_POWER_BIT = const(0x01)
@@ -40,6 +47,18 @@ LONG_WAIT_BIT = const(0x02)
 ADDR_CONTROL_REG = const(0x0F)
 GAINS = (1, 4, 16, 60)
 
+# Configuration registers 0x00-0x0F are only written by this driver and
+# are mirrored in a write-through shadow.
+SHADOW_REGISTER_COUNT = const(0x10)
+# Runs of writable configuration registers. 0x02, 0x08-0x0B and 0x0E are
+# reserved and are never written, so an auto-increment burst can not span them.
+CONFIGURATION_BURST_RANGES = (
+    (ADDR_ENABLE_REG, ADDR_RGBC_INTEGRATION_TIME + 1),
+    (ADDR_WAIT_TIME_REG, ADDR_INTERRUPT_THRESHOLD_HIGH + 2),
+    (ADDR_INTERRUPT_PERSISTANCE_FILTER, ADDR_WAIT_CONFIGURATION_REGISTER + 1),
+    (ADDR_CONTROL_REG, ADDR_CONTROL_REG + 1),
+)
+
 ADDR_DEVICE_ID  = const(0x12)
 ADDR_STATUS_REG = const(0x13)
 STATUS_INTEGRATION_VALID_BIT   = const(0x01)
@@ -50,7 +69,6 @@ ADDR_DATA_READ_BYTE_RED   = const(0x16)
 ADDR_DATA_READ_BYTE_GREEN = const(0x18)
 ADDR_DATA_READ_BYTE_BLUE  = const(0x1A)
 
-TIME_ONE_CYCLE = 2.4 # milliseconds
 LONG_WAIT_MULTIPLIER = const(12)
 
 COMMAND_BIT    = const(0x80)
@@ -58,6 +76,30 @@ COMMAND_SPECIAL_FUNCTION = const(0x60)
 COMMAND_AUTO_INCREMENT = const(0x20)
 COMMAND_CLEAR_INTERRUPT = const(0x06)
 
+SAMPLE_RING_CAPACITY = const(64)
+
+def integration_time_to_atime(integration_time_ms):
+    integration_time_count = int(integration_time_ms / TIME_ONE_CYCLE)
+    return 255 - max(0, min(255, integration_time_count))
+
+def wait_time_to_wtime(wait_time_ms):
+    """Returns (WTIME register value, long wait flag) for a wait time."""
+    wait_time_count = int(wait_time_ms / TIME_ONE_CYCLE)
+    long_wait = wait_time_count > 256
+    if long_wait:
+        wait_time_count = int(wait_time_ms / (LONG_WAIT_MULTIPLIER * TIME_ONE_CYCLE))
+    return (256 - max(1, min(256, wait_time_count)), long_wait)
+
+def _decode_rgbc(raw, offset, buf):
+    """Decodes the little-endian CDATA..BDATA words at raw[offset:] into
+    buf as (red, green, blue, clear)
+    """
+    buf[0] = (raw[offset + 3] << 8) | raw[offset + 2]
+    buf[1] = (raw[offset + 5] << 8) | raw[offset + 4]
+    buf[2] = (raw[offset + 7] << 8) | raw[offset + 6]
+    buf[3] = (raw[offset + 1] << 8) | raw[offset]
+    return buf
+
 class Driver:
     i2c_freq = 9600
 
@@ -65,27 +107,142 @@ class Driver:
     def __init__(self, i2c, led_pin, interrupt_pin):
         self.interrupt_saturation_tolerance = 0.0
         self._BUFFER = bytearray(3)
+        # Exactly sized for the per-sample transactions, which pass whole
+        # buffers: a narrower range would be sliced, and slicing allocates
+        self._COMMAND_BUFFER = bytearray(1)
+        self._WRITE8_BUFFER = bytearray(2)
+        # CDATAL..BDATAH from a single burst read, and its decoded (r, g, b, c).
+        # Shared by every thread, so they are only used with the device held.
+        self._RGBC_BUFFER = bytearray(8)
+        # STATUS followed by CDATAL..BDATAH
+        self._STATUS_RGBC_BUFFER = bytearray(9)
+        self._rgbc = array('H', (0, 0, 0, 0))
+        self._dn40_result = new_result()
+        self._shadow = bytearray(SHADOW_REGISTER_COUNT)
+        self._shadow_valid = False
+        # Incremented on every write to the configuration registers
+        self.config_version = 0
+        self._pending = bytearray(SHADOW_REGISTER_COUNT)
+        self._BURST_BUFFER = bytearray(SHADOW_REGISTER_COUNT + 1)
+
+        # Interrupt pipeline: the IRQ only timestamps and schedules _service_interrupt
+        self.samples = SampleRing(SAMPLE_RING_CAPACITY)
+        self.capture_on_interrupt = True
+        self.interrupts_received = 0
+        # Interrupts whose handler could not be scheduled right away. They are
+        # not lost: service_interrupts() handles them later.
+        self.schedule_failures = 0
+        # Scheduled handlers that found the bus held and left their
+        # interrupts pending
+        self.services_deferred = 0
+        self._interrupts_pending = 0
+        self._service_scheduled = False
+        self._interrupt_ticks = array('L', (0,))
+        self._interrupt_callbacks = []
+        # Bound methods allocate; create them once, outside of interrupt context
+        self._service_interrupt_ref = self._service_interrupt
+        micropython.alloc_emergency_exception_buf(100)
 
         # Initialize pins
         self._led_pin = Pin(led_pin, Pin.OUT)
         self._interrupt_pin = Pin(interrupt_pin, Pin.IN, Pin.PULL_UP)
-        self._interrupt_pin.irq(trigger=Pin.IRQ_FALLING, handler=self.get_clear_interrupt_handler())
-        self._interrupt_callbacks = []
+        self._interrupt_pin.irq(trigger=Pin.IRQ_FALLING, handler=self._on_interrupt)
 
         device_addr = i2c.scan()[0]
         self.device = I2CDevice(i2c, device_addr)
+        self.refresh()
 
     def register_interrupt_callback(self, callback):
         print("adding callback")
         self._interrupt_callbacks.append(callback)
 
-    def get_clear_interrupt_handler(self):
-        def clear_interrupt_handler(p):
-            print("Interrupt Triggered", p)
-            for callback in self._interrupt_callbacks:
-                callback()
-
-        return clear_interrupt_handler
+    def _on_interrupt(self, pin):
+        """Pin IRQ. Records when it fired and defers everything else to
+        _service_interrupt; must not allocate or touch the bus.
+        """
+        self._interrupt_ticks[0] = time.ticks_ms()
+        self.interrupts_received += 1
+        self._interrupts_pending += 1
+        if not self._service_scheduled:
+            try:
+                micropython.schedule(self._service_interrupt_ref, 0)
+                self._service_scheduled = True
+            except RuntimeError:
+                # Schedule queue is full. The interrupt stays pending and is
+                # serviced by the next schedule or service_interrupts() call.
+                self.schedule_failures += 1
+
+    def _service_interrupt(self, _):
+        self._service_scheduled = False
+        # Scheduled handlers run between two bytecodes of the main thread,
+        # which may be inside `with self.device`; waiting for the lock would
+        # then never end. Leave the interrupts pending for the next
+        # service_interrupts() call instead.
+        i2c = self.device.i2c
+        if not i2c.try_lock():
+            self.services_deferred += 1
+            return
+        i2c.unlock()
+        self.service_interrupts()
+
+    def service_interrupts(self):
+        """Handles pending clear channel interrupts outside of interrupt
+        context: captures a sample stamped with the interrupt time and runs
+        the registered callbacks. Returns the number of interrupts handled.
+        """
+        irq_state = disable_irq()
+        pending = self._interrupts_pending
+        self._interrupts_pending = 0
+        timestamp = self._interrupt_ticks[0]
+        enable_irq(irq_state)
+        if not pending:
+            return 0
+
+        if self.capture_on_interrupt:
+            self.capture(timestamp)
+        for callback in self._interrupt_callbacks:
+            callback()
+        return pending
+
+    # Register Shadow
+    def refresh(self):
+        """Reloads the shadow of the configuration registers (0x00-0x0F)
+        with a single auto-increment read.
+        """
+        with self.device as i2c:
+            self._BUFFER[0] = (COMMAND_BIT | COMMAND_AUTO_INCREMENT | ADDR_ENABLE_REG) & 0xFF
+            i2c.write_then_readinto(self._BUFFER, self._shadow, out_end=1)
+        self._shadow_valid = True
+
+    def invalidate(self):
+        """Marks the shadow as stale. The next cached read refreshes it.
+        Use after anything other than this driver may have changed the chip
+        (power loss, another bus master).
+        """
+        self._shadow_valid = False
+
+    def cached8(self, addr):
+        if not self._shadow_valid:
+            self.refresh()
+        return self._shadow[addr]
+
+    def cached16(self, addr):
+        if not self._shadow_valid:
+            self.refresh()
+        return (self._shadow[addr + 1] << 8) | self._shadow[addr]
+
+    def _update_enable_reg(self, set_bits, clear_bits=0):
+        """Read-modify-write of ENABLE from the shadow. Both threads change
+        ENABLE (the acquisition loop restarts integrations), so the shadow
+        read, the write and the shadow update happen with the device held.
+        """
+        if not self._shadow_valid:
+            self.refresh()
+        with self.device as i2c:
+            enable_reg_value = self._shadow[ADDR_ENABLE_REG]
+            next_value = (enable_reg_value | set_bits) & ~clear_bits
+            if next_value != enable_reg_value:
+                self._write8_held(i2c, ADDR_ENABLE_REG, next_value)
 
     # Lowest Level Communications
     def read8(self, addr):
@@ -102,9 +259,16 @@ class Driver:
 
     def write8(self, addr, data):
         with self.device as i2c:
-            self._BUFFER[0] = (COMMAND_BIT | addr) & 0xFF
-            self._BUFFER[1] = data & 0xFF
-            i2c.write(self._BUFFER, end=2)
+            self._write8_held(i2c, addr, data)
+
+    def _write8_held(self, i2c, addr, data):
+        buf = self._WRITE8_BUFFER
+        buf[0] = (COMMAND_BIT | addr) & 0xFF
+        buf[1] = data & 0xFF
+        i2c.write(buf)
+        if addr < SHADOW_REGISTER_COUNT:
+            self._shadow[addr] = data & 0xFF
+            self.config_version += 1
 
     def write16(self, addr, data):
         with self.device as i2c:
@@ -112,6 +276,68 @@ class Driver:
             self._BUFFER[1] = data & 0xFF
             self._BUFFER[2] = (data >> 8 ) & 0xFF
             i2c.write(self._BUFFER)
+        if addr < SHADOW_REGISTER_COUNT - 1:
+            self._shadow[addr] = data & 0xFF
+            self._shadow[addr + 1] = (data >> 8) & 0xFF
+            self.config_version += 1
+
+    def read_rgbc_into(self, buf):
+        """Reads CDATAL..BDATAH (0x14-0x1B) in a single auto-increment transaction.
+        Reading CDATAL latches the upper bytes, so all four channels come from
+        the same integration cycle.
+        """
+        with self.device as i2c:
+            self._BUFFER[0] = (COMMAND_BIT | COMMAND_AUTO_INCREMENT | ADDR_DATA_READ_BYTE_CLEAR) & 0xFF
+            i2c.write_then_readinto(self._BUFFER, buf, out_end=1, in_end=8)
+
+    def read_status_rgbc_into(self, buf):
+        """Reads STATUS and CDATAL..BDATAH (0x13-0x1B) in a single
+        auto-increment transaction.
+        """
+        with self.device as i2c:
+            self._BUFFER[0] = (COMMAND_BIT | COMMAND_AUTO_INCREMENT | ADDR_STATUS_REG) & 0xFF
+            i2c.write_then_readinto(self._BUFFER, buf, out_end=1, in_end=9)
+
+    def _read_rgbc_held(self, i2c, buf):
+        """read_rgbc_into decoded into buf, for callers already holding the
+        device: the shared raw buffer is decoded before another thread can
+        read into it.
+        """
+        raw = self._RGBC_BUFFER
+        command = self._COMMAND_BUFFER
+        command[0] = (COMMAND_BIT | COMMAND_AUTO_INCREMENT | ADDR_DATA_READ_BYTE_CLEAR) & 0xFF
+        i2c.write_then_readinto(command, raw)
+        return _decode_rgbc(raw, 0, buf)
+
+    def _read_rgbc_if_valid_held(self, i2c, buf):
+        """_read_rgbc_held with STATUS: None, leaving buf alone, when
+        AVALID is clear
+        """
+        raw = self._STATUS_RGBC_BUFFER
+        command = self._COMMAND_BUFFER
+        command[0] = (COMMAND_BIT | COMMAND_AUTO_INCREMENT | ADDR_STATUS_REG) & 0xFF
+        i2c.write_then_readinto(command, raw)
+        if not raw[0] & STATUS_INTEGRATION_VALID_BIT:
+            return None
+        return _decode_rgbc(raw, 1, buf)
+
+    def write_burst(self, addr, data, end):
+        """Writes data[addr:end] to registers addr..end-1 in a single
+        auto-increment transaction.
+        """
+        with self.device as i2c:
+            self._write_burst_held(i2c, addr, data, end)
+
+    def _write_burst_held(self, i2c, addr, data, end):
+        count = end - addr
+        self._BURST_BUFFER[0] = (COMMAND_BIT | COMMAND_AUTO_INCREMENT | addr) & 0xFF
+        for i in range(count):
+            self._BURST_BUFFER[i + 1] = data[addr + i]
+        i2c.write(self._BURST_BUFFER, end=count + 1)
+        if end <= SHADOW_REGISTER_COUNT:
+            for i in range(addr, end):
+                self._shadow[i] = data[i]
+            self.config_version += 1
 
     def clear_interrupt(self):
         with self.device as i2c:
@@ -119,47 +345,151 @@ class Driver:
             i2c.write(self._BUFFER, end=1)
 
     # State
+    def color_raw_into(self, buf):
+        """Fills buf, an array('H') of at least 4 items, with (red, green, blue, clear).
+        Does not allocate.
+        """
+        with self.device as i2c:
+            return self._read_rgbc_held(i2c, buf)
+
+    def color_raw_if_valid_into(self, buf):
+        """color_raw_into with STATUS read in the same transaction: returns
+        None, leaving buf alone, when AVALID is clear. Does not allocate.
+        """
+        with self.device as i2c:
+            return self._read_rgbc_if_valid_held(i2c, buf)
+
     @property
     def color_raw(self):
-        clear  = self.read16(ADDR_DATA_READ_BYTE_CLEAR)
-        red    = self.read16(ADDR_DATA_READ_BYTE_RED)
-        green  = self.read16(ADDR_DATA_READ_BYTE_GREEN)
-        blue   = self.read16(ADDR_DATA_READ_BYTE_BLUE)
-
-        return (red, green, blue, clear)
+        with self.device as i2c:
+            rgbc = self._read_rgbc_held(i2c, self._rgbc)
+            return (rgbc[0], rgbc[1], rgbc[2], rgbc[3])
     
+    def configure(self, *, gain=None, atime=None, wtime=None, long_wait=None,
+                  thresholds=None, persistence=None):
+        """Applies any combination of configuration changes at once.
+
+        Only registers whose value changes are written, and each run of
+        contiguous changed registers goes out as one auto-increment burst, so
+        the chip never integrates with a half applied configuration.
+        Returns the number of bus transactions used.
+
+        gain: 1, 4, 16 or 60
+        atime/wtime: raw ATIME/WTIME register values
+        long_wait: sets or clears WLONG
+        thresholds: (low, high) clear channel interrupt thresholds
+        persistence: raw PERS register value (page 17 of spec sheet)
+
+        The pending copy is taken and written with the device held, so an
+        ENABLE change from another thread is not written back over.
+        """
+        if not self._shadow_valid:
+            self.refresh()
+        with self.device as i2c:
+            return self._configure_held(i2c, gain, atime, wtime, long_wait, thresholds, persistence)
+
+    def _configure_held(self, i2c, gain, atime, wtime, long_wait, thresholds, persistence):
+        pending = self._pending
+        pending[:] = self._shadow
+        if gain is not None:
+            pending[ADDR_CONTROL_REG] = GAINS.index(gain)
+        if atime is not None:
+            pending[ADDR_RGBC_INTEGRATION_TIME] = atime & 0xFF
+        if wtime is not None:
+            pending[ADDR_WAIT_TIME_REG] = wtime & 0xFF
+        if long_wait is not None:
+            pending[ADDR_WAIT_CONFIGURATION_REGISTER] = LONG_WAIT_BIT if long_wait else 0x00
+        if thresholds is not None:
+            low_threshold, high_threshold = thresholds
+            pending[ADDR_INTERRUPT_THRESHOLD_LOW] = low_threshold & 0xFF
+            pending[ADDR_INTERRUPT_THRESHOLD_LOW + 1] = (low_threshold >> 8) & 0xFF
+            pending[ADDR_INTERRUPT_THRESHOLD_HIGH] = high_threshold & 0xFF
+            pending[ADDR_INTERRUPT_THRESHOLD_HIGH + 1] = (high_threshold >> 8) & 0xFF
+        if persistence is not None:
+            pending[ADDR_INTERRUPT_PERSISTANCE_FILTER] = persistence & 0x0F
+
+        transactions = 0
+        for start, end in CONFIGURATION_BURST_RANGES:
+            first = -1
+            last = -1
+            for addr in range(start, end):
+                if pending[addr] != self._shadow[addr]:
+                    if first < 0:
+                        first = addr
+                    last = addr
+            if first >= 0:
+                self._write_burst_held(i2c, first, pending, last + 1)
+                transactions += 1
+        return transactions
+
+    def set_exposure(self, gain, atime):
+        """Writes gain and ATIME, skipping either if unchanged. A lighter
+        configure, without the pending copy and burst planning, for loops
+        that switch exposure every integration.
+        """
+        gain_index = GAINS.index(gain)
+        if not self._shadow_valid:
+            self.refresh()
+        with self.device as i2c:
+            if self._shadow[ADDR_RGBC_INTEGRATION_TIME] != atime:
+                self._write8_held(i2c, ADDR_RGBC_INTEGRATION_TIME, atime)
+            if self._shadow[ADDR_CONTROL_REG] != gain_index:
+                self._write8_held(i2c, ADDR_CONTROL_REG, gain_index)
+
+    @property
+    def cycle_time(self):
+        """Milliseconds between the start of two integrations (ATIME plus
+        WTIME when waiting is enabled). Computed from the shadow.
+        """
+        cycle_time = self.integration_count * TIME_ONE_CYCLE
+        if self.is_wait_between_integration_enabled:
+            cycle_time += self.wait_time
+        return cycle_time
+
+    @property
+    def saturation_limit(self):
+        """Full scale of a channel at the current ATIME: analog saturation
+        up to 63 cycles, digital above (DN40 3.5)
+        """
+        return saturation(self.integration_count)
+
     @property
     def led_state(self):
         return self._led_pin.value()
 
     @property
     def is_enabled(self):
-        return bool(self.read8(ADDR_ENABLE_REG) & ENABLE_POWER_BIT & ENABLE_RGBC_BIT)
+        return bool(self.cached8(ADDR_ENABLE_REG) & ENABLE_POWER_BIT & ENABLE_RGBC_BIT)
     
     @property
     def is_power_on(self):
-        return bool(self.read8(ADDR_ENABLE_REG) & ENABLE_POWER_BIT)
+        return bool(self.cached8(ADDR_ENABLE_REG) & ENABLE_POWER_BIT)
 
     @property
     def is_adc_enabled(self):
-        return bool(self.read8(ADDR_ENABLE_REG) & ENABLE_RGBC_BIT)
+        return bool(self.cached8(ADDR_ENABLE_REG) & ENABLE_RGBC_BIT)
 
     @property
     def is_integration_complete(self):
         return bool(self.read8(ADDR_STATUS_REG) & STATUS_INTEGRATION_VALID_BIT)
 
+    def wait_for_integration(self):
+        """Blocks until AVALID is set, checking once per expected cycle"""
+        while not self.is_integration_complete:
+            time.sleep_ms(max(1, int(self.cycle_time)))
+
     @property
     def is_wait_between_integration_enabled(self):
-        return bool(self.read8(ADDR_ENABLE_REG) & ENABLE_WAIT_BETWEEN_INTEGRATIONS)
+        return bool(self.cached8(ADDR_ENABLE_REG) & ENABLE_WAIT_BETWEEN_INTEGRATIONS)
 
     @property
     def is_interrupt_enabled(self):
-        return bool(self.read8(ADDR_ENABLE_REG) & ENABLE_CLEAR_INTERRUPT_BIT)
+        return bool(self.cached8(ADDR_ENABLE_REG) & ENABLE_CLEAR_INTERRUPT_BIT)
 
     @property
     def interrupt_thresholds(self):
-        low_threshold  = self.read16(ADDR_INTERRUPT_THRESHOLD_LOW)
-        high_threshold = self.read16(ADDR_INTERRUPT_THRESHOLD_HIGH)
+        low_threshold  = self.cached16(ADDR_INTERRUPT_THRESHOLD_LOW)
+        high_threshold = self.cached16(ADDR_INTERRUPT_THRESHOLD_HIGH)
 
         return (low_threshold, high_threshold)
 
@@ -171,7 +501,7 @@ class Driver:
 
     @property
     def interrupt_persistance_filter(self):
-        return self.read8(ADDR_INTERRUPT_PERSISTANCE_FILTER)
+        return self.cached8(ADDR_INTERRUPT_PERSISTANCE_FILTER)
 
     @interrupt_persistance_filter.setter
     def interrupt_persistance_filter(self, interrupt_persistance_filter):
@@ -182,11 +512,11 @@ class Driver:
     
     @property
     def long_wait_set(self):
-        return bool(self.read8(ADDR_WAIT_CONFIGURATION_REGISTER) & LONG_WAIT_BIT)
+        return bool(self.cached8(ADDR_WAIT_CONFIGURATION_REGISTER) & LONG_WAIT_BIT)
 
     @property
     def wait_time(self):
-        wait_reg = self.read8(ADDR_WAIT_TIME_REG)
+        wait_reg = self.cached8(ADDR_WAIT_TIME_REG)
         wait_count = 256 - wait_reg
         if self.long_wait_set:
             return (wait_count * TIME_ONE_CYCLE * LONG_WAIT_MULTIPLIER)
@@ -195,21 +525,18 @@ class Driver:
 
     @wait_time.setter
     def wait_time(self, wait_time_ms):
-        wait_time_count = int(wait_time_ms / TIME_ONE_CYCLE)
-
-        if wait_time_count > 256:
+        wait_time_2s_complement, long_wait = wait_time_to_wtime(wait_time_ms)
+        if long_wait:
             self.set_long_wait()
-            wait_time_count = wait_time_ms / (LONG_WAIT_MULTIPLIER * TIME_ONE_CYCLE)
         else:
             self.clear_long_wait()
 
-        wait_time_2s_complement = 256 - max(0, min(256, wait_time_count))
         print("wait time set", wait_time_ms, wait_time_2s_complement)
         self.write8(ADDR_WAIT_TIME_REG, wait_time_2s_complement)
 
     @property
     def gain(self):
-        return GAINS[self.read8(ADDR_CONTROL_REG)]
+        return GAINS[self.cached8(ADDR_CONTROL_REG) & 0x03]
 
     @gain.setter
     def gain(self, gain):
@@ -219,7 +546,7 @@ class Driver:
 
     @property
     def ATIME(self):
-        return self.read8(ADDR_RGBC_INTEGRATION_TIME)
+        return self.cached8(ADDR_RGBC_INTEGRATION_TIME)
 
     @ATIME.setter
     def ATIME(self, atime):
@@ -239,14 +566,13 @@ class Driver:
     @property
     def integration_time(self):
         print("integration time")
-        atime = self.read8(ADDR_RGBC_INTEGRATION_TIME)
+        atime = self.cached8(ADDR_RGBC_INTEGRATION_TIME)
         print("integration time", atime)
         return (255 - atime) * TIME_ONE_CYCLE
 
     @integration_time.setter
     def integration_time(self, integration_time_ms):
-        integration_time_count = int(integration_time_ms / TIME_ONE_CYCLE)
-        self.integration_count = max(0, min(256, integration_time_count))
+        self.ATIME = integration_time_to_atime(integration_time_ms)
 
     # LED Control
     def turn_on_led(self):
@@ -264,26 +590,21 @@ class Driver:
     # ENABLE/DISABLE
     def power_on(self):
         print("power on")
-        enable_reg_value = self.read8(ADDR_ENABLE_REG)
-        self.write8(ADDR_ENABLE_REG, enable_reg_value | ENABLE_POWER_BIT)
+        self._update_enable_reg(ENABLE_POWER_BIT)
         time.sleep(0.003)
 
     def enable_rgbc(self):
         print("enable_rgbc")
-        enable_reg_value = self.read8(ADDR_ENABLE_REG)
-        print('enable_reg_value', enable_reg_value)
-        self.write8(ADDR_ENABLE_REG, enable_reg_value | ENABLE_RGBC_BIT)
+        self._update_enable_reg(ENABLE_RGBC_BIT)
         print('complete')
 
     def enable_wait_between_integrations(self):
         print("enable wait")
-        enable_reg_value = self.read8(ADDR_ENABLE_REG)
-        self.write8(ADDR_ENABLE_REG, enable_reg_value | ENABLE_WAIT_BETWEEN_INTEGRATIONS)
+        self._update_enable_reg(ENABLE_WAIT_BETWEEN_INTEGRATIONS)
 
     def enable_interrupt(self):
         print("enable interrupt")
-        enable_reg_value = self.read8(ADDR_ENABLE_REG)
-        self.write8(ADDR_ENABLE_REG, (enable_reg_value | ENABLE_CLEAR_INTERRUPT_BIT))
+        self._update_enable_reg(ENABLE_CLEAR_INTERRUPT_BIT)
 
     def set_long_wait(self):
         print("enable long wait")
@@ -291,86 +612,94 @@ class Driver:
 
     def power_off(self):
         print("power off")
-        enable_reg_value = self.read8(ADDR_ENABLE_REG)
-        self.write8(ADDR_ENABLE_REG, enable_reg_value & ~ENABLE_POWER_BIT)
+        self._update_enable_reg(0, ENABLE_POWER_BIT)
 
     def disable_rgbc(self):
         print("disable rgbc")
-        enable_reg_value = self.read8(ADDR_ENABLE_REG)
-        self.write8(ADDR_ENABLE_REG, enable_reg_value & ~ENABLE_RGBC_BIT)
+        self._update_enable_reg(0, ENABLE_RGBC_BIT)
+
+    def restart_integration(self):
+        """Cycles AEN so a new integration starts now, which also clears
+        AVALID. The result is ready one init cycle plus the integration time
+        later. Uses the repeated byte protocol to write ENABLE twice in a
+        single transaction. The ENABLE shadow is read and updated with the
+        device held (see _update_enable_reg).
+        """
+        if not self._shadow_valid:
+            self.refresh()
+        with self.device as i2c:
+            enable_reg_value = self._shadow[ADDR_ENABLE_REG]
+            self._BUFFER[0] = (COMMAND_BIT | ADDR_ENABLE_REG) & 0xFF
+            self._BUFFER[1] = enable_reg_value & ~ENABLE_RGBC_BIT
+            self._BUFFER[2] = enable_reg_value | ENABLE_RGBC_BIT
+            i2c.write(self._BUFFER)
+            if not enable_reg_value & ENABLE_RGBC_BIT:
+                self._shadow[ADDR_ENABLE_REG] = enable_reg_value | ENABLE_RGBC_BIT
+                self.config_version += 1
 
     def disable_wait_between_integrations(self):
         print("disable wait")
-        enable_reg_value = self.read8(ADDR_ENABLE_REG)
-        self.write8(ADDR_ENABLE_REG, (enable_reg_value & ~ENABLE_WAIT_BETWEEN_INTEGRATIONS))
+        self._update_enable_reg(0, ENABLE_WAIT_BETWEEN_INTEGRATIONS)
 
     def disable_interrupt(self):
         print("disable interrupt")
-        enable_reg_value = self.read8(ADDR_ENABLE_REG)
-        self.write8(ADDR_ENABLE_REG, (enable_reg_value & ~ENABLE_CLEAR_INTERRUPT_BIT))
+        self._update_enable_reg(0, ENABLE_CLEAR_INTERRUPT_BIT)
 
     def clear_long_wait(self):
         print("clear long wait")
         self.write8(ADDR_WAIT_CONFIGURATION_REGISTER, 0x00)
 
     # Compute
+    # The methods below use the shared decode buffers, so they keep the
+    # device held until they are done with them. Gain and ATIME are read
+    # first: a stale shadow is refreshed over the bus.
     def _temperature_and_lux_dn40(self):
-        """ Converts the raw RGBC values to color temperature in degrees
-        Kelvin using the algorithm described in DN40 from Taos (now AMS).
-        Also computes lux. Returns tuple with both values or tuple of Nones
-        if computation can not be done.
+        """ Converts the current raw RGBC values to color temperature in degrees
+        Kelvin and lux. See dn40_fixed.dn40_into.
+        """
+        atime = self.ATIME
+        gain = self.gain
+        with self.device as i2c:
+            rgbc = self._read_rgbc_held(i2c, self._rgbc)
+            dn40_into(rgbc, atime, gain, self._dn40_result)
+            return result_values(self._dn40_result)
+
+    def capture(self, timestamp=None):
+        """Reads the four channels into the sample ring and returns the new
+        sequence number. Does not allocate.
+        """
+        gain = self.gain
+        atime = self.ATIME
+        if timestamp is None:
+            timestamp = time.ticks_ms()
+        with self.device as i2c:
+            rgbc = self._read_rgbc_held(i2c, self._rgbc)
+            return self.samples.push(rgbc[0], rgbc[1], rgbc[2], rgbc[3], gain, atime, timestamp)
+
+    def capture_if_valid(self, timestamp=None):
+        """Reads STATUS and the four channels in one transaction. When AVALID
+        is set the sample is pushed into the ring and its sequence number is
+        returned, otherwise returns 0. Does not allocate.
         """
-        ATIME = self.ATIME
-        ATIME_ms = (256 - ATIME) * TIME_ONE_CYCLE
-        AGAINx = self.gain
-        R, G, B, C = self.color_raw
-
-        # Device specific values (DN40 Table 1 in Appendix I)
-        GA = 1 # Glass Attenuation (1 for no glass) see DNS40 3.3
-        DF = 310.0 # Device Factor
-        R_Coef = 0.136
-        G_Coef = 1.0 # used in lux computation
-        B_Coef = -0.444
-        CT_Coef = 3810
-        CT_Offset = 1391
-
-        #ANALOG/Digital Saturation (DN40 3.5)
-        # if ATIME_ms >  154ms; then we're dealing with digital saturation
-        # if ATIME_ms <= 154ms; then we MIGHT have analog saturation.
-        #                       in other words, the total amount accumulated
-        #                       is going to be equal to 1024 * num_cycles
-        #                       rather than the max digital value of 65535. 
-        SATURATION_LEVEL = 65535 if 256 - ATIME > 63 else 1024 * (256 - ATIME)
-
-        # Ripple Saturation (DN40 3.7)
-        # Ripple Rejection: Man-made light sources (in N.A.) will oscilate at 60 Hz
-        #                   Integration times in multiples of 50ms will remove ripple  
-        # Ripple Saturation: Occurs when the peak of a ripple is saturated, giving incorrect
-        #                    values.  integration_times > 150ms will experience digital_saturation
-        #                    before analog saturation, so we can ignore ripple saturation effects
-        if ATIME_ms < 150:
-            SATURATION_LEVEL -= SATURATION_LEVEL / 4
-        
-        # Check for saturation and mark sample as invalid
-        # Extended range sensing is possible (see DN40 3.13)
-        if C >= SATURATION_LEVEL:
-            return None, None
-
-        # IR Rejection (DN40 3.1)
-        IR = (R + G + B - C) / 2 if R + G + B > C else 0.0
-        R2 = R - IR
-        G2 = G - IR
-        B2 = B - IR
-
-        # Lux Calculation (DN40 3.2)
-        G1 = R_Coef * R2 + G_Coef * G2 + B_Coef * B2
-        CPL = (ATIME_ms * AGAINx) / (GA * DF)
-        CPL = 0.001 if CPL == 0 else CPL
-        lux = G1 / CPL
-
-        #CT Calculations (DN40 3.4)
-        # Color Saturation will make this number much less acurate. See DN40 3.12
-        R2 = 0.001 if R2 == 0 else R2
-        CT = CT_Coef * B2 / R2 + CT_Offset
-
-        return lux, CT
+        gain = self.gain
+        atime = self.ATIME
+        if timestamp is None:
+            timestamp = time.ticks_ms()
+        with self.device as i2c:
+            rgbc = self._read_rgbc_if_valid_held(i2c, self._rgbc)
+            if rgbc is None:
+                return 0
+            return self.samples.push(rgbc[0], rgbc[1], rgbc[2], rgbc[3], gain, atime, timestamp)
+
+    def sample(self, timestamp=None, seq=0):
+        """Reads the four channels in one transaction and returns a Sample
+        tagged with the (cached) gain and ATIME they were taken with.
+        """
+        gain = self.gain
+        atime = self.ATIME
+        if timestamp is None:
+            timestamp = time.ticks_ms()
+        with self.device as i2c:
+            rgbc = self._read_rgbc_held(i2c, self._rgbc)
+            r, g, b, c = rgbc[0], rgbc[1], rgbc[2], rgbc[3]
+        return Sample(r, g, b, c, gain, atime, timestamp, seq)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Compact binary export of the sample ring.
+
+A batch is a fixed header followed by fixed-width little-endian records:
+
+    header: magic 'TCSS', version, record size, record count,
+            first seq, latest seq, dropped
+    record: seq (low 16 bits), timestamp (ticks_ms), r, g, b, c, gain, atime
+
+Records are in sequence order. The full sequence number of a record is
+first_seq + ((seq16 - first_seq) & 0xFFFF). `dropped` counts requested
+samples that were already overwritten in the ring.
+
+@author: jcron
+"""
+import struct
+from src.rgb_sensor_tcs34725.ring_buffer import new_sample_record
+
+SAMPLES_CONTENT_TYPE = "application/vnd.tcs34725.samples"
+SAMPLES_MAGIC = b"TCSS"
+SAMPLES_VERSION = 1
+HEADER_FORMAT = "<4sBBHIII"
+RECORD_FORMAT = "<HIHHHHBB"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+
+def pack_samples(ring, since=0):
+    """Packs every sample in the ring with a sequence number greater than
+    `since` into a single batch. Returns a memoryview of the batch.
+    """
+    latest_seq = ring.latest_seq
+    first_seq = max(since + 1, ring.oldest_seq)
+    dropped = first_seq - since - 1
+    count = max(0, latest_seq - first_seq + 1)
+
+    buf = bytearray(HEADER_SIZE + count * RECORD_SIZE)
+    record = new_sample_record()
+    packed = 0
+    offset = HEADER_SIZE
+    for seq in range(first_seq, latest_seq + 1):
+        if not ring.read_into(seq, record):
+            # Overwritten while packing
+            dropped += 1
+            continue
+        if packed == 0:
+            first_seq = seq
+        struct.pack_into(
+            RECORD_FORMAT, buf, offset,
+            seq & 0xFFFF, record[6] & 0xFFFFFFFF,
+            record[0], record[1], record[2], record[3], record[4], record[5]
+        )
+        packed += 1
+        offset += RECORD_SIZE
+
+    struct.pack_into(
+        HEADER_FORMAT, buf, 0,
+        SAMPLES_MAGIC, SAMPLES_VERSION, RECORD_SIZE, packed,
+        first_seq, latest_seq, dropped
+    )
+    return memoryview(buf)[:offset]
+
+
+def unpack_samples(data):
+    """Decodes a batch. Returns (header, records) where header is a dict and
+    records is a list of (seq, timestamp, r, g, b, c, gain, atime) tuples.
+    """
+    magic, version, record_size, count, first_seq, latest_seq, dropped = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != SAMPLES_MAGIC or version != SAMPLES_VERSION:
+        raise ValueError("Not a version {} sample batch".format(SAMPLES_VERSION))
+
+    records = []
+    offset = HEADER_SIZE
+    for _ in range(count):
+        record = struct.unpack_from(RECORD_FORMAT, data, offset)
+        seq = first_seq + ((record[0] - first_seq) & 0xFFFF)
+        records.append((seq,) + tuple(record[1:]))
+        offset += record_size
+
+    header = {
+        'first_seq': first_seq,
+        'latest_seq': latest_seq,
+        'dropped': dropped,
+        'count': count,
+    }
+    return header, records
+
+
+def samples_as_json(ring, since=0):
+    """The same batch as a JSON-serializable dict, for clients that do not
+    accept the binary format.
+    """
+    header, records = unpack_samples(pack_samples(ring, since))
+    header['samples'] = [list(record) for record in records]
+    return header
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Exposure ladder for predictive auto-exposure.
+
+Each rung is a (gain, ATIME) pair; rungs are in order of sensitivity
+(gain x integration cycles). For every rung the clear count it saturates
+at, the count calibration aims for and the interrupt thresholds are
+computed once, in integers, when the ladder is built.
+
+Counts scale with sensitivity, so one clear reading predicts the count on
+every rung: select() picks the most sensitive rung whose predicted count
+stays under its target (failing that, under its high threshold), and
+calibration jumps there directly. A saturated
+reading only gives a lower bound, so it jumps to the least sensitive rung
+with PROBE_THRESHOLDS, which interrupt on its first unsaturated reading;
+that reading then places the next jump.
+
+Hysteresis is in the thresholds. A rung's low threshold is half the count
+that would put the next rung at its target, so a move up lands well inside
+the next rung's window and a small dip does not move back and forth. A
+rung's high threshold is below the count it saturates at, except on the
+least sensitive rung: there is nothing to move down to, so light too bright
+for the whole ladder must not interrupt (and recalibrate) every cycle. Its
+low threshold still moves back up once the light drops.
+
+@author: jcron
+"""
+from micropython import const
+
+# Calibration aims for this share of a rung's saturation
+TARGET_PERCENT = const(40)
+# A move up needs the count to fall this far below the next rung's target
+HYSTERESIS = const(2)
+# DN40 3.5: analog saturation below 64 cycles, digital above
+ANALOG_CYCLES_LIMIT = const(63)
+MAX_COUNT = const(65535)
+# 5% of the range short of saturation (DN40 3.5 & 3.7)
+SATURATION_TOLERANCE = const(3276)
+# Interrupt on any reading short of full scale
+PROBE_THRESHOLDS = (MAX_COUNT, MAX_COUNT)
+
+# (gain index, integration cycles) from least to most sensitive. ~154 ms
+# (64 cycles) rejects mains flicker, so the gains are stepped there; shorter
+# integrations, down to a single 2.4 ms cycle, are only for light too bright
+# at gain 1, longer ones only at gain 60.
+DEFAULT_RUNGS = (
+    (0, 1), (0, 2), (0, 4), (0, 10), (0, 20), (0, 42),
+    (0, 64), (1, 64), (2, 64), (3, 64),
+    (3, 84), (3, 125), (3, 167), (3, 209), (3, 255),
+)
+
+
+def saturation(cycles):
+    if cycles <= ANALOG_CYCLES_LIMIT:
+        return 1024 * cycles
+    return MAX_COUNT
+
+
+class ExposureLadder:
+    """Parallel tuples, one entry per rung: gain_index, atime,
+    sensitivity, saturation, target, low and high (interrupt thresholds).
+
+    All products select() forms stay below 2**30, so it does not allocate
+    on MicroPython.
+    """
+
+    def __init__(self, gains, rungs=DEFAULT_RUNGS):
+        count = len(rungs)
+        self.gains = gains
+        self.gain_index = tuple(rung[0] for rung in rungs)
+        self.atime = tuple(256 - rung[1] for rung in rungs)
+        self.sensitivity = tuple(gains[rung[0]] * rung[1] for rung in rungs)
+        self.saturation = tuple(saturation(rung[1]) for rung in rungs)
+        self.target = tuple(limit * TARGET_PERCENT // 100 for limit in self.saturation)
+
+        high = []
+        for i in range(count):
+            limit = self.saturation[i]
+            if i == 0:
+                # Nothing below: never interrupt for brightness
+                high.append(MAX_COUNT)
+            elif rungs[i][1] <= ANALOG_CYCLES_LIMIT:
+                # Ripple peaks saturate the ADC first
+                high.append(limit * 3 // 4)
+            else:
+                high.append(limit - SATURATION_TOLERANCE)
+        self.high = tuple(high)
+
+        low = []
+        for i in range(count):
+            if i == count - 1:
+                # Nothing above: never interrupt for darkness
+                low.append(0)
+            else:
+                low.append(self.target[i + 1] * self.sensitivity[i] // self.sensitivity[i + 1] // HYSTERESIS)
+        self.low = tuple(low)
+
+    def __len__(self):
+        return len(self.atime)
+
+    def find(self, gain, atime):
+        """The rung with this gain and ATIME, or -1"""
+        for i in range(len(self.atime)):
+            if self.atime[i] == atime and self.gains[self.gain_index[i]] == gain:
+                return i
+        return -1
+
+    def select(self, clear, gain, atime):
+        """The rung to move to after reading `clear` with gain and ATIME"""
+        cycles = 256 - atime
+        if clear >= saturation(cycles):
+            return 0
+        sensitivity = gain * cycles
+        fallback = 0
+        for i in range(len(self.atime) - 1, 0, -1):
+            predicted = clear * self.sensitivity[i]
+            if predicted <= self.target[i] * sensitivity:
+                return i
+            if not fallback and predicted < self.high[i] * sensitivity:
+                fallback = i
+        return fallback
+
+    def is_saturated(self, clear, atime):
+        return clear >= saturation(256 - atime)
+
+    def thresholds(self, rung):
+        return (self.low[rung], self.high[rung])
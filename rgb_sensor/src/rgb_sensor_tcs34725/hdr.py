@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Extended dynamic range (DN40 3.13): one sample merged from a short and a
+long exposure.
+
+Both readings are brought to the same counts per lux by the ratio of
+their sensitivities (gain x integration cycles), then merged with a hat
+weight on the long exposure's clear count:
+    - up to the knee the long reading is used as is; it has the better
+      resolution
+    - from the knee to the long exposure's limit (its high interrupt
+      threshold, DN40 3.5 & 3.7) the weight fades to the short reading
+    - beyond the limit only the short reading is used
+Below the knee the merged sample is in the long exposure's units,
+otherwise in the short one's. Either way it is a plain RGBC reading with
+a gain and ATIME, so it goes into the sample ring and through DN40 like
+any other, and it is only saturated when the short exposure is.
+
+The short exposure is a single cycle, so mains flicker is not averaged
+out; it only matters in light too bright for the long one. Below 64 cycles
+the ADC saturates at 1024 counts per cycle, so a longer short exposure would
+not reach brighter light, it would only make every pair slower.
+
+@author: jcron
+"""
+from micropython import const
+from src.rgb_sensor_tcs34725.exposure import saturation, ANALOG_CYCLES_LIMIT, SATURATION_TOLERANCE
+
+# gain, ATIME: 2.4 ms at 1x and 154 ms at 16x, 1024x apart
+DEFAULT_SHORT_EXPOSURE = (1, 0xFF)
+DEFAULT_LONG_EXPOSURE = (16, 0xC0)
+# Fixed point weights
+WEIGHT_ONE = const(256)
+
+SHORT = const(0)
+LONG = const(1)
+
+
+class HDRMerger:
+    def __init__(self, short=DEFAULT_SHORT_EXPOSURE, long=DEFAULT_LONG_EXPOSURE):
+        self.exposures = (short, long)
+        self.short_sensitivity = short[0] * (256 - short[1])
+        self.long_sensitivity = long[0] * (256 - long[1])
+        if self.long_sensitivity <= self.short_sensitivity:
+            raise ValueError("The long exposure must be the more sensitive")
+        long_cycles = 256 - long[1]
+        if long_cycles <= ANALOG_CYCLES_LIMIT:
+            self.limit = saturation(long_cycles) * 3 // 4
+        else:
+            self.limit = saturation(long_cycles) - SATURATION_TOLERANCE
+        self.knee = self.limit * 3 // 4
+
+    def merge_into(self, short_rgbc, long_rgbc, out):
+        """Merges two (r, g, b, c) readings into out and returns SHORT or
+        LONG, the exposure whose units out is in. Does not allocate.
+        """
+        c = long_rgbc[3]
+        if c <= self.knee:
+            for i in range(4):
+                out[i] = long_rgbc[i]
+            return LONG
+        if c >= self.limit:
+            for i in range(4):
+                out[i] = short_rgbc[i]
+            return SHORT
+        weight = (self.limit - c) * WEIGHT_ONE // (self.limit - self.knee)
+        for i in range(4):
+            scaled = long_rgbc[i] * self.short_sensitivity // self.long_sensitivity
+            out[i] = (weight * scaled + (WEIGHT_ONE - weight) * short_rgbc[i]) // WEIGHT_ONE
+        return SHORT
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed size ring of raw RGBC samples.
+
+Storage is preallocated arrays, so pushing a sample never allocates and can
+be done from a scheduled interrupt handler.
+
+@author: jcron
+"""
+from array import array
+from src.rgb_sensor_tcs34725.sample import Sample
+
+# Layout of the array filled by read_into/pop_into
+SAMPLE_FIELDS = ('r', 'g', 'b', 'c', 'gain', 'atime', 'timestamp')
+SAMPLE_FIELD_COUNT = 7
+
+
+def new_sample_record():
+    """Returns an array suitable for read_into/pop_into"""
+    return array('L', [0] * SAMPLE_FIELD_COUNT)
+
+
+class SampleRing:
+    """Ring of the last `capacity` samples, addressed by sequence number.
+
+    Sequence numbers start at 1 and increase by one per push; the newest
+    sample is latest_seq and the oldest still held is oldest_seq. Random
+    access (read_into, sample) is available to any number of readers, while
+    pop_into serves a single FIFO consumer. Every sample overwritten before
+    that consumer popped it is counted in overflows.
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self._r = array('H', [0] * capacity)
+        self._g = array('H', [0] * capacity)
+        self._b = array('H', [0] * capacity)
+        self._c = array('H', [0] * capacity)
+        self._gain = bytearray(capacity)
+        self._atime = bytearray(capacity)
+        self._timestamp = array('L', [0] * capacity)
+
+        self._count = 0
+        self._tail = 0
+        self.overflows = 0
+
+    @property
+    def latest_seq(self):
+        return self._count
+
+    @property
+    def oldest_seq(self):
+        return max(1, self._count - self.capacity + 1)
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def push(self, r, g, b, c, gain, atime, timestamp):
+        """Stores a sample and returns its sequence number. Does not allocate."""
+        seq = self._count + 1
+        i = seq % self.capacity
+        self._r[i] = r
+        self._g[i] = g
+        self._b[i] = b
+        self._c[i] = c
+        self._gain[i] = gain
+        self._atime[i] = atime
+        self._timestamp[i] = timestamp
+        if seq - self._tail > self.capacity:
+            self._tail += 1
+            self.overflows += 1
+        # Publish last so readers never see a partially written slot as the latest
+        self._count = seq
+        return seq
+
+    def read_into(self, seq, out):
+        """Copies sample `seq` into out (see SAMPLE_FIELDS). Returns False if
+        the sample is not (or no longer) held.
+        """
+        if seq < self.oldest_seq or seq > self._count:
+            return False
+        i = seq % self.capacity
+        out[0] = self._r[i]
+        out[1] = self._g[i]
+        out[2] = self._b[i]
+        out[3] = self._c[i]
+        out[4] = self._gain[i]
+        out[5] = self._atime[i]
+        out[6] = self._timestamp[i]
+        # A push may have recycled the slot while it was being copied
+        return seq >= self.oldest_seq
+
+    def pop_into(self, out):
+        """Copies the oldest sample not yet popped into out and returns its
+        sequence number, or 0 if there is none.
+        """
+        while self._tail < self._count:
+            self._tail += 1
+            if self.read_into(self._tail, out):
+                return self._tail
+        return 0
+
+    def sample(self, seq):
+        """Returns sample `seq` as a Sample, or None if it is not held"""
+        out = new_sample_record()
+        if not self.read_into(seq, out):
+            return None
+        return Sample(out[0], out[1], out[2], out[3], out[4], out[5], out[6], seq)
+
+    def latest(self):
+        if self._count == 0:
+            return None
+        return self.sample(self._count)
+
+
+class SampleCursor:
+    """A reader's position in a SampleRing.
+
+    Each subscriber owns one cursor, so any number of readers can follow the
+    same ring without slowing the producer down. A reader that falls more
+    than max_backlog samples behind skips ahead to the most recent ones;
+    skipped samples are counted in dropped.
+    """
+
+    def __init__(self, ring, max_backlog=8, start_seq=None):
+        self._ring = ring
+        self.max_backlog = max_backlog
+        self.next_seq = ring.latest_seq + 1 if start_seq is None else start_seq
+        self.dropped = 0
+
+    @property
+    def pending(self):
+        return max(0, self._ring.latest_seq - self.next_seq + 1)
+
+    def take_into(self, out):
+        """Copies the next sample into out and returns its sequence number,
+        or 0 when the reader is up to date.
+        """
+        ring = self._ring
+        while True:
+            latest_seq = ring.latest_seq
+            if self.next_seq > latest_seq:
+                return 0
+            oldest_seq = max(ring.oldest_seq, latest_seq - self.max_backlog + 1)
+            if self.next_seq < oldest_seq:
+                self.dropped += oldest_seq - self.next_seq
+                self.next_seq = oldest_seq
+            seq = self.next_seq
+            self.next_seq += 1
+            if ring.read_into(seq, out):
+                return seq
+            self.dropped += 1
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+A single RGBC acquisition and everything derived from it.
+
+@author: jcron
+"""
+from src.rgb_sensor_tcs34725.dn40 import TIME_ONE_CYCLE
+from src.rgb_sensor_tcs34725.dn40_fixed import temperature_and_lux_fixed
+
+
+class Sample:
+    """Snapshot of one integration: raw channels, the gain and ATIME they
+    were taken with, when they were read (time.ticks_ms) and the lux/CCT
+    computed from them. Lux and CCT are computed once, on construction, in
+    fixed point (see dn40_fixed), and are None when the clear channel is
+    saturated; CCT is also None when it is undefined.
+
+    Samples are shared between consumers; treat them as read-only.
+    """
+    __slots__ = ('seq', 'r', 'g', 'b', 'c', 'gain', 'atime', 'timestamp', 'lux', 'ct')
+
+    def __init__(self, r, g, b, c, gain, atime, timestamp, seq=0):
+        self.seq = seq
+        self.r = r
+        self.g = g
+        self.b = b
+        self.c = c
+        self.gain = gain
+        self.atime = atime
+        self.timestamp = timestamp
+        self.lux, self.ct = temperature_and_lux_fixed(r, g, b, c, atime, gain)
+
+    @property
+    def color_raw(self):
+        return (self.r, self.g, self.b, self.c)
+
+    @property
+    def integration_time(self):
+        return (256 - self.atime) * TIME_ONE_CYCLE
+
+    def as_list(self):
+        """[r, g, b, c, ct, lux], the /rgbcct wire format"""
+        return [self.r, self.g, self.b, self.c, self.ct, self.lux]
+
+    def as_dict(self):
+        return {
+            'seq': self.seq,
+            'r': self.r,
+            'g': self.g,
+            'b': self.b,
+            'c': self.c,
+            'gain': self.gain,
+            'atime': self.atime,
+            'timestamp': self.timestamp,
+            'lux': self.lux,
+            'ct': self.ct,
+        }
@@ -0,0 +1,3 @@
+from src.sim.bus import FakeI2C
+from src.sim.clock import VirtualClock, RealClock
+from src.sim.tcs34725 import SimulatedTCS34725
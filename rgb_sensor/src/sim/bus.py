@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Fake I2C bus with the machine.I2C surface used by utils.locakable_i2c.I2C
+(scan, writeto, readfrom_into), counting every transaction and byte.
+
+Each writeto or readfrom_into is one transaction: a START, the address
+byte, then the payload. bus_time_us estimates the time these would take
+on the wire at the bus frequency, at 9 clocks per byte plus one for the
+START and one for the STOP.
+
+@author: jcron
+"""
+
+# machine.I2C raises OSError(ENODEV) when no device acknowledges
+ENODEV = 19
+
+
+class FakeI2C:
+    def __init__(self, freq=400000, record=False):
+        self.freq = freq
+        self.devices = {}
+        self.record = record
+        self.log = []
+        self.reset_counters()
+
+    def attach(self, device):
+        """Puts a device (anything with an address, write(buf) and
+        read_into(buf)) on the bus
+        """
+        self.devices[device.address] = device
+        return device
+
+    def reset_counters(self):
+        self.transactions = 0
+        self.writes = 0
+        self.reads = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.bus_time_us = 0.0
+        del self.log[:]
+
+    def counters(self):
+        return {
+            'transactions': self.transactions,
+            'writes': self.writes,
+            'reads': self.reads,
+            'bytes_written': self.bytes_written,
+            'bytes_read': self.bytes_read,
+            'bus_time_us': self.bus_time_us,
+        }
+
+    def _transaction(self, address, payload):
+        self.transactions += 1
+        self.bus_time_us += (9 * (payload + 1) + 2) * 1000000 / self.freq
+        device = self.devices.get(address)
+        if device is None:
+            raise OSError(ENODEV)
+        return device
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def writeto(self, address, buffer, stop=True):
+        device = self._transaction(address, len(buffer))
+        self.writes += 1
+        self.bytes_written += len(buffer)
+        if self.record:
+            self.log.append(('w', address, bytes(buffer)))
+        device.write(buffer)
+        return len(buffer)
+
+    def readfrom_into(self, address, buffer, stop=True):
+        device = self._transaction(address, len(buffer))
+        self.reads += 1
+        self.bytes_read += len(buffer)
+        device.read_into(buffer)
+        if self.record:
+            self.log.append(('r', address, bytes(buffer)))
+
+    def readfrom(self, address, nbytes, stop=True):
+        buffer = bytearray(nbytes)
+        self.readfrom_into(address, buffer, stop)
+        return bytes(buffer)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Time sources for the simulated sensor.
+
+The simulated chip runs on a clock in microseconds. VirtualClock only moves
+when something sleeps on it, so a second of sensor time costs nothing and
+runs are repeatable; RealClock follows the host's monotonic clock. Both
+notify their listeners (the simulated devices) after every sleep, so
+interrupts fire while the code under test is sleeping.
+
+@author: jcron
+"""
+import time
+
+
+class Clock:
+    def __init__(self):
+        self.listeners = []
+
+    def now_us(self):
+        raise NotImplementedError
+
+    def _pass(self, us):
+        raise NotImplementedError
+
+    def sleep_us(self, us):
+        if us > 0:
+            self._pass(int(us))
+        now = self.now_us()
+        for listener in self.listeners:
+            listener(now)
+
+
+class VirtualClock(Clock):
+    """Starts at start_us and advances only when slept on"""
+
+    def __init__(self, start_us=0):
+        super().__init__()
+        self._now_us = start_us
+
+    def now_us(self):
+        return self._now_us
+
+    def _pass(self, us):
+        self._now_us += us
+
+    def advance_ms(self, ms):
+        self.sleep_us(ms * 1000)
+
+
+class RealClock(Clock):
+    def __init__(self):
+        super().__init__()
+        self._cpython = hasattr(time, 'monotonic_ns')
+        if not self._cpython:
+            # MicroPython: extend the wrapping tick counter
+            self._ticks = time.ticks_us()
+            self._elapsed_us = 0
+
+    def now_us(self):
+        if self._cpython:
+            return time.monotonic_ns() // 1000
+        ticks = time.ticks_us()
+        self._elapsed_us += time.ticks_diff(ticks, self._ticks)
+        self._ticks = ticks
+        return self._elapsed_us
+
+    def _pass(self, us):
+        # On CPython time.sleep_us may be host's, which sleeps on this clock
+        if self._cpython:
+            time.sleep(us / 1000000)
+        else:
+            time.sleep_us(us)
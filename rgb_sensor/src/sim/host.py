@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the firmware on CPython against simulated hardware.
+
+install() puts stand-ins for the MicroPython modules the firmware imports
+into sys.modules (machine, micropython, uasyncio, ujson, ustruct) and adds
+the MicroPython time functions to time. It must run before anything under
+src.rgb_sensor_tcs34725 is imported:
+
+    from src.sim import host, VirtualClock
+    bus = host.install(VirtualClock())
+    sensor = host.add_sensor()
+    sensor.set_light(40, 35, 25, 90)
+
+    from src.rgb_sensor_tcs34725 import Controller
+    controller = Controller(22, 21, 400000, 2, 23)
+    print(bus.counters())
+
+machine.I2C and machine.SoftI2C return the installed FakeI2C whatever
+their pins. machine.Pin inputs read the level of a Line, which simulated
+devices drive; a falling edge calls the pin's IRQ handler right away, as a
+hard interrupt would. micropython.schedule queues callbacks the way the
+firmware's scheduler does and runs them on the next sleep or
+run_scheduled().
+
+With a VirtualClock, time.sleep, sleep_ms and sleep_us advance the virtual
+clock instead of blocking; uninstall() restores time.sleep.
+
+On the MicroPython Unix port only machine is replaced: micropython, time
+and the u-modules are the real ones, so the clock must be a RealClock.
+
+@author: jcron
+"""
+import sys
+import time
+
+from src.sim.bus import FakeI2C
+from src.sim.clock import RealClock
+from src.sim.tcs34725 import SimulatedTCS34725
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD >> 1
+# Depth of the MicroPython scheduler queue on the ESP32
+SCHEDULE_DEPTH = 8
+INTERRUPT_PIN = 23
+
+clock = None
+bus = None
+lines = {}
+scheduled = []
+_time_sleep = time.sleep
+_installed_modules = ('machine', 'micropython', 'uasyncio', 'ujson', 'ustruct')
+MICROPYTHON = sys.implementation.name == 'micropython'
+
+
+class Module:
+    """Stand-in module object"""
+
+
+class Line:
+    """A wire shared by every Pin of the same id. Idles high, as with the
+    interrupt line's pull up.
+    """
+
+    def __init__(self):
+        self.level = 1
+        self.pins = []
+
+    def drive(self, level):
+        previous = self.level
+        self.level = level
+        for pin in self.pins:
+            if pin.handler is None:
+                continue
+            if (previous and not level and pin.trigger & Pin.IRQ_FALLING) or \
+                    (level and not previous and pin.trigger & Pin.IRQ_RISING):
+                pin.handler(pin)
+
+
+def line(pin_id):
+    if pin_id not in lines:
+        lines[pin_id] = Line()
+    return lines[pin_id]
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 2
+    IRQ_RISING = 1
+
+    def __init__(self, pin_id, mode=None, pull=None, value=None):
+        self.id = pin_id
+        self.mode = mode
+        self.handler = None
+        self.trigger = 0
+        self._line = line(pin_id)
+        self._line.pins.append(self)
+        if value is not None:
+            self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return self._line.level
+        self._line.level = 1 if value else 0
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        self.handler = handler
+        self.trigger = trigger
+
+
+def _i2c(*args, freq=400000, **kwargs):
+    bus.freq = freq
+    return bus
+
+
+def schedule(func, arg):
+    if len(scheduled) >= SCHEDULE_DEPTH:
+        raise RuntimeError("schedule queue full")
+    scheduled.append((func, arg))
+
+
+def run_scheduled():
+    """Runs queued callbacks, including any they schedule. Returns how
+    many ran.
+    """
+    count = 0
+    while scheduled:
+        func, arg = scheduled.pop(0)
+        func(arg)
+        count += 1
+    return count
+
+
+def ticks_us():
+    return clock.now_us() & TICKS_MAX
+
+
+def ticks_ms():
+    return (clock.now_us() // 1000) & TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def sleep_us(us):
+    clock.sleep_us(us)
+    run_scheduled()
+
+
+def sleep_ms(ms):
+    sleep_us(ms * 1000)
+
+
+def sleep(seconds):
+    sleep_us(seconds * 1000000)
+
+
+def _identity(func):
+    return func
+
+
+def install(new_clock=None, new_bus=None):
+    """Installs the host modules, with a RealClock and a new FakeI2C by
+    default. Returns the bus.
+    """
+    global clock, bus
+    clock = new_clock if new_clock is not None else RealClock()
+    if MICROPYTHON and not isinstance(clock, RealClock):
+        raise ValueError("Only a RealClock can drive the MicroPython time module")
+    bus = new_bus if new_bus is not None else FakeI2C()
+    lines.clear()
+    del scheduled[:]
+
+    machine = Module()
+    machine.Pin = Pin
+    machine.I2C = _i2c
+    machine.SoftI2C = _i2c
+    machine.disable_irq = lambda: 0
+    machine.enable_irq = lambda state: None
+    machine.freq = lambda: 240000000
+    machine.reset = lambda: None
+    sys.modules['machine'] = machine
+    if MICROPYTHON:
+        return bus
+
+    import asyncio
+    import json
+    import struct
+    micropython = Module()
+    micropython.const = _identity
+    micropython.native = _identity
+    micropython.viper = _identity
+    micropython.schedule = schedule
+    micropython.alloc_emergency_exception_buf = lambda size: None
+    sys.modules['micropython'] = micropython
+
+    sys.modules['uasyncio'] = asyncio
+    sys.modules['ujson'] = json
+    sys.modules['ustruct'] = struct
+
+    time.ticks_us = ticks_us
+    time.ticks_ms = ticks_ms
+    time.ticks_add = ticks_add
+    time.ticks_diff = ticks_diff
+    time.sleep_us = sleep_us
+    time.sleep_ms = sleep_ms
+    if not isinstance(clock, RealClock):
+        time.sleep = sleep
+    return bus
+
+
+def uninstall():
+    for name in _installed_modules:
+        sys.modules.pop(name, None)
+    if not MICROPYTHON:
+        time.sleep = _time_sleep
+
+
+def add_sensor(pin_id=INTERRUPT_PIN, **kwargs):
+    """Attaches a SimulatedTCS34725 to the bus, its interrupt output wired
+    to pin_id
+    """
+    return bus.attach(SimulatedTCS34725(clock, interrupt_line=line(pin_id), **kwargs))
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Register level simulation of the TCS34725, for use behind sim.bus.FakeI2C.
+DataSheet: https://cdn-shop.adafruit.com/datasheets/TCS34725.pdf
+
+Modelled:
+    - the command byte: CMD bit, repeated byte (00), auto-increment (01)
+      and special function (11) transaction types; the clear channel
+      interrupt clear is the only special function
+    - read only (ID, STATUS, data) and reserved registers, and the writable
+      bits of each register
+    - the state machine: sleep, idle, the 2.4 ms init after AEN is set,
+      then integrations of ATIME cycles separated by WTIME cycles (x12 with
+      WLONG) when WEN is set. ATIME and the gain are taken at the start of
+      each integration.
+    - AVALID, set by every completed integration and cleared with AEN
+    - analog (1024 counts per cycle) and digital (65535) saturation
+    - the clear channel thresholds, the persistence filter and AINT, which
+      pulls the interrupt line low while AIEN is set
+    - data latching: reading a low data byte latches its high byte, and
+      reading CDATAL latches all four channels
+
+Time only passes between bus transactions: the chip catches up with its
+clock before each one, and after every sleep on that clock.
+
+Light is given as counts per ms at gain 1 for (red, green, blue, clear),
+either fixed with set_light or as a function of the time in ms.
+
+@author: jcron
+"""
+
+ADDRESS = 0x29
+DEVICE_ID = 0x44
+
+CYCLE_US = 2400
+INIT_US = 2400
+LONG_WAIT_MULTIPLIER = 12
+GAINS = (1, 4, 16, 60)
+# Consecutive out of range cycles required by each PERS value
+PERSISTENCE = (0, 1, 2, 3, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60)
+ANALOG_FULL_SCALE = 1024
+DIGITAL_FULL_SCALE = 65535
+# Beyond this many missed phases the chip skips ahead to the present
+MAX_CATCH_UP = 256
+
+COMMAND_BIT = 0x80
+TYPE_REPEATED = 0x00
+TYPE_AUTO_INCREMENT = 0x20
+TYPE_SPECIAL_FUNCTION = 0x60
+SPECIAL_CLEAR_INTERRUPT = 0x06
+
+ENABLE = 0x00
+ATIME = 0x01
+WTIME = 0x03
+AILTL = 0x04
+AIHTL = 0x06
+PERS = 0x0C
+CONFIG = 0x0D
+CONTROL = 0x0F
+ID = 0x12
+STATUS = 0x13
+CDATAL = 0x14
+BDATAH = 0x1B
+
+ENABLE_PON = 0x01
+ENABLE_AEN = 0x02
+ENABLE_WEN = 0x08
+ENABLE_AIEN = 0x10
+CONFIG_WLONG = 0x02
+STATUS_AVALID = 0x01
+STATUS_AINT = 0x10
+
+# Writable bits of each writable register
+WRITE_MASKS = {
+    ENABLE: 0x1B,
+    ATIME: 0xFF,
+    WTIME: 0xFF,
+    AILTL: 0xFF,
+    AILTL + 1: 0xFF,
+    AIHTL: 0xFF,
+    AIHTL + 1: 0xFF,
+    PERS: 0x0F,
+    CONFIG: CONFIG_WLONG,
+    CONTROL: 0x03,
+}
+
+SLEEP = 'sleep'
+IDLE = 'idle'
+INIT = 'init'
+INTEGRATE = 'integrate'
+WAIT = 'wait'
+
+
+class SimulatedTCS34725:
+    def __init__(self, clock, address=ADDRESS, interrupt_line=None):
+        self.address = address
+        self.clock = clock
+        self.interrupt_line = interrupt_line
+        self.light = None
+        self.rates = (0.0, 0.0, 0.0, 0.0)
+
+        self.registers = bytearray(0x20)
+        self.registers[ATIME] = 0xFF
+        self.registers[WTIME] = 0xFF
+        self.registers[ID] = DEVICE_ID
+        # Data as last integrated, and as latched by reads
+        self._data = bytearray(8)
+        self._latched = bytearray(8)
+        self._pointer = 0
+        self._auto_increment = False
+
+        self.phase = SLEEP
+        self._phase_end_us = None
+        self._integration_cycles = 1
+        self._integration_gain = 1
+        self._out_of_range = 0
+        self.interrupt_level = 1
+
+        self.integrations = 0
+        self.interrupts = 0
+        self.protocol_errors = 0
+        clock.listeners.append(self.update)
+
+    # Light
+    def set_light(self, r, g, b, c):
+        """Fixed light, in counts per ms at gain 1"""
+        self.light = None
+        self.rates = (r, g, b, c)
+
+    def counts(self, cycles, gain, t_ms):
+        """(r, g, b, c) an integration of `cycles` cycles ending at t_ms
+        reports
+        """
+        rates = self.light(t_ms) if self.light is not None else self.rates
+        limit = min(ANALOG_FULL_SCALE * cycles, DIGITAL_FULL_SCALE)
+        exposure = gain * cycles * CYCLE_US / 1000
+        return tuple(min(limit, max(0, int(rate * exposure))) for rate in rates)
+
+    # Register views
+    def _register16(self, addr):
+        return self.registers[addr] | (self.registers[addr + 1] << 8)
+
+    @property
+    def thresholds(self):
+        return (self._register16(AILTL), self._register16(AIHTL))
+
+    @property
+    def data(self):
+        """(r, g, b, c) of the last completed integration"""
+        d = self._data
+        clear = d[0] | (d[1] << 8)
+        return (d[2] | (d[3] << 8), d[4] | (d[5] << 8), d[6] | (d[7] << 8), clear)
+
+    # Bus interface
+    def write(self, buf):
+        self.update()
+        if not len(buf):
+            # Address probe
+            return
+        command = buf[0]
+        if not command & COMMAND_BIT:
+            self.protocol_errors += 1
+            return
+        kind = command & TYPE_SPECIAL_FUNCTION
+        addr = command & 0x1F
+        if kind == TYPE_SPECIAL_FUNCTION:
+            if addr == SPECIAL_CLEAR_INTERRUPT:
+                self.registers[STATUS] &= ~STATUS_AINT
+                self._update_interrupt_line()
+            else:
+                self.protocol_errors += 1
+            return
+        if kind != TYPE_REPEATED and kind != TYPE_AUTO_INCREMENT:
+            self.protocol_errors += 1
+            return
+        self._pointer = addr
+        self._auto_increment = kind == TYPE_AUTO_INCREMENT
+        for i in range(1, len(buf)):
+            self._write_register(self._pointer, buf[i])
+            if self._auto_increment:
+                self._pointer = (self._pointer + 1) & 0x1F
+
+    def read_into(self, buf):
+        self.update()
+        for i in range(len(buf)):
+            buf[i] = self._read_register(self._pointer)
+            if self._auto_increment:
+                self._pointer = (self._pointer + 1) & 0x1F
+
+    def _write_register(self, addr, value):
+        mask = WRITE_MASKS.get(addr)
+        if mask is None:
+            return
+        previous = self.registers[addr]
+        self.registers[addr] = value & mask
+        if addr == ENABLE:
+            self._enable_changed(previous, value & mask)
+
+    def _read_register(self, addr):
+        if CDATAL <= addr <= BDATAH:
+            offset = addr - CDATAL
+            if addr == CDATAL:
+                self._latched[:] = self._data
+            elif not offset & 1:
+                self._latched[offset + 1] = self._data[offset + 1]
+                self._latched[offset] = self._data[offset]
+            return self._latched[offset]
+        return self.registers[addr]
+
+    # State machine
+    def _enable_changed(self, previous, enable):
+        now = self.clock.now_us()
+        running = enable & ENABLE_PON and enable & ENABLE_AEN
+        was_running = previous & ENABLE_PON and previous & ENABLE_AEN
+        if not enable & ENABLE_AEN:
+            self.registers[STATUS] &= ~STATUS_AVALID
+        if running and not was_running:
+            self._enter(INIT, now + INIT_US)
+        elif not running:
+            self._enter(IDLE if enable & ENABLE_PON else SLEEP, None)
+        self._update_interrupt_line()
+
+    def _enter(self, phase, end_us):
+        self.phase = phase
+        self._phase_end_us = end_us
+
+    def _start_integration(self, start_us):
+        self._integration_cycles = 256 - self.registers[ATIME]
+        self._integration_gain = GAINS[self.registers[CONTROL] & 0x03]
+        self._enter(INTEGRATE, start_us + self._integration_cycles * CYCLE_US)
+
+    def _wait_us(self):
+        wait_us = (256 - self.registers[WTIME]) * CYCLE_US
+        if self.registers[CONFIG] & CONFIG_WLONG:
+            wait_us *= LONG_WAIT_MULTIPLIER
+        return wait_us
+
+    def update(self, now_us=None):
+        """Runs the chip up to now_us (the clock's time by default)"""
+        if now_us is None:
+            now_us = self.clock.now_us()
+        steps = 0
+        while self._phase_end_us is not None and self._phase_end_us <= now_us:
+            end_us = self._phase_end_us
+            steps += 1
+            if steps > MAX_CATCH_UP and self.phase == INTEGRATE:
+                # Skip whole cycles that nothing could have observed
+                period = self._integration_cycles * CYCLE_US
+                if self.registers[ENABLE] & ENABLE_WEN:
+                    period += self._wait_us()
+                skipped = (now_us - end_us) // period
+                end_us += skipped * period
+                self._phase_end_us = end_us
+            if self.phase == INTEGRATE:
+                self._complete_integration(end_us)
+                if self.registers[ENABLE] & ENABLE_WEN:
+                    self._enter(WAIT, end_us + self._wait_us())
+                    continue
+            self._start_integration(end_us)
+
+    def _complete_integration(self, t_us):
+        r, g, b, c = self.counts(self._integration_cycles, self._integration_gain, t_us / 1000)
+        data = self._data
+        for i, value in enumerate((c, r, g, b)):
+            data[2 * i] = value & 0xFF
+            data[2 * i + 1] = value >> 8
+        self.registers[STATUS] |= STATUS_AVALID
+        self.integrations += 1
+
+        low, high = self.thresholds
+        persistence = self.registers[PERS] & 0x0F
+        if persistence == 0:
+            triggered = True
+        else:
+            self._out_of_range = self._out_of_range + 1 if c < low or c > high else 0
+            triggered = self._out_of_range >= PERSISTENCE[persistence]
+        if triggered:
+            self.registers[STATUS] |= STATUS_AINT
+            self._update_interrupt_line()
+
+    def _update_interrupt_line(self):
+        asserted = self.registers[STATUS] & STATUS_AINT and self.registers[ENABLE] & ENABLE_AIEN
+        level = 0 if asserted else 1
+        if level != self.interrupt_level:
+            self.interrupt_level = level
+            if not level:
+                self.interrupts += 1
+            if self.interrupt_line is not None:
+                self.interrupt_line.drive(level)
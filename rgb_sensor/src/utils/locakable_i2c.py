@@ -6,6 +6,11 @@ try:
 except ImportError:
     threading = None
 
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
 I2C_MASTER_PORT = const(0)
 
 class ContextManaged:
@@ -29,9 +34,16 @@ class Lockable(ContextManaged):
     """An object that must be locked to prevent collisions on a microcontroller resource."""
 
     _locked = False
+    # Set by subclasses shared between threads (e.g. the acquisition loop)
+    _thread_lock = None
 
     def try_lock(self):
         """Attempt to grab the lock. Return True on success, False if the lock is already taken."""
+        if self._thread_lock is not None:
+            if not self._thread_lock.acquire(0):
+                return False
+            self._locked = True
+            return True
         if self._locked:
             return False
         self._locked = True
@@ -41,6 +53,8 @@ class Lockable(ContextManaged):
         """Release the lock so others may use the resource."""
         if self._locked:
             self._locked = False
+            if self._thread_lock is not None:
+                self._thread_lock.release()
         else:
             raise ValueError("Not locked")
 
@@ -48,13 +62,22 @@ class I2C(Lockable):
     """
     Busio I2C Class for CircuitPython Compatibility. Used
     for both MicroPython and Linux.
+
+    Counts transactions, the bytes they carried and the ones that failed.
     """
 
     def __init__(self, scl, sda, freq=100000):
         self.deinit()
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.errors = 0
 
         self._i2c = _I2C(I2C_MASTER_PORT, sda=sda, scl=scl, freq=freq)
 
+        if _thread is not None:
+            self._thread_lock = _thread.allocate_lock()
+
         if threading is not None:
             self._lock = threading.RLock()
 
@@ -80,23 +103,42 @@ class I2C(Lockable):
         return self._i2c.scan()
 
     def readfrom_into(self, address, buffer, *, start=0, end=None):
-        """Read from a device at specified address into a buffer"""
-        if start != 0 or end is not None:
+        """Read from a device at specified address into a buffer. Only a
+        range narrower than the buffer is sliced: slicing allocates.
+        """
+        if start != 0 or (end is not None and end != len(buffer)):
             if end is None:
                 end = len(buffer)
             buffer = memoryview(buffer)[start:end]
         stop = True  # remove for efficiency later
-        return self._i2c.readfrom_into(address, buffer, stop)
+        self.transactions += 1
+        try:
+            result = self._i2c.readfrom_into(address, buffer, stop)
+        except OSError:
+            self.errors += 1
+            raise
+        self.bytes_read += len(buffer)
+        return result
 
     def writeto(self, address, buffer, *, start=0, end=None, stop=True):
-        """Write to a device at specified address from a buffer"""
+        """Write to a device at specified address from a buffer. Only a
+        range narrower than the buffer is sliced: slicing allocates.
+        """
         if isinstance(buffer, str):
             buffer = bytes([ord(x) for x in buffer])
-        if start != 0 or end is not None:
+        if start != 0 or (end is not None and end != len(buffer)):
             if end is None:
-                return self._i2c.writeto(address, memoryview(buffer)[start:], stop)
-            return self._i2c.writeto(address, memoryview(buffer)[start:end], stop)
-        return self._i2c.writeto(address, buffer, stop)
+                buffer = memoryview(buffer)[start:]
+            else:
+                buffer = memoryview(buffer)[start:end]
+        self.transactions += 1
+        try:
+            result = self._i2c.writeto(address, buffer, stop)
+        except OSError:
+            self.errors += 1
+            raise
+        self.bytes_written += len(buffer)
+        return result
 
     def writeto_then_readfrom(
         self,
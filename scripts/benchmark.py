@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the sensor loop and the web server, run against the
+simulated sensor in rgb_sensor/src/sim:
+
+    python3 scripts/benchmark.py --output benchmark.json
+
+For each operation it reports:
+- the CPU time per call;
+- the bus transactions, bytes and estimated wire time per call;
+- the heap bytes allocated per call (gc.mem_alloc deltas with the
+  collector disabled), where gc.mem_alloc exists.
+
+CPython has no equivalent of gc.mem_alloc, so the allocation figures are
+null there. The simulator and the measurements are written to also run
+under the MicroPython Unix port, on a real clock, but that has not been
+verified.
+
+The calibration scenarios step the light and let the Controller's
+interrupt driven calibration run until it goes quiet. They report how
+long that took in sensor time, how many calibrations it made, and the bus
+traffic it cost. Calibration that goes quiet with the clear channel at
+full scale is reported as saturated, not settled. Under CPython the
+sensor runs on a virtual clock, so this takes no real time.
+
+Arguments: --output <path> (JSON, default benchmark.json), --iterations
+<n> (default 1000), --only <name,name,...>, --bus-freq <Hz> (default the
+firmware's I2C_FREQ from main.py).
+
+@author: jcron
+"""
+import gc
+import sys
+import time
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+SCRIPTS_DIR = __file__.replace('\\', '/').rpartition('/')[0] or '.'
+sys.path.insert(0, SCRIPTS_DIR + '/../rgb_sensor')
+
+from src.sim import host, VirtualClock, RealClock
+
+MICROPYTHON = sys.implementation.name == 'micropython'
+# Allocation is measured over fewer calls, with the collector off
+ALLOC_ITERATIONS = 20
+HTTP_ITERATIONS = 50
+
+# Light in counts per ms at gain 1 for (red, green, blue, clear)
+LIGHTS = {
+    'dark': (0.02, 0.02, 0.015, 0.05),
+    'office': (2.0, 1.8, 1.2, 5.0),
+    'daylight': (80.0, 75.0, 60.0, 200.0),
+    'sunlight': (400.0, 380.0, 300.0, 1100.0),
+}
+CALIBRATION_STEPS = ('dark', 'daylight', 'sunlight', 'office', 'dark')
+AUTO_EXPOSURE_MODES = ('step', 'predictive')
+# Calibration has settled once no interrupt came for this many cycles
+SETTLE_CYCLES = 10
+SETTLE_TIMEOUT_MS = 30000
+
+RGBCCT_REQUEST = b"GET /rgbcct HTTP/1.1\r\nHost: benchmark\r\nConnection: close\r\n\r\n"
+
+if hasattr(time, 'perf_counter_ns'):
+    def now_us():
+        return time.perf_counter_ns() // 1000
+
+    def elapsed_us(start):
+        return now_us() - start
+else:
+    now_us = time.ticks_us
+
+    def elapsed_us(start):
+        return time.ticks_diff(time.ticks_us(), start)
+
+
+def measure(bus, func, iterations, setup=None):
+    """Calls func iterations times and returns its cost per call. setup,
+    if given, runs before every call and is not timed.
+    """
+    func()
+    gc.collect()
+    bus.reset_counters()
+    total_us = 0
+    if setup is None:
+        start = now_us()
+        for _ in range(iterations):
+            func()
+        total_us = elapsed_us(start)
+    else:
+        for _ in range(iterations):
+            setup()
+            start = now_us()
+            func()
+            total_us += elapsed_us(start)
+    counters = bus.counters()
+
+    alloc_bytes = None
+    mem_alloc = getattr(gc, 'mem_alloc', None)
+    if mem_alloc is not None:
+        alloc_iterations = min(iterations, ALLOC_ITERATIONS)
+        alloc_bytes = 0
+        gc.collect()
+        gc.disable()
+        try:
+            for _ in range(alloc_iterations):
+                if setup is not None:
+                    setup()
+                before = mem_alloc()
+                func()
+                alloc_bytes += mem_alloc() - before
+        finally:
+            gc.enable()
+        alloc_bytes /= alloc_iterations
+
+    return {
+        'iterations': iterations,
+        'us_per_op': total_us / iterations,
+        'transactions_per_op': counters['transactions'] / iterations,
+        'bytes_per_op': (counters['bytes_written'] + counters['bytes_read']) / iterations,
+        'bus_time_us_per_op': counters['bus_time_us'] / iterations,
+        'alloc_bytes_per_op': alloc_bytes,
+    }
+
+
+class MemoryReader:
+    """Request bytes for WebServer._handle_client, without a socket"""
+
+    def __init__(self, data):
+        self._data = data
+        self._offset = 0
+
+    def rewind(self):
+        self._offset = 0
+
+    async def readinto(self, buf):
+        count = min(len(buf), len(self._data) - self._offset)
+        buf[:count] = self._data[self._offset:self._offset + count]
+        self._offset += count
+        return count
+
+
+class MemoryWriter:
+    """Counts the response bytes and keeps the status line"""
+
+    def __init__(self):
+        self.bytes = 0
+        self.status_line = b''
+
+    def write(self, data):
+        if not self.bytes:
+            self.status_line = bytes(data[:bytes(data).find(b'\r\n')])
+        self.bytes += len(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+    def get_extra_info(self, name):
+        return ('benchmark', 0)
+
+
+def http_request(server, loop, raw):
+    """Returns a function serving raw on a new in-memory connection"""
+    reader = MemoryReader(raw)
+    writer = MemoryWriter()
+
+    def request():
+        reader.rewind()
+        writer.bytes = 0
+        loop.run_until_complete(server._handle_client(reader, writer))
+        return writer
+
+    return request
+
+
+def calibration_settling(controller, sensor, clock, bus, light):
+    """Steps the light and runs the sensor until calibration goes quiet"""
+    driver = controller.driver
+    mode = controller.auto_exposure
+    calibrations = [0]
+    calibrate = controller.calibrate
+
+    def counting_calibrate():
+        calibrations[0] += 1
+        calibrate()
+
+    controller.calibrate = counting_calibrate
+    bus.reset_counters()
+    sensor.set_light(*LIGHTS[light])
+    start_us = clock.now_us()
+    last_us = start_us
+    settled = False
+    try:
+        while clock.now_us() - start_us < SETTLE_TIMEOUT_MS * 1000:
+            seen = calibrations[0]
+            cycle_ms = driver.cycle_time
+            time.sleep_ms(max(1, int(cycle_ms)))
+            driver.service_interrupts()
+            if calibrations[0] != seen:
+                last_us = clock.now_us()
+            elif clock.now_us() - last_us >= SETTLE_CYCLES * cycle_ms * 1000:
+                settled = True
+                break
+    finally:
+        del controller.calibrate
+
+    counters = bus.counters()
+    saturated = sensor.data[3] >= driver.saturation_limit
+    return {
+        'mode': mode,
+        'light': light,
+        'settled': settled and not saturated,
+        'saturated': saturated,
+        'settle_ms': (last_us - start_us) / 1000,
+        'calibrations': calibrations[0],
+        'transactions': counters['transactions'],
+        'bus_time_us': counters['bus_time_us'],
+        'gain': driver.gain,
+        'atime': driver.ATIME,
+        'clear': sensor.data[3],
+    }
+
+
+def parse_args(argv):
+    options = {'output': 'benchmark.json', 'iterations': 1000, 'only': None, 'bus_freq': None}
+    i = 0
+    while i < len(argv):
+        name = argv[i]
+        if name not in ('--output', '--iterations', '--only', '--bus-freq') or i + 1 == len(argv):
+            raise SystemExit("usage: benchmark.py [--output path] [--iterations n] [--only name,...] [--bus-freq Hz]")
+        value = argv[i + 1]
+        if name == '--output':
+            options['output'] = value
+        elif name == '--iterations':
+            options['iterations'] = int(value)
+        elif name == '--bus-freq':
+            options['bus_freq'] = int(value)
+        else:
+            options['only'] = value.split(',')
+        i += 2
+    return options
+
+
+def main(argv):
+    options = parse_args(argv)
+    iterations = options['iterations']
+    only = options['only']
+
+    clock = RealClock() if MICROPYTHON else VirtualClock()
+    bus = host.install(clock)
+    sensor = host.add_sensor()
+    sensor.set_light(*LIGHTS['office'])
+
+    import uasyncio as asyncio
+    from array import array
+    from src.rgb_sensor_tcs34725 import Controller
+    from src.rgb_sensor_tcs34725.dn40_fixed import dn40_into, new_result
+    from src.main import create_webserver, LED_PIN, INTERRUPT_PIN, SCL_PIN, SDA_PIN, I2C_FREQ
+
+    bus_freq = options['bus_freq'] or I2C_FREQ
+    controller = Controller(SCL_PIN, SDA_PIN, bus_freq, LED_PIN, INTERRUPT_PIN)
+    driver = controller.driver
+    server = create_webserver({'0': controller})
+    server.compile()
+    loop = asyncio.new_event_loop()
+
+    rgbc = array('H', (1200, 1100, 800, 3000))
+    dn40_result = new_result()
+
+    def next_cycle():
+        clock.sleep_us(int(driver.cycle_time * 1000))
+
+    rgbcct = http_request(server, loop, RGBCCT_REQUEST)
+    status_line = rgbcct().status_line
+    if status_line != b'HTTP/1.1 200 OK':
+        raise RuntimeError("/rgbcct answered {}".format(status_line))
+
+    benchmarks = (
+        ('driver.color_raw', lambda: driver.color_raw, iterations, None),
+        ('driver._temperature_and_lux_dn40', driver._temperature_and_lux_dn40, iterations, None),
+        ('dn40_into', lambda: dn40_into(rgbc, 0xC0, 16, dn40_result), iterations, None),
+        ('controller.status', lambda: controller.status, iterations, None),
+        ('controller.calibrate', controller.calibrate, min(iterations, 100), None),
+        ('http.rgbcct', rgbcct, min(iterations, HTTP_ITERATIONS), next_cycle),
+        ('http.rgbcct_cached', rgbcct, min(iterations, HTTP_ITERATIONS * 4), None),
+    )
+
+    results = {
+        'implementation': sys.implementation.name,
+        'version': '.'.join(str(part) for part in sys.implementation.version[:3]),
+        'clock': 'virtual' if isinstance(clock, VirtualClock) else 'real',
+        'bus_freq': bus.freq,
+        'benchmarks': {},
+        'calibration': [],
+    }
+    for name, func, count, setup in benchmarks:
+        if only is not None and name not in only:
+            continue
+        results['benchmarks'][name] = measure(bus, func, count, setup)
+
+    if only is None or 'calibration' in only:
+        for mode in AUTO_EXPOSURE_MODES:
+            controller.auto_exposure = mode
+            for light in CALIBRATION_STEPS:
+                results['calibration'].append(calibration_settling(controller, sensor, clock, bus, light))
+
+    with open(options['output'], 'w') as file:
+        json.dump(results, file)
+
+    print()
+    for name, result in results['benchmarks'].items():
+        print("{:34} {:10.1f} us {:6.2f} tx {:7.1f} B {:>8} alloc B".format(
+            name, result['us_per_op'], result['transactions_per_op'], result['bytes_per_op'],
+            'n/a' if result['alloc_bytes_per_op'] is None else '{:.0f}'.format(result['alloc_bytes_per_op'])))
+    for result in results['calibration']:
+        if result['settled']:
+            state = 'settled'
+        elif result['saturated']:
+            state = 'SATURATED'
+        else:
+            state = 'NOT settled'
+        print("{:10} calibration to {:9} {:11} in {:8.1f} ms, {} calibrations, {} tx".format(
+            result['mode'], result['light'], state, result['settle_ms'],
+            result['calibrations'], result['transactions']))
+    print("results written to", options['output'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -5,31 +5,46 @@ Created on Sat Oct 26 18:25:56 2019
 @author: jcron
 """
 
-import csv
+import argparse
+import os
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
-from datetime import datetime
+from downsample import Pyramid, build_pyramid, pyramid_path
 
-columns = ["red", 'green', 'blue', 'clear', 'ct', 'ct_alt', 'timestamp']
+# Points drawn for whatever range is on screen
+SCREEN_POINTS = 2000
 
-data = {
-        "ct": [],
-        "timestamp": []
-    }
+parser = argparse.ArgumentParser(description="Plots a column of a sample log against time")
+parser.add_argument('log', nargs='?', default='Y:/raw.tcslog', help="log made with sample_log.py convert")
+parser.add_argument('--column', default='ct_alt')
+parser.add_argument('--mode', choices=('minmax', 'lttb'), default='minmax')
+args = parser.parse_args()
 
-count = 0
+try:
+    pyramid = Pyramid(args.log, args.column)
+except (OSError, ValueError):
+    print("building pyramid in", pyramid_path(args.log, args.column))
+    build_pyramid(args.log, args.column)
+    pyramid = Pyramid(args.log, args.column)
 
-with open('Y:/raw.csv', newline='\n') as csvfile:
-    reader = csv.reader(csvfile, delimiter=',')
-    for row in reader:
-        data['ct'].append(row[5])
-        ts = datetime.strptime(row[6].split('.')[0],"%Y-%m-%dT%H:%M:%S")
-        data['timestamp'].append(ts)
-        count += 1
-        if count > 10:
-            break
+def to_datetimes(timestamps):
+    return timestamps.view('datetime64[ms]')
 
-print("data arrays created")
+timestamps, values = pyramid.query(points=SCREEN_POINTS, mode=args.mode)
+print("{} of {} rows plotted".format(len(values), len(pyramid.log)))
 
 plt.figure(1)
-plt.plot(range(0,len(data['ct'])), data['ct'])
+line, = plt.plot(to_datetimes(timestamps), values)
+axes = line.axes
+
+def on_xlim_changed(axes):
+    """Re-queries the pyramid for the range zoomed or panned to"""
+    start, end = axes.get_xlim()
+    start_ms = int(mdates.num2date(start).timestamp() * 1000)
+    end_ms = int(mdates.num2date(end).timestamp() * 1000)
+    timestamps, values = pyramid.query(start_ms, end_ms, SCREEN_POINTS, args.mode)
+    line.set_data(to_datetimes(timestamps), values)
+    axes.figure.canvas.draw_idle()
+
+axes.callbacks.connect('xlim_changed', on_xlim_changed)
 plt.show()
\ No newline at end of file
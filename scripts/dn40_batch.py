@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+DN40 lux and color temperature for recorded RGBC data, vectorized with NumPy.
+
+The math is dn40.temperature_and_lux_dn40 (the float reference) applied to
+whole arrays, with saturation and ripple handling taken from each row's own
+gain and ATIME. Saturated rows get NaN.
+
+Inputs are read through memory maps and processed in chunks of rows, so
+files larger than memory work; with --workers the chunks are spread over a
+process pool, each worker mapping the input and the output itself.
+
+    python dn40_batch.py samples.bin lux_ct.npy [--workers 8] [--check]
+    python dn40_batch.py raw.tcslog lux_ct.npy --gain 16 --atime 0xC0
+
+Inputs are binary sample batches as served by /samples (see export.py),
+one or several appended to one file; .npy files of records with r, g, b, c,
+gain and atime fields; or sample logs (see sample_log.py), which record no
+gain or ATIME, so those are given with --gain and --atime.
+The output is a .npy file of (lux, ct) float64 records, one per input row.
+
+@author: jcron
+"""
+import argparse
+import importlib.util
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sample_log import META_FILE, open_log
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rgb_sensor', 'src', 'rgb_sensor_tcs34725')
+
+
+def load_module(name):
+    """Loads a module of the driver package by path; the package itself
+    imports machine and can not be imported on CPython.
+    """
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PACKAGE_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Device specific values (DN40 Table 1 in Appendix I), from the float reference
+dn40 = load_module('dn40')
+TIME_ONE_CYCLE = dn40.TIME_ONE_CYCLE
+GA = dn40.GA
+DF = dn40.DF
+R_COEF = dn40.R_COEF
+G_COEF = dn40.G_COEF
+B_COEF = dn40.B_COEF
+CT_COEF = dn40.CT_COEF
+CT_OFFSET = dn40.CT_OFFSET
+
+# The /samples batch format (export.py): magic, version, record size, record
+# count, first seq, latest seq, dropped
+BATCH_HEADER_FORMAT = '<4sBBHIII'
+BATCH_HEADER_SIZE = struct.calcsize(BATCH_HEADER_FORMAT)
+RECORD_DTYPE = np.dtype([
+    ('seq', '<u2'),
+    ('timestamp', '<u4'),
+    ('r', '<u2'),
+    ('g', '<u2'),
+    ('b', '<u2'),
+    ('c', '<u2'),
+    ('gain', 'u1'),
+    ('atime', 'u1'),
+])
+RESULT_DTYPE = np.dtype([('lux', '<f8'), ('ct', '<f8')])
+
+DEFAULT_CHUNK_ROWS = 1 << 20
+
+
+def temperature_and_lux(r, g, b, c, atime, gain):
+    """Vectorized DN40. Every argument is an array (or a scalar) and they
+    broadcast together; returns (lux, ct) float64 arrays with NaN where the
+    clear channel is saturated.
+    """
+    r = np.asarray(r, dtype=np.float64)
+    g = np.asarray(g, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    c = np.asarray(c, dtype=np.float64)
+    cycles = 256 - np.asarray(atime, dtype=np.int32)
+    atime_ms = cycles * TIME_ONE_CYCLE
+
+    # Analog/digital saturation (DN40 3.5), less a quarter for ripple (3.7)
+    saturation = np.where(cycles > 63, 65535.0, 1024.0 * cycles)
+    saturation = np.where(atime_ms < 150, saturation * 0.75, saturation)
+    saturated = c >= saturation
+
+    # IR rejection (DN40 3.1)
+    rgb = r + g + b
+    ir = np.where(rgb > c, (rgb - c) / 2, 0.0)
+    r2 = r - ir
+    g2 = g - ir
+    b2 = b - ir
+
+    # Lux (DN40 3.2)
+    g1 = R_COEF * r2 + G_COEF * g2 + B_COEF * b2
+    cpl = atime_ms * np.asarray(gain, dtype=np.float64) / (GA * DF)
+    cpl = np.where(cpl == 0, 0.001, cpl)
+    lux = g1 / cpl
+
+    # CT (DN40 3.4)
+    r2 = np.where(r2 == 0, 0.001, r2)
+    ct = CT_COEF * b2 / r2 + CT_OFFSET
+
+    lux = np.where(saturated, np.nan, lux)
+    ct = np.where(saturated, np.nan, ct)
+    return lux, ct
+
+
+class BatchRecords:
+    """The records of several sample batches appended to one file, each
+    batch memory mapped; slices spanning batches are copied together.
+    """
+
+    def __init__(self, batches):
+        self.batches = batches
+        self.starts = np.cumsum([0] + [len(batch) for batch in batches])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("only contiguous slices are supported")
+            parts = []
+            for batch_start, batch in zip(self.starts, self.batches):
+                lo = max(start - batch_start, 0)
+                hi = min(stop - batch_start, len(batch))
+                if lo < hi:
+                    parts.append(batch[lo:hi])
+            if not parts:
+                return np.zeros(0, dtype=RECORD_DTYPE)
+            return parts[0] if len(parts) == 1 else np.concatenate(parts)
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        batch = int(np.searchsorted(self.starts, index, side='right')) - 1
+        return self.batches[batch][index - self.starts[batch]]
+
+
+class LogRecords:
+    """A sample log seen as records: r, g, b and c are its columns, gain and
+    atime its own columns if it has them, else the given values.
+    """
+
+    def __init__(self, log, gain=None, atime=None):
+        self.log = log
+        self.fields = {'r': log['red'], 'g': log['green'], 'b': log['blue'], 'c': log['clear']}
+        for name, value in (('gain', gain), ('atime', atime)):
+            if name in log.columns:
+                self.fields[name] = log[name]
+            elif value is None:
+                raise ValueError("{} records no {}; give --{}".format(log.path, name, name))
+            else:
+                self.fields[name] = value
+
+    def __len__(self):
+        return len(self.log)
+
+    def __getitem__(self, index):
+        return {
+            name: value[index] if isinstance(value, np.ndarray) else value
+            for name, value in self.fields.items()
+        }
+
+
+def map_batches(path):
+    """Memory maps every sample batch in a file. Raises ValueError on a
+    truncated batch or on bytes after the last one that are not a batch.
+    """
+    size = os.path.getsize(path)
+    batches = []
+    offset = 0
+    with open(path, 'rb') as file:
+        while offset < size:
+            file.seek(offset)
+            header = file.read(BATCH_HEADER_SIZE)
+            if len(header) < BATCH_HEADER_SIZE or header[:4] != b'TCSS':
+                if not batches:
+                    raise ValueError("{} is neither a .npy file, a sample log nor a sample batch".format(path))
+                raise ValueError("{}: {} trailing bytes at offset {} are not a sample batch".format(
+                    path, size - offset, offset))
+            _, _, record_size, count, _, _, _ = struct.unpack(BATCH_HEADER_FORMAT, header)
+            if record_size != RECORD_DTYPE.itemsize:
+                raise ValueError("{}: records of {} bytes at offset {}, expected {}".format(
+                    path, record_size, offset, RECORD_DTYPE.itemsize))
+            offset += BATCH_HEADER_SIZE
+            if offset + count * record_size > size:
+                raise ValueError("{}: truncated, header at offset {} counts {} records".format(
+                    path, offset - BATCH_HEADER_SIZE, count))
+            if count:
+                batches.append(np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=offset, shape=(count,)))
+            offset += count * record_size
+    if not batches:
+        # Empty file, or empty batches only
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    if len(batches) == 1:
+        return batches[0]
+    return BatchRecords(batches)
+
+
+def open_records(path, gain=None, atime=None):
+    """Opens an input as records (see the module docstring), mapping it
+    rather than reading it. gain and atime are used only for sample logs.
+    """
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    if os.path.isfile(os.path.join(path, META_FILE)):
+        return LogRecords(open_log(path), gain, atime)
+    return map_batches(path)
+
+
+def process_rows(records, out, start, stop):
+    """Computes rows [start, stop) of records into out"""
+    rows = records[start:stop]
+    lux, ct = temperature_and_lux(rows['r'], rows['g'], rows['b'], rows['c'], rows['atime'], rows['gain'])
+    out['lux'][start:stop] = lux
+    out['ct'][start:stop] = ct
+
+
+def _process_range(task):
+    """Pool worker: maps the files itself so no rows are pickled"""
+    input_path, output_path, start, stop, gain, atime = task
+    records = open_records(input_path, gain, atime)
+    out = np.load(output_path, mmap_mode='r+')
+    process_rows(records, out, start, stop)
+    out.flush()
+    return stop - start
+
+
+def chunk_ranges(count, chunk_rows):
+    return [(start, min(start + chunk_rows, count)) for start in range(0, count, chunk_rows)]
+
+
+def process_file(input_path, output_path, chunk_rows=DEFAULT_CHUNK_ROWS, workers=None, gain=None, atime=None):
+    """Computes lux and CCT for every row of input_path into a new .npy file
+    at output_path. Returns the number of rows.
+    """
+    records = open_records(input_path, gain, atime)
+    count = len(records)
+    out = np.lib.format.open_memmap(output_path, mode='w+', dtype=RESULT_DTYPE, shape=(count,))
+    ranges = chunk_ranges(count, chunk_rows)
+
+    if not workers or workers == 1 or len(ranges) == 1:
+        for start, stop in ranges:
+            process_rows(records, out, start, stop)
+        out.flush()
+        return count
+
+    # The header is on disk before any worker maps the file
+    out.flush()
+    del out
+    tasks = [(input_path, output_path, start, stop, gain, atime) for start, stop in ranges]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(_process_range, tasks))
+
+
+def check_against_reference(input_path, output_path, rows=1000, seed=40, gain=None, atime=None):
+    """Recomputes a random selection of rows with dn40.py and compares.
+    Returns the largest relative difference found.
+    """
+    records = open_records(input_path, gain, atime)
+    out = np.load(output_path, mmap_mode='r')
+    rng = np.random.default_rng(seed)
+    worst = 0.0
+    for i in rng.integers(0, len(records), size=min(rows, len(records))):
+        row = records[i]
+        lux, ct = dn40.temperature_and_lux_dn40(
+            int(row['r']), int(row['g']), int(row['b']), int(row['c']), int(row['atime']), int(row['gain'])
+        )
+        if lux is None:
+            if not (np.isnan(out['lux'][i]) and np.isnan(out['ct'][i])):
+                raise AssertionError("row {} should be saturated".format(i))
+            continue
+        for expected, actual in ((lux, out['lux'][i]), (ct, out['ct'][i])):
+            worst = max(worst, abs(expected - actual) / max(1.0, abs(expected)))
+    return worst
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('input', help="sample batches (.bin), record .npy file or sample log")
+    parser.add_argument('output', help=".npy file to write (lux, ct) records to")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--workers', type=int, default=None, help="processes; default is to run in this one")
+    parser.add_argument('--check', action='store_true', help="compare some rows against dn40.py")
+    parser.add_argument('--gain', type=int, default=None, help="gain of a sample log without a gain column")
+    parser.add_argument('--atime', type=lambda text: int(text, 0), default=None,
+                        help="ATIME of a sample log without an atime column")
+    args = parser.parse_args(argv)
+
+    count = process_file(args.input, args.output, args.chunk_rows, args.workers, args.gain, args.atime)
+    print("{} rows -> {}".format(count, args.output))
+    if args.check:
+        worst = check_against_reference(args.input, args.output, gain=args.gain, atime=args.atime)
+        print("largest relative difference from dn40.py: {:.3g}".format(worst))
+        if worst > 1e-9:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
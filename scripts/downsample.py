@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Downsampling of long captures for plotting.
+
+minmax keeps the lowest and highest point of every bucket, so no spike
+disappears. lttb (Largest Triangle Three Buckets) keeps one point per
+bucket, the one that best preserves the shape of the line. Either reduces
+any range to about screen resolution.
+
+For interactive zooming, build_pyramid stores min/max levels of a log
+column next to the log (pyramid_<column>/ in the log directory), each
+FACTOR times coarser than the one below. query() picks the finest level
+that covers a time range with few enough points and downsamples only
+that slice, so a query costs about the same at any zoom.
+
+    python downsample.py build raw.tcslog ct_alt
+
+@author: jcron
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+from sample_log import open_log
+
+# Rows per bucket of the finest level, and the ratio between levels
+BASE_BUCKET = 8
+FACTOR = 8
+# Levels stop once they are this small
+MIN_LEVEL_POINTS = 4096
+# Rows reduced at a time while building the finest level
+BUILD_CHUNK_ROWS = BASE_BUCKET * (1 << 17)
+PYRAMID_VERSION = 1
+
+
+def minmax(x, y, buckets):
+    """Reduces (x, y) to the minimum and maximum of each of `buckets`
+    equal buckets, in x order: at most 2 * buckets points. Buckets where y
+    is all NaN contribute NaN points, which plot as gaps.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if n <= 2 * buckets:
+        return x, y
+    size = -(-n // buckets)
+    buckets = -(-n // size)
+    padded = buckets * size
+
+    low = np.full(padded, np.inf)
+    low[:n] = y
+    high = np.full(padded, -np.inf)
+    high[:n] = y
+    nan = np.isnan(low)
+    low[nan] = np.inf
+    high[nan] = -np.inf
+
+    offsets = np.arange(buckets) * size
+    low_index = offsets + np.argmin(low.reshape(buckets, size), axis=1)
+    high_index = offsets + np.argmax(high.reshape(buckets, size), axis=1)
+    # Both may fall in the padding of the last bucket
+    low_index = np.minimum(low_index, n - 1)
+    high_index = np.minimum(high_index, n - 1)
+
+    index = np.empty(2 * buckets, dtype=np.int64)
+    index[0::2] = np.minimum(low_index, high_index)
+    index[1::2] = np.maximum(low_index, high_index)
+    return x[index], y[index]
+
+
+def lttb(x, y, points):
+    """Largest Triangle Three Buckets: reduces (x, y) to `points` points,
+    always keeping the first and last. NaN points are dropped first.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    keep = ~np.isnan(y)
+    if not keep.all():
+        x = x[keep]
+        y = y[keep]
+    n = len(y)
+    if points >= n or points < 3:
+        return x, y
+
+    xf = x.astype(np.float64)
+    yf = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    index = np.empty(points, dtype=np.int64)
+    index[0] = 0
+    index[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        # The next bucket's average is the third corner of the triangle
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = xf[stop:next_stop].mean() if next_stop > stop else xf[-1]
+        next_y = yf[stop:next_stop].mean() if next_stop > stop else yf[-1]
+        area = np.abs(
+            (xf[a] - next_x) * (yf[start:stop] - yf[a])
+            - (xf[a] - xf[start:stop]) * (next_y - yf[a])
+        )
+        a = start + int(np.argmax(area))
+        index[i + 1] = a
+    return x[index], y[index]
+
+
+def downsample(x, y, points, mode='minmax'):
+    """Reduces (x, y) to about `points` points"""
+    if mode == 'lttb':
+        return lttb(x, y, points)
+    return minmax(x, y, max(1, points // 2))
+
+
+def pyramid_path(log_path, column):
+    return os.path.join(log_path, 'pyramid_' + column)
+
+
+def _level_paths(path, level):
+    return (
+        os.path.join(path, '{}.x.bin'.format(level)),
+        os.path.join(path, '{}.y.bin'.format(level)),
+    )
+
+
+def build_pyramid(log_path, column):
+    """Builds the min/max levels of a log column. The finest level is
+    reduced from the memory mapped column a chunk at a time; every other
+    level from the one below it.
+    """
+    log = open_log(log_path)
+    path = pyramid_path(log_path, column)
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    timestamps = log['timestamp']
+    values = log[column]
+    x_path, y_path = _level_paths(path, 0)
+    count = 0
+    with open(x_path, 'wb') as x_file, open(y_path, 'wb') as y_file:
+        for start in range(0, len(log), BUILD_CHUNK_ROWS):
+            stop = min(start + BUILD_CHUNK_ROWS, len(log))
+            x, y = minmax(timestamps[start:stop], values[start:stop], -(-(stop - start) // BASE_BUCKET))
+            x_file.write(np.asarray(x, dtype='<i8').tobytes())
+            y_file.write(np.asarray(y, dtype='<f4').tobytes())
+            count += len(y)
+    levels = [{'bucket_rows': BASE_BUCKET, 'points': count}]
+
+    bucket_rows = BASE_BUCKET
+    while count > MIN_LEVEL_POINTS:
+        x, y = _map_level(path, len(levels) - 1, count)
+        # Each bucket holds FACTOR buckets of the level below, min and max of each
+        x, y = minmax(x, y, -(-count // (2 * FACTOR)))
+        bucket_rows *= FACTOR
+        x_path, y_path = _level_paths(path, len(levels))
+        np.asarray(x, dtype='<i8').tofile(x_path)
+        np.asarray(y, dtype='<f4').tofile(y_path)
+        count = len(y)
+        levels.append({'bucket_rows': bucket_rows, 'points': count})
+
+    meta = {
+        'version': PYRAMID_VERSION,
+        'column': column,
+        'rows': len(log),
+        'levels': levels,
+    }
+    with open(meta_path, 'w') as file:
+        json.dump(meta, file, indent=2)
+    return meta
+
+
+def _map_level(path, level, points):
+    x_path, y_path = _level_paths(path, level)
+    if points == 0:
+        return np.zeros(0, dtype='<i8'), np.zeros(0, dtype='<f4')
+    return (
+        np.memmap(x_path, dtype='<i8', mode='r', shape=(points,)),
+        np.memmap(y_path, dtype='<f4', mode='r', shape=(points,)),
+    )
+
+
+class Pyramid:
+    """The stored levels of one log column, for query()"""
+
+    def __init__(self, log_path, column):
+        self.log = open_log(log_path)
+        self.column = column
+        path = pyramid_path(log_path, column)
+        with open(os.path.join(path, 'meta.json')) as file:
+            self.meta = json.load(file)
+        if self.meta.get('version') != PYRAMID_VERSION or self.meta['rows'] != len(self.log):
+            raise ValueError("Pyramid of {} is out of date; build it again".format(column))
+        self.levels = [_map_level(path, i, level['points']) for i, level in enumerate(self.meta['levels'])]
+
+    def query(self, start_ms=None, end_ms=None, points=2000, mode='minmax'):
+        """Returns (timestamps in ms, values) for the time range, reduced to
+        about `points` points
+        """
+        timestamps = self.log['timestamp']
+        values = self.log[self.column]
+        first, last = _range(timestamps, start_ms, end_ms)
+        if last - first <= points:
+            return np.asarray(timestamps[first:last]), np.asarray(values[first:last])
+
+        # Levels are in order of coarseness: use the finest small enough
+        x, y = timestamps, values
+        for level_x, level_y in self.levels:
+            if last - first <= 4 * points:
+                break
+            first, last = _range(level_x, start_ms, end_ms)
+            x, y = level_x, level_y
+        return downsample(np.asarray(x[first:last]), np.asarray(y[first:last]), points, mode)
+
+
+def _range(timestamps, start_ms, end_ms):
+    first = 0 if start_ms is None else int(np.searchsorted(timestamps, start_ms, 'left'))
+    last = len(timestamps) if end_ms is None else int(np.searchsorted(timestamps, end_ms, 'right'))
+    return first, last
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Downsampling pyramids for sample logs")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="build the pyramid of a log column")
+    build.add_argument('log')
+    build.add_argument('column')
+    args = parser.parse_args(argv)
+
+    meta = build_pyramid(args.log, args.column)
+    for i, level in enumerate(meta['levels']):
+        print("level {}: {} rows per bucket, {} points".format(i, level['bucket_rows'], level['points']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
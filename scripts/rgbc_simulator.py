@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Forward simulation of the TCS3472: from an illuminant spectrum and a lux
+level to the RGBC counts the chip would report at a given gain and ATIME.
+
+Channel responses come from SpectralModel. Counts are scaled so that DN40
+(as in dn40.py) computes exactly the requested lux from noiseless,
+unsaturated counts; what the simulator adds on top is what the chip adds:
+
+    - mains ripple: light flickering at twice the mains frequency,
+      averaged over the integration window from a random phase
+    - shot noise (Gaussian approximation of Poisson)
+    - analog saturation at 1024 counts per 2.4 ms cycle
+    - digital saturation at 65535
+
+Everything is NumPy over arrays of samples, so millions of samples per
+second are generated for load and accuracy benchmarks.
+
+    python rgbc_simulator.py --samples 1000000 --ripple 0.3 --output workload.npy
+
+The output .npy has the r, g, b, c, gain and atime fields dn40_batch.py
+reads, plus the true lux and the CCT of the source spectrum.
+
+@author: jcron
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+from dn40_batch import GA, DF, R_COEF, G_COEF, B_COEF, TIME_ONE_CYCLE, temperature_and_lux
+from spectral_model import SpectralModel
+
+GAINS = (1, 4, 16, 60)
+ANALOG_FULL_SCALE = 1024
+DIGITAL_FULL_SCALE = 65535
+
+# Planck's law constants
+H = 6.62607015e-34
+C_LIGHT = 299792458.0
+K_B = 1.380649e-23
+
+SAMPLE_DTYPE = np.dtype([
+    ('r', '<u2'),
+    ('g', '<u2'),
+    ('b', '<u2'),
+    ('c', '<u2'),
+    ('gain', 'u1'),
+    ('atime', 'u1'),
+    ('lux_true', '<f4'),
+    ('cct_source', '<f4'),
+])
+
+
+def blackbody(wavelengths_nm, kelvin):
+    """Relative spectral radiance of black bodies, one row per temperature,
+    each normalized to a peak of 1
+    """
+    wavelengths = np.asarray(wavelengths_nm, dtype=np.float64)[np.newaxis, :] * 1e-9
+    kelvin = np.atleast_1d(np.asarray(kelvin, dtype=np.float64))[:, np.newaxis]
+    radiance = 1.0 / (wavelengths ** 5 * np.expm1(H * C_LIGHT / (wavelengths * K_B * kelvin)))
+    return radiance / radiance.max(axis=1, keepdims=True)
+
+
+def g1(counts):
+    """DN40 G1 (IR corrected illuminance term) of (n, 4) counts"""
+    r, g, b, c = counts[:, 0], counts[:, 1], counts[:, 2], counts[:, 3]
+    ir = np.maximum(r + g + b - c, 0.0) / 2
+    return R_COEF * (r - ir) + G_COEF * (g - ir) + B_COEF * (b - ir)
+
+
+class RGBCSimulator:
+    """Turns spectra into counts.
+
+    ripple_depth is the relative amplitude of the flicker (0 for daylight,
+    around 0.3 for magnetic-ballast fluorescent tubes).
+    """
+
+    def __init__(self, model=None, ripple_depth=0.0, mains_hz=60, noise=True, seed=None):
+        self.model = model if model is not None else SpectralModel()
+        self.ripple_depth = ripple_depth
+        self.flicker_hz = 2 * mains_hz
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+    def rates_per_lux(self, spectra):
+        """(n spectra, 4) counts per ms, at gain 1, per lux of each spectrum
+        (given on the model's grid)
+        """
+        response = self.model.channel_counts(spectra)
+        # Treated as counts from 1 ms at gain 1, DN40 gives G1 * GA * DF lux
+        return response / (g1(response) * GA * DF)[:, np.newaxis]
+
+    def simulate(self, rates, lux, gain, atime, phase=None):
+        """Counts for each sample: rates is (n, 4) from rates_per_lux (or one
+        row for all), lux, gain and atime are (n,) arrays or scalars. phase
+        is the flicker phase at the start of each integration, in radians;
+        random by default. Returns (n, 4) uint16.
+        """
+        lux = np.asarray(lux, dtype=np.float64)
+        gain = np.asarray(gain, dtype=np.float64)
+        cycles = 256 - np.asarray(atime, dtype=np.int64)
+        n = max(len(np.atleast_1d(lux)), len(np.atleast_1d(gain)), len(np.atleast_1d(cycles)), len(np.atleast_2d(rates)))
+        integration_ms = cycles * TIME_ONE_CYCLE
+
+        scale = lux * gain * integration_ms
+        if self.ripple_depth:
+            # Mean of 1 + m sin(wt) over the integration window
+            if phase is None:
+                phase = self.rng.uniform(0, 2 * np.pi, n)
+            w = 2 * np.pi * self.flicker_hz / 1000
+            window = w * integration_ms
+            scale = scale * (1 + self.ripple_depth * (np.cos(phase) - np.cos(phase + window)) / window)
+        counts = np.atleast_2d(rates) * np.broadcast_to(scale, (n,))[:, np.newaxis]
+
+        if self.noise:
+            counts = counts + self.rng.standard_normal(counts.shape) * np.sqrt(counts)
+
+        # The ADC saturates per cycle, at the peak of the ripple first
+        analog_limit = ANALOG_FULL_SCALE * np.broadcast_to(cycles, (n,)) / (1 + self.ripple_depth)
+        counts = np.minimum(counts, analog_limit[:, np.newaxis])
+        counts = np.clip(counts, 0, DIGITAL_FULL_SCALE)
+        return counts.astype(np.uint16)
+
+    def workload(self, samples, kelvin_range=(2000, 10000), lux_range=(1.0, 50000.0), gains=GAINS, atimes=None):
+        """Random samples: black body spectra between kelvin_range, lux drawn
+        log-uniformly from lux_range, gain and ATIME drawn from the values
+        given (every ATIME by default). Returns a SAMPLE_DTYPE array.
+        """
+        rng = self.rng
+        # A table of spectra is enough; each sample picks one
+        table_kelvin = np.linspace(kelvin_range[0], kelvin_range[1], 256)
+        table_rates = self.rates_per_lux(blackbody(self.model.wavelengths, table_kelvin))
+        pick = rng.integers(0, len(table_kelvin), samples)
+
+        lux = np.exp(rng.uniform(np.log(lux_range[0]), np.log(lux_range[1]), samples))
+        gain = rng.choice(np.asarray(gains), samples)
+        atime = rng.choice(np.arange(256) if atimes is None else np.asarray(atimes), samples)
+
+        counts = self.simulate(table_rates[pick], lux, gain, atime)
+        out = np.empty(samples, dtype=SAMPLE_DTYPE)
+        out['r'] = counts[:, 0]
+        out['g'] = counts[:, 1]
+        out['b'] = counts[:, 2]
+        out['c'] = counts[:, 3]
+        out['gain'] = gain
+        out['atime'] = atime
+        out['lux_true'] = lux
+        out['cct_source'] = table_kelvin[pick]
+        return out
+
+
+def accuracy(workload):
+    """Runs DN40 on a workload and summarizes its lux error against the truth"""
+    lux, ct = temperature_and_lux(workload['r'], workload['g'], workload['b'], workload['c'], workload['atime'], workload['gain'])
+    valid = ~np.isnan(lux)
+    error = np.abs(lux[valid] - workload['lux_true'][valid]) / workload['lux_true'][valid]
+    return {
+        'samples': len(workload),
+        'saturated': int((~valid).sum()),
+        'lux_median_error': float(np.median(error)) if len(error) else float('nan'),
+        'lux_p95_error': float(np.percentile(error, 95)) if len(error) else float('nan'),
+        'ct_median_error_k': float(np.median(np.abs(ct[valid] - workload['cct_source'][valid]))) if len(error) else float('nan'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates synthetic TCS3472 samples")
+    parser.add_argument('--samples', type=int, default=1000000)
+    parser.add_argument('--ripple', type=float, default=0.0, help="flicker depth, 0 to 1")
+    parser.add_argument('--mains-hz', type=int, default=60)
+    parser.add_argument('--no-noise', action='store_true')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', help=".npy file to write the samples to")
+    args = parser.parse_args(argv)
+
+    simulator = RGBCSimulator(ripple_depth=args.ripple, mains_hz=args.mains_hz, noise=not args.no_noise, seed=args.seed)
+    started = time.perf_counter()
+    workload = simulator.workload(args.samples)
+    elapsed = time.perf_counter() - started
+    print("{} samples in {:.3f}s ({:.2g} samples/s)".format(args.samples, elapsed, args.samples / elapsed))
+    for key, value in accuracy(workload).items():
+        print("  {}: {}".format(key, value))
+    if args.output:
+        np.save(args.output, workload)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
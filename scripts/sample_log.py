@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar sample logs.
+
+A log is a directory holding one raw little-endian file per column plus
+meta.json, which names the columns, their dtypes and the row count:
+
+    raw.tcslog/
+        meta.json
+        red.bin  green.bin  blue.bin  clear.bin   uint16
+        ct.bin  ct_alt.bin                         float32 (NaN if unknown)
+        timestamp.bin                              int64, ms since the epoch
+
+Columns are opened with numpy.memmap, so opening a log reads nothing but
+meta.json however large it is, and only the pages actually used are read.
+meta.json is written last; a directory without it is an unfinished
+conversion.
+
+    python sample_log.py convert raw.csv raw.tcslog
+    python sample_log.py info raw.tcslog
+
+@author: jcron
+"""
+import argparse
+import calendar
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+
+# Column order of the CSV captures
+CSV_COLUMNS = ('red', 'green', 'blue', 'clear', 'ct', 'ct_alt', 'timestamp')
+COLUMN_DTYPES = {
+    'red': '<u2',
+    'green': '<u2',
+    'blue': '<u2',
+    'clear': '<u2',
+    'ct': '<f4',
+    'ct_alt': '<f4',
+    'timestamp': '<i8',
+}
+DEFAULT_CHUNK_ROWS = 1 << 16
+
+
+class SampleLog:
+    """A log opened read-only; log['red'] is a memory mapped column"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as file:
+            self.meta = json.load(file)
+        if self.meta.get('version') != FORMAT_VERSION:
+            raise ValueError("{} is not a version {} sample log".format(path, FORMAT_VERSION))
+        self.rows = self.meta['rows']
+        self.columns = tuple(self.meta['columns'])
+        self._maps = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        column = self._maps.get(name)
+        if column is None:
+            dtype = np.dtype(self.meta['columns'][name])
+            if self.rows == 0:
+                # numpy can not map an empty file
+                column = np.zeros(0, dtype=dtype)
+            else:
+                column = np.memmap(column_path(self.path, name), dtype=dtype, mode='r', shape=(self.rows,))
+            self._maps[name] = column
+        return column
+
+    def datetimes(self):
+        """The timestamp column as datetime64[ms], without copying it"""
+        return self['timestamp'].view('datetime64[ms]')
+
+
+def column_path(path, name):
+    return os.path.join(path, name + '.bin')
+
+
+def open_log(path):
+    return SampleLog(path)
+
+
+class LogWriter:
+    """Appends rows to a new log, a chunk of column arrays at a time"""
+
+    def __init__(self, path, columns=COLUMN_DTYPES):
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        self.path = path
+        self.columns = dict(columns)
+        self.rows = 0
+        self._files = {name: open(column_path(path, name), 'wb') for name in self.columns}
+
+    def append(self, chunk, rows=None):
+        """chunk maps every column name to an array; only the first `rows`
+        entries of each are written (all of them by default)
+        """
+        for name, file in self._files.items():
+            values = np.asarray(chunk[name])
+            if rows is not None:
+                values = values[:rows]
+            file.write(values.astype(self.columns[name], copy=False).tobytes())
+        self.rows += len(values)
+
+    def close(self, complete=True):
+        """Closes the column files and, if complete, writes meta.json"""
+        for file in self._files.values():
+            file.close()
+        if not complete:
+            return
+        meta = {
+            'version': FORMAT_VERSION,
+            'rows': self.rows,
+            'columns': self.columns,
+        }
+        with open(os.path.join(self.path, META_FILE), 'w') as file:
+            json.dump(meta, file, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # A failed conversion is left without meta.json, i.e. unfinished
+        self.close(exc[0] is None)
+
+
+class TimestampParser:
+    """Parses ISO 8601 timestamps ('2019-10-26T18:25:56.123456', read as
+    UTC) to ms since the epoch. The date is only parsed when it differs from
+    the previous row's; the time of day is read by position.
+    """
+
+    def __init__(self):
+        self._date = None
+        self._date_ms = 0
+
+    def __call__(self, text):
+        date = text[:10]
+        if date != self._date:
+            self._date_ms = calendar.timegm(time.strptime(date, '%Y-%m-%d')) * 1000
+            self._date = date
+        ms = (
+            int(text[11:13]) * 3600000
+            + int(text[14:16]) * 60000
+            + int(text[17:19]) * 1000
+        )
+        if len(text) > 20 and text[19] == '.':
+            fraction = text[20:23]
+            ms += int(fraction) * 10 ** (3 - len(fraction))
+        return self._date_ms + ms
+
+
+def to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        # 'None' where the sensor could not compute a value
+        return float('nan')
+
+
+def convert_csv(csv_path, log_path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Streams a CSV capture (columns as in CSV_COLUMNS, with or without a
+    header row) into a new log. Memory use is one chunk of rows. Returns
+    the number of rows converted.
+    """
+    parse_timestamp = TimestampParser()
+    chunk = {name: np.empty(chunk_rows, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+    red, green, blue, clear = chunk['red'], chunk['green'], chunk['blue'], chunk['clear']
+    ct, ct_alt, timestamp = chunk['ct'], chunk['ct_alt'], chunk['timestamp']
+
+    with LogWriter(log_path) as writer, open(csv_path, newline='') as csvfile:
+        i = 0
+        for row in csv.reader(csvfile):
+            if not row:
+                continue
+            if not row[0].isdigit():
+                # Header
+                continue
+            red[i] = int(row[0])
+            green[i] = int(row[1])
+            blue[i] = int(row[2])
+            clear[i] = int(row[3])
+            ct[i] = to_float(row[4])
+            ct_alt[i] = to_float(row[5])
+            timestamp[i] = parse_timestamp(row[6])
+            i += 1
+            if i == chunk_rows:
+                writer.append(chunk)
+                i = 0
+        if i:
+            writer.append(chunk, i)
+        return writer.rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar sample logs")
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help="convert a CSV capture to a log")
+    convert.add_argument('csv')
+    convert.add_argument('log')
+    convert.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    info = commands.add_parser('info', help="describe a log")
+    info.add_argument('log')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        started = time.time()
+        rows = convert_csv(args.csv, args.log, args.chunk_rows)
+        print("{} rows in {:.1f}s -> {}".format(rows, time.time() - started, args.log))
+    else:
+        log = open_log(args.log)
+        print("{} rows".format(log.rows))
+        for name in log.columns:
+            print("  {:<10} {}".format(name, log.meta['columns'][name]))
+        if log.rows:
+            datetimes = log.datetimes()
+            print("from {} to {}".format(datetimes[0], datetimes[-1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Spectral response model of the TCS3472 built from the datasheet curves in
+data/TCS3472ColorSensitivity.csv.
+
+The four channel responses are resampled once onto a uniform wavelength
+grid. Integrals are then matrix products: Simpson's rule over any set of
+grid points is a fixed weight vector, so integrating many bands, or the
+response to many spectra, is a single multiply.
+
+@author: jcron
+"""
+import os
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+try:
+    from scipy.integrate import simpson
+except ImportError:
+    # scipy < 1.6
+    from scipy.integrate import simps as simpson
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'TCS3472ColorSensitivity.csv')
+CHANNELS = ('r', 'g', 'b', 'c')
+
+# Bands (first and last wavelength in nm, inclusive) used for the channel weights
+BANDS = {
+    'blue': (300, 480),
+    'green': (490, 560),
+    'red': (570, 680),
+    'ir': (690, 1100),
+}
+
+
+class SpectralModel:
+    """Channel responses on the grid start..stop nm in steps of `step` nm.
+
+    response is an (n wavelengths, 4) matrix, columns in CHANNELS order,
+    clamped at zero where the cubic resampling undershoots.
+    """
+
+    def __init__(self, csv_path=DEFAULT_CSV, start=300, stop=1100, step=10, kind='cubic'):
+        data = np.loadtxt(csv_path, delimiter=',', skiprows=1)
+        self.step = step
+        self.wavelengths = np.arange(start, stop + step, step, dtype=np.float64)
+        resample = interp1d(data[:, 0], data[:, 1:5], kind=kind, axis=0)
+        self.response = np.maximum(resample(self.wavelengths), 0.0)
+        # Integrating weights over the whole grid, folded into the response
+        self._weighted_response = self.simpson_weights(len(self.wavelengths))[:, np.newaxis] * self.response
+        self._band_integrals = {}
+
+    def simpson_weights(self, points):
+        """Weights w such that w @ f is simpson(f, dx=step) for any f of
+        `points` samples. Simpson's rule is linear in f, so the weights are
+        its result on the identity matrix.
+        """
+        if points < 2:
+            return np.zeros(points)
+        return simpson(np.eye(points), dx=self.step, axis=0)
+
+    def band_matrix(self, bands):
+        """(n bands, n wavelengths) matrix whose product with a function on
+        the grid integrates it over each (first, last) band
+        """
+        matrix = np.zeros((len(bands), len(self.wavelengths)))
+        for i, (first, last) in enumerate(bands):
+            inside = np.flatnonzero((self.wavelengths >= first) & (self.wavelengths <= last))
+            if len(inside):
+                matrix[i, inside] = self.simpson_weights(len(inside))
+        return matrix
+
+    def band_integrals(self, bands):
+        """(n bands, 4) integrals of each channel over each band. Results are
+        cached per band, so repeated sweeps only integrate new bands.
+        """
+        bands = [tuple(band) for band in bands]
+        missing = [band for band in bands if band not in self._band_integrals]
+        if missing:
+            for band, integrals in zip(missing, self.band_matrix(missing) @ self.response):
+                self._band_integrals[band] = integrals
+        return np.array([self._band_integrals[band] for band in bands])
+
+    def channel_areas(self):
+        """Integral of each channel over the whole grid"""
+        return self._weighted_response.sum(axis=0)
+
+    def channel_weights(self, bands):
+        """(n bands, 3): how much of the light in each band reaches the r, g
+        and b channels, normalized over the three
+        """
+        rgb = self.band_integrals(bands)[:, :3]
+        return rgb / rgb.sum(axis=1, keepdims=True)
+
+    def clear_fractions(self, bands):
+        """Share of the clear channel's response that falls in each band,
+        normalized over the bands given
+        """
+        clear = self.band_integrals(bands)[:, 3]
+        return clear / clear.sum()
+
+    def crosstalk(self, bands=(BANDS['red'], BANDS['green'], BANDS['blue'])):
+        """(n bands, 4): fraction of each channel's total response that
+        falls in each band. Off-diagonal entries are crosstalk.
+        """
+        return self.band_integrals(bands) / self.channel_areas()
+
+    def ir_fraction(self, ir_band=BANDS['ir']):
+        """Fraction of each channel's response that is infrared"""
+        return self.band_integrals([ir_band])[0] / self.channel_areas()
+
+    def rgb_excess(self):
+        """(r + g + b - c) / c over the whole grid: how far the sum of the
+        color channels overshoots the clear channel
+        """
+        r, g, b, c = self.channel_areas()
+        return (r + g + b - c) / c
+
+    def resample(self, wavelengths, spectra, kind='cubic'):
+        """Resamples spectra (n spectra, n wavelengths, or one spectrum) onto
+        the model's grid. Zero outside the wavelengths given.
+        """
+        spectra = np.atleast_2d(np.asarray(spectra, dtype=np.float64))
+        resample = interp1d(wavelengths, spectra, kind=kind, axis=1, bounds_error=False, fill_value=0.0)
+        return np.maximum(resample(self.wavelengths), 0.0)
+
+    def channel_counts(self, spectra):
+        """(n spectra, 4) integrated response of each channel to each
+        spectrum, given on the model's grid (see resample). One multiply.
+        """
+        return np.atleast_2d(spectra) @ self._weighted_response
+
+    def ir_fractions(self, spectra, ir_band=BANDS['ir']):
+        """(n spectra, 4): fraction of each channel's count, under each
+        spectrum, that comes from the infrared band
+        """
+        spectra = np.atleast_2d(spectra)
+        ir_weights = self.band_matrix([ir_band])[0][:, np.newaxis] * self.response
+        counts = self.channel_counts(spectra)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (spectra @ ir_weights) / counts
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures. Tests of modules under src import them through sim_host,
+which puts the simulator's stand-ins for the MicroPython modules in place
+first (see src/sim/host.py).
+
+@author: jcron
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rgb_sensor'))
+
+
+@pytest.fixture(scope='session')
+def sim_host():
+    from src.sim import host
+    host.install()
+    yield host
+    host.uninstall()
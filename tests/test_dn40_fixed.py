@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+The fixed point DN40 kernel (dn40_fixed.py) against the float reference
+(dn40.py), on CPython.
+
+Every gain is tried with every ATIME, at the saturation boundaries and on
+random channel values. Lux may differ by less than 0.001 lux and CCT by less
+than 1 K (both are truncated), and both must agree on saturation.
+
+@author: jcron
+"""
+import importlib.util
+import os
+import random
+
+import pytest
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rgb_sensor', 'src', 'rgb_sensor_tcs34725')
+GAINS = (1, 4, 16, 60)
+SAMPLES_PER_SETTING = 200
+LUX_TOLERANCE = 0.001
+CT_TOLERANCE = 1.0
+# Slack for the float reference's own rounding
+FLOAT_EPSILON = 1e-9
+
+
+def load_module(name):
+    """Loads a module of the driver package by path; the package itself
+    imports machine and can not be imported on CPython.
+    """
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PACKAGE_DIR, name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='module')
+def dn40():
+    return load_module('dn40')
+
+
+@pytest.fixture(scope='module')
+def dn40_fixed():
+    return load_module('dn40_fixed')
+
+
+def channel_values(atime, count, rng):
+    """Clear values around the saturation level plus random RGBC readings"""
+    cycles = 256 - atime
+    full_scale = min(65535, 1024 * cycles)
+    for c in (0, 1, full_scale * 3 // 4 - 1, full_scale * 3 // 4, full_scale - 1, full_scale):
+        c = min(c, 65535)
+        yield c // 3, c // 3, c // 3, c
+    for _ in range(count):
+        c = rng.randint(0, full_scale)
+        # Mostly physical readings (each channel below clear), some that are not
+        limit = c if rng.random() < 0.9 else full_scale
+        yield rng.randint(0, limit), rng.randint(0, limit), rng.randint(0, limit), c
+
+
+@pytest.mark.parametrize('gain', GAINS)
+def test_matches_float_reference(dn40, dn40_fixed, gain):
+    rng = random.Random(40 + gain)
+    failures = []
+    for atime in range(256):
+        for r, g, b, c in channel_values(atime, SAMPLES_PER_SETTING, rng):
+            lux, ct = dn40.temperature_and_lux_dn40(r, g, b, c, atime, gain)
+            lux_fixed, ct_fixed = dn40_fixed.temperature_and_lux_fixed(r, g, b, c, atime, gain)
+            case = (r, g, b, c, atime, gain)
+
+            if (lux is None) != (lux_fixed is None):
+                failures.append((case, 'saturation', lux, lux_fixed))
+                continue
+            if lux is None:
+                continue
+            if abs(lux - lux_fixed) >= LUX_TOLERANCE + FLOAT_EPSILON * abs(lux):
+                failures.append((case, 'lux', lux, lux_fixed))
+            if ct_fixed is None:
+                # R2 == 0: the float version divides by 0.001 instead
+                continue
+            if abs(ct - ct_fixed) >= CT_TOLERANCE + FLOAT_EPSILON * abs(ct):
+                failures.append((case, 'ct', ct, ct_fixed))
+    assert not failures, failures[:20]
+
+
+def test_saturated_reading_has_no_values(dn40_fixed):
+    result = dn40_fixed.new_result()
+    rgbc = dn40_fixed.array('H', (1000, 1000, 1000, 10240))
+    # 10 cycles: analog saturation at 10240, less a quarter for ripple
+    assert dn40_fixed.dn40_into(rgbc, 0xF6, 1, result) == dn40_fixed.DN40_SATURATED
+    assert dn40_fixed.result_values(result) == (None, None)
+
+
+def test_non_physical_reading_is_clamped(dn40, dn40_fixed):
+    # IR far beyond every channel: the float reference gives -2928868.4 lux,
+    # more thousandths than the int32 result holds
+    lux, ct = dn40.temperature_and_lux_dn40(65535, 65535, 65535, 0, 0xFF, 1)
+    lux_fixed, ct_fixed = dn40_fixed.temperature_and_lux_fixed(65535, 65535, 65535, 0, 0xFF, 1)
+    assert lux < -2147483.647
+    assert lux_fixed == -2147483.647
+    assert abs(ct - ct_fixed) < CT_TOLERANCE
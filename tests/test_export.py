@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+The /samples batch format (export.py): what pack_samples writes from a
+SampleRing, unpack_samples reads back, including sequence numbers past 16
+bits and samples the ring no longer holds.
+
+@author: jcron
+"""
+import pytest
+
+CAPACITY = 8
+
+
+@pytest.fixture(scope='module')
+def export(sim_host):
+    from src.rgb_sensor_tcs34725 import export
+    return export
+
+
+@pytest.fixture
+def ring(sim_host):
+    from src.rgb_sensor_tcs34725.ring_buffer import SampleRing
+    return SampleRing(CAPACITY)
+
+
+def push(ring, count):
+    for i in range(count):
+        ring.push(100 + i % 1000, 200, 300, 1000 + i % 60000, 16, 0xC0, 50 * i)
+
+
+def test_round_trip(export, ring):
+    push(ring, 5)
+    batch = export.pack_samples(ring)
+    assert len(batch) == export.HEADER_SIZE + 5 * export.RECORD_SIZE
+    header, records = export.unpack_samples(batch)
+    assert header == {'first_seq': 1, 'latest_seq': 5, 'dropped': 0, 'count': 5}
+    assert records[0] == (1, 0, 100, 200, 300, 1000, 16, 0xC0)
+    assert [record[0] for record in records] == [1, 2, 3, 4, 5]
+
+
+def test_since(export, ring):
+    push(ring, 5)
+    header, records = export.unpack_samples(export.pack_samples(ring, since=3))
+    assert [record[0] for record in records] == [4, 5]
+    assert header['dropped'] == 0
+
+
+def test_nothing_new(export, ring):
+    push(ring, 5)
+    header, records = export.unpack_samples(export.pack_samples(ring, since=5))
+    assert records == []
+    assert header['count'] == 0
+    assert header['latest_seq'] == 5
+
+
+def test_overwritten_samples_are_counted(export, ring):
+    push(ring, 20)
+    header, records = export.unpack_samples(export.pack_samples(ring, since=2))
+    # The ring holds 13..20; 3..12 are gone
+    assert [record[0] for record in records] == list(range(13, 21))
+    assert header['dropped'] == 10
+
+
+def test_sequence_numbers_past_16_bits(export, ring):
+    push(ring, 70000)
+    header, records = export.unpack_samples(export.pack_samples(ring, since=69995))
+    assert [record[0] for record in records] == [69996, 69997, 69998, 69999, 70000]
+    assert records[-1][1] == 50 * 69999
+
+
+def test_not_a_batch(export):
+    with pytest.raises(ValueError):
+        export.unpack_samples(b'JUNK' + bytes(export.HEADER_SIZE - 4))
+
+
+def test_json_matches_binary(export, ring):
+    push(ring, 3)
+    batch = export.samples_as_json(ring, since=1)
+    assert batch['count'] == 2
+    assert batch['samples'] == [[2, 50, 101, 200, 300, 1001, 16, 0xC0], [3, 100, 102, 200, 300, 1002, 16, 0xC0]]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+HDR merging (hdr.py) of simulated readings, on CPython.
+
+Light with the spectrum of the simulator's sunlight is swept from dim to
+the brightest the short exposure can read: the merged sample must give a
+DN40 lux within a few percent of the light's true lux all the way. Below 64
+cycles the clear channel saturates at 1024 counts per cycle (768 with the
+ripple margin), so at gain 1 nothing brighter than 320 counts/ms can be read
+at any ATIME; the full sunlight must come out saturated, not as a wrong lux.
+
+@author: jcron
+"""
+import pytest
+
+# Counts per ms at gain 1, as in scripts/benchmark.py
+SUNLIGHT = (400.0, 380.0, 300.0, 1100.0)
+# The reference lux is computed this far below the light, where the long
+# exposure reads it without saturating
+REFERENCE_SCALE = 0.001
+LUX_TOLERANCE = 0.03
+
+
+@pytest.fixture(scope='module')
+def modules(sim_host):
+    from src.rgb_sensor_tcs34725 import dn40, hdr
+    from src.sim import VirtualClock
+    from src.sim.tcs34725 import SimulatedTCS34725
+    return dn40, hdr, SimulatedTCS34725(VirtualClock())
+
+
+def read(sensor, light, exposure):
+    gain, atime = exposure
+    sensor.set_light(*light)
+    return list(sensor.counts(256 - atime, gain, 0))
+
+
+def merged_lux(modules, light):
+    dn40, hdr, sensor = modules
+    merger = hdr.HDRMerger()
+    short = read(sensor, light, merger.exposures[hdr.SHORT])
+    long = read(sensor, light, merger.exposures[hdr.LONG])
+    out = [0, 0, 0, 0]
+    gain, atime = merger.exposures[merger.merge_into(short, long, out)]
+    return dn40.temperature_and_lux_dn40(out[0], out[1], out[2], out[3], atime, gain)[0]
+
+
+def true_lux(modules, scale):
+    """DN40 lux of the unquantized counts, scaled up from a dim reading"""
+    dn40, hdr, _ = modules
+    gain, atime = hdr.DEFAULT_LONG_EXPOSURE
+    exposure_ms = gain * (256 - atime) * dn40.TIME_ONE_CYCLE
+    r, g, b, c = (rate * REFERENCE_SCALE * exposure_ms for rate in SUNLIGHT)
+    lux, _ = dn40.temperature_and_lux_dn40(r, g, b, c, atime, gain)
+    return lux * scale / REFERENCE_SCALE
+
+
+def test_short_exposure_is_one_cycle(modules):
+    _, hdr, _ = modules
+    assert hdr.DEFAULT_SHORT_EXPOSURE == (1, 0xFF)
+
+
+@pytest.mark.parametrize('scale', (0.0005, 0.002, 0.01, 0.05, 0.1, 0.2, 0.28))
+def test_merged_lux_is_valid_up_to_short_saturation(modules, scale):
+    light = tuple(rate * scale for rate in SUNLIGHT)
+    lux = merged_lux(modules, light)
+    expected = true_lux(modules, scale)
+    assert lux is not None
+    assert abs(lux - expected) <= LUX_TOLERANCE * expected, (lux, expected)
+
+
+def test_full_sunlight_is_saturated(modules):
+    assert merged_lux(modules, SUNLIGHT) is None
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Request parsing (lite_server/request.py) on in-memory connections: well
+formed and pipelined requests, and every request the reader refuses with a
+RequestError and the status to answer it with.
+
+@author: jcron
+"""
+import asyncio
+
+import pytest
+
+# Seconds a slow client is given to complete its header in the 408 test
+HEADER_TIMEOUT = 0.2
+
+
+class MemoryReader:
+    """Request bytes without a socket, at most chunk bytes per read and
+    delay seconds before each
+    """
+
+    def __init__(self, data, chunk=None, delay=0):
+        self._data = data
+        self._offset = 0
+        self._chunk = chunk
+        self._delay = delay
+
+    async def readinto(self, buf):
+        if self._delay:
+            await asyncio.sleep(self._delay)
+        count = min(len(buf), len(self._data) - self._offset)
+        if self._chunk is not None:
+            count = min(count, self._chunk)
+        buf[:count] = self._data[self._offset:self._offset + count]
+        self._offset += count
+        return count
+
+
+@pytest.fixture(scope='module')
+def request_module(sim_host):
+    from src.lite_server import request
+    return request
+
+
+def read_requests(request_module, data, count=1, **kwargs):
+    reader = request_module.RequestReader(MemoryReader(data, **kwargs))
+
+    async def read():
+        return [await reader.read_request(header_timeout=HEADER_TIMEOUT) for _ in range(count)]
+
+    return asyncio.run(read())
+
+
+def request_error(request_module, data, **kwargs):
+    with pytest.raises(request_module.RequestError) as error:
+        read_requests(request_module, data, **kwargs)
+    return error.value.status
+
+
+def test_get(request_module):
+    request, = read_requests(request_module, b"GET /samples?since=12&format=json HTTP/1.1\r\nHost: sensor\r\n\r\n")
+    assert (request.method, request.uri, request.version) == ('GET', '/samples?since=12&format=json', 'HTTP/1.1')
+    assert request.path == '/samples'
+    assert request.query == {'since': '12', 'format': 'json'}
+    assert request.get_header('HOST') == 'sensor'
+    assert request.body is None
+    assert request.keep_alive
+
+
+def test_pipelined_requests_and_end_of_stream(request_module):
+    data = (
+        b"POST /led HTTP/1.1\r\nContent-Type: application/json\r\nContent-Length: 12\r\n\r\n{\"on\": true}"
+        b"GET /rgbcct HTTP/1.0\r\nConnection: close\r\n\r\n"
+    )
+    # Three bytes per read: the header end and the body straddle reads
+    post, get, end = read_requests(request_module, data, count=3, chunk=3)
+    assert post.body == {'on': True}
+    assert get.path == '/rgbcct'
+    assert not get.keep_alive
+    assert end is None
+
+
+@pytest.mark.parametrize('data', (
+    b"GET /\r\n\r\n",
+    b"GET / HTTP/1.1 extra\r\n\r\n",
+    b"GET / HTTP/1.1\r\nno colon here\r\n\r\n",
+    b"POST / HTTP/1.1\r\nContent-Length: abc\r\n\r\n",
+    b"POST / HTTP/1.1\r\nContent-Length: -5\r\n\r\n",
+    b"POST / HTTP/1.1\r\nContent-Length:\r\n\r\n",
+    "GET / HTTP/1.1\r\nX-Name: café\r\n\r\n".encode('utf-8'),
+    b"POST / HTTP/1.1\r\nContent-Type: application/json\r\nContent-Length: 3\r\n\r\n{x]",
+    b"POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nshort",
+))
+def test_malformed_request_is_400(request_module, data):
+    assert request_error(request_module, data) == 400
+
+
+def test_large_body_is_413(request_module):
+    data = "POST / HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(request_module.MAX_BODY_BYTES + 1).encode()
+    assert request_error(request_module, data) == 413
+
+
+def test_large_header_is_431(request_module):
+    data = b"GET / HTTP/1.1\r\nX-Padding: " + b"x" * request_module.MAX_HEADER_BYTES + b"\r\n\r\n"
+    assert request_error(request_module, data) == 431
+
+
+def test_too_many_headers_is_431(request_module):
+    lines = ''.join('X-{}: {}\r\n'.format(i, i) for i in range(request_module.MAX_HEADER_COUNT + 1))
+    data = 'GET / HTTP/1.1\r\n{}\r\n'.format(lines).encode()
+    assert request_error(request_module, data) == 431
+
+
+def test_slow_header_is_408(request_module):
+    data = b"GET / HTTP/1.1\r\nHost: sensor\r\n\r\n"
+    # One byte every 20 ms: the header takes 0.6 s
+    assert request_error(request_module, data, chunk=1, delay=0.02) == 408
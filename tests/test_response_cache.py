@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+ETags of cached responses (lite_server/response_cache.py): the forms of
+If-None-Match that match, and ETags being specific to a boot.
+
+@author: jcron
+"""
+import pytest
+
+
+@pytest.fixture(scope='module')
+def cache(sim_host):
+    from src.lite_server import response_cache
+    return response_cache
+
+
+@pytest.mark.parametrize('if_none_match, matches', (
+    (None, False),
+    ('', False),
+    ('"{etag}"', True),
+    ('W/"{etag}"', True),
+    ('*', True),
+    ('"other", "{etag}"', True),
+    ('"other",W/"{etag}"', True),
+    ('"other"', False),
+    ('{etag}', False),
+))
+def test_etag_matches(cache, if_none_match, matches):
+    etag = cache.make_etag(42)
+    if if_none_match:
+        if_none_match = if_none_match.format(etag=etag.strip('"'))
+    assert cache.etag_matches(if_none_match, etag) is matches
+
+
+def test_etag_depends_on_version(cache):
+    assert cache.make_etag(1) != cache.make_etag(2)
+    assert cache.make_etag((1, 2)) != cache.make_etag((1, 3))
+    assert not cache.etag_matches(cache.make_etag(1), cache.make_etag(2))
+
+
+def test_etag_carries_boot_nonce(cache):
+    etag = cache.make_etag(0)
+    assert etag == '"{}-0"'.format(cache.BOOT_NONCE)
+    # The same version after a reboot, with a new nonce
+    previous_boot = '"{:08x}-0"'.format(int(cache.BOOT_NONCE, 16) ^ 1)
+    assert not cache.etag_matches(previous_boot, etag)
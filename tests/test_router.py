@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Route matching and handler arguments (lite_server/router.py): path
+parameters, literal segments winning over parameters, prefix routes and
+arguments taken from the body or the query string.
+
+@author: jcron
+"""
+import pytest
+
+
+@pytest.fixture(scope='module')
+def router_module(sim_host):
+    from src.lite_server import router
+    return router
+
+
+@pytest.fixture(scope='module')
+def request_module(sim_host):
+    from src.lite_server import request
+    return request
+
+
+def handler(name):
+    def func():
+        return name
+    return func
+
+
+@pytest.fixture
+def router(router_module):
+    router = router_module.Router()
+    router.add('GET', '/rgbcct', handler('rgbcct'))
+    router.add('GET', '/sensor/<sensor_id>/rgbcct', handler('sensor rgbcct'))
+    router.add('GET', '/sensor/<sensor_id>/<reading>', handler('sensor reading'))
+    router.add('GET', '/sensor/0/<reading>', handler('sensor 0 reading'))
+    router.add('GET', '/files/<*path>', handler('files'))
+    router.add('GET', '/files/docs/<*path>', handler('docs'))
+    router.add('POST', '/sensor/<sensor_id>/led', handler('led'))
+    return router
+
+
+def matched(router, method, path):
+    route, params = router.match(method, path)
+    if route is None:
+        return None, None
+    return route.handler(), params
+
+
+def test_static(router):
+    assert matched(router, 'GET', '/rgbcct') == ('rgbcct', {})
+    assert matched(router, 'GET', '/rgbcct/') == ('rgbcct', {})
+
+
+def test_path_params(router):
+    assert matched(router, 'GET', '/sensor/3/lux') == ('sensor reading', {'sensor_id': '3', 'reading': 'lux'})
+    assert matched(router, 'POST', '/sensor/3/led') == ('led', {'sensor_id': '3'})
+    # Routes of another method do not take part
+    assert matched(router, 'GET', '/sensor/3/led') == ('sensor reading', {'sensor_id': '3', 'reading': 'led'})
+
+
+def test_literal_segments_win(router):
+    assert matched(router, 'GET', '/sensor/3/rgbcct') == ('sensor rgbcct', {'sensor_id': '3'})
+    assert matched(router, 'GET', '/sensor/0/lux') == ('sensor 0 reading', {'reading': 'lux'})
+
+
+def test_prefix_routes_longest_first(router):
+    assert matched(router, 'GET', '/files/a/b.txt') == ('files', {'path': 'a/b.txt'})
+    assert matched(router, 'GET', '/files/docs/readme') == ('docs', {'path': 'readme'})
+    assert matched(router, 'GET', '/files') == ('files', {'path': ''})
+
+
+def test_no_match(router):
+    assert matched(router, 'GET', '/sensor/3') == (None, None)
+    assert matched(router, 'GET', '/sensor/3/lux/extra') == (None, None)
+    assert matched(router, 'DELETE', '/rgbcct') == (None, None)
+
+
+def test_routes_added_after_compiling(router):
+    router.compile()
+    router.add('GET', '/status', handler('status'))
+    assert matched(router, 'GET', '/status') == ('status', {})
+
+
+def test_rest_must_be_last(router_module):
+    with pytest.raises(ValueError):
+        router_module.Route('GET', '/files/<*path>/more', handler('files'))
+
+
+def test_arguments(router_module, request_module):
+    def set_led(sensor_id, state, request, brightness=100):
+        pass
+
+    route = router_module.Route('POST', '/sensor/<sensor_id>/led', set_led)
+    params = route.match(['sensor', '2', 'led'])
+
+    request = request_module.Request('POST', '/sensor/2/led?brightness=10', 'HTTP/1.1', {}, {'state': 'on'})
+    kwargs = route.arguments(request, None, params)
+    assert kwargs == {'sensor_id': '2', 'state': 'on', 'request': request, 'brightness': '10'}
+
+    request = request_module.Request('POST', '/sensor/2/led', 'HTTP/1.1', {})
+    with pytest.raises(request_module.RequestError) as error:
+        route.arguments(request, None, params)
+    assert error.value.status == 400
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar sample logs (scripts/sample_log.py): a CSV capture converted to a
+log reads back the same, and a failed conversion is left unfinished.
+
+@author: jcron
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import sample_log  # noqa: E402
+
+ROWS = (
+    'red,green,blue,clear,ct,ct_alt,timestamp',
+    '10,20,30,70,3500.5,None,2019-10-26T18:25:56.123456',
+    '11,21,31,71,None,3400.0,2019-10-26T18:25:57',
+    '12,22,32,72,3600.0,3300.0,2019-10-27T00:00:00.5',
+)
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as file:
+        file.write('\n'.join(rows) + '\n')
+
+
+def test_convert_reads_back(tmp_path):
+    csv_path = str(tmp_path / 'raw.csv')
+    log_path = str(tmp_path / 'raw.tcslog')
+    write_csv(csv_path, ROWS)
+    # A chunk smaller than the capture so more than one is appended
+    assert sample_log.convert_csv(csv_path, log_path, chunk_rows=2) == 3
+
+    log = sample_log.open_log(log_path)
+    assert len(log) == 3
+    assert list(log['red']) == [10, 11, 12]
+    assert list(log['clear']) == [70, 71, 72]
+    assert np.isnan(log['ct'][1]) and np.isnan(log['ct_alt'][0])
+    assert log['ct'][2] == 3600.0
+    assert [str(t) for t in log.datetimes()] == [
+        '2019-10-26T18:25:56.123', '2019-10-26T18:25:57.000', '2019-10-27T00:00:00.500',
+    ]
+
+
+def test_failed_conversion_leaves_no_meta(tmp_path):
+    csv_path = str(tmp_path / 'raw.csv')
+    log_path = str(tmp_path / 'raw.tcslog')
+    write_csv(csv_path, ROWS[:2] + ('13,23,not a number,73,1,1,2019-10-26T18:25:58',))
+    with pytest.raises(ValueError):
+        sample_log.convert_csv(csv_path, log_path, chunk_rows=1)
+
+    assert not os.path.exists(os.path.join(log_path, sample_log.META_FILE))
+    with pytest.raises(OSError):
+        sample_log.open_log(log_path)